@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# Released under the MIT license (2024).
+
+import argparse
+import random
+import re
+import timeit
+from types import SimpleNamespace
+
+import vcf
+from epaa import VEP_FIELDS, parse_annotation_block, resolve_annotation_layouts
+
+parser = argparse.ArgumentParser(
+    "Benchmark the annotation parser of epaa.py against the previous per-entry parsing loop."
+)
+parser.add_argument("-i", "--input", metavar="FILE", type=str, help="SnpEff or VEP annotated VCF file.")
+parser.add_argument(
+    "-f",
+    "--format",
+    choices=["snpeff", "vep"],
+    default="snpeff",
+    help="Annotation format of synthetic records if no input is given.",
+)
+parser.add_argument(
+    "-n",
+    "--num_records",
+    metavar="N",
+    type=int,
+    default=10000,
+    help="Number of synthetic records if no input is given.",
+)
+parser.add_argument(
+    "-a", "--num_annotations", metavar="N", type=int, default=20, help="Number of annotations per synthetic record."
+)
+parser.add_argument("-r", "--repeat", metavar="N", type=int, default=3, help="Number of timing repetitions.")
+args = parser.parse_args()
+
+
+def legacy_parse_snpeff(annotations):
+    rows = []
+    gene = ""
+    isSynonymous = False
+    for annraw in annotations:
+        annots = annraw.split("|")
+        if len(annots) != 16:
+            continue
+        a_mut_type, a_gene_id, transcript_id, trans_coding, prot_coding = (
+            annots[1],
+            annots[4],
+            annots[6],
+            annots[9],
+            annots[10],
+        )
+        tpos = 0
+        ppos = 0
+        isSynonymous = a_mut_type == "synonymous_variant"
+        gene = a_gene_id
+        if trans_coding != "":
+            positions = re.findall(r"\d+", trans_coding)
+            ppos = int(positions[0]) - 1
+        if prot_coding != "":
+            positions = re.findall(r"\d+", prot_coding)
+            tpos = int(positions[0]) - 1
+        if not prot_coding or "stop_gained" in a_mut_type:
+            continue
+        rows.append((transcript_id, ppos, tpos, trans_coding, prot_coding))
+    return rows, gene, isSynonymous
+
+
+def legacy_parse_vep(annotations, vep_fields):
+    rows = []
+    gene = ""
+    isSynonymous = False
+    for annotation in annotations:
+        split_annotation = annotation.split("|")
+        isSynonymous = "synonymous" in split_annotation[vep_fields["consequence"]]
+        gene = split_annotation[vep_fields["gene"]]
+        c_coding = split_annotation[vep_fields["hgvsc"]]
+        p_coding = split_annotation[vep_fields["hgvsp"]]
+        cds_pos = split_annotation[vep_fields["cds_position"]]
+        if cds_pos:
+            ppos = -1
+            split_coding_c = c_coding.split(":")
+            split_coding_p = p_coding.split(":")
+            transcript_id = split_coding_c[0] if split_coding_c[0] else split_annotation[vep_fields["feature"]]
+            transcript_id = transcript_id.split(".")[0]
+            tpos = int(cds_pos.split("/")[0].split("-")[0]) - 1
+            if split_annotation[vep_fields["protein_position"]]:
+                ppos = int(split_annotation[vep_fields["protein_position"]].split("-")[0].split("/")[0]) - 1
+            rows.append((transcript_id, tpos, ppos, split_coding_c[-1], split_coding_p[-1]))
+    return rows, gene, isSynonymous
+
+
+def synthetic_snpeff_annotations(num_records, num_annotations):
+    effects = ["missense_variant", "synonymous_variant", "stop_gained", "upstream_gene_variant"]
+    blocks = []
+    for _ in range(num_records):
+        block = []
+        for a in range(num_annotations):
+            effect = random.choice(effects)
+            cpos = random.randint(1, 5000)
+            hgvs_p = "" if effect == "upstream_gene_variant" else f"p.Lys{cpos // 3 + 1}Arg"
+            block.append(
+                f"G|{effect}|MODERATE|GENE{a}|ENSG{a:011d}|transcript|ENST{a:011d}.1|protein_coding|1/5|"
+                f"c.{cpos}A>G|{hgvs_p}|{cpos}/6000|{cpos}/5000|{cpos // 3 + 1}/1666||"
+            )
+        blocks.append(block)
+    return blocks
+
+
+def synthetic_vep_annotations(num_records, num_annotations):
+    consequences = ["missense_variant", "synonymous_variant", "upstream_gene_variant"]
+    blocks = []
+    for _ in range(num_records):
+        block = []
+        for a in range(num_annotations):
+            consequence = random.choice(consequences)
+            cpos = random.randint(1, 5000)
+            positions = "||" if consequence == "upstream_gene_variant" else f"{cpos}|{cpos}|{cpos // 3 + 1}"
+            block.append(
+                f"G|{consequence}|MODERATE|GENE{a}|ENSG{a:011d}|Transcript|ENST{a:011d}.1|protein_coding|1/5||"
+                f"ENST{a:011d}.1:c.{cpos}A>G|ENSP{a:011d}.1:p.Lys{cpos // 3 + 1}Arg|{positions}|K/R|aAa/aGa|||1|||"
+            )
+        blocks.append(block)
+    return blocks
+
+
+def main():
+    if args.input:
+        with open(args.input) as vcf_file:
+            vcf_reader = vcf.Reader(vcf_file)
+            layout_infos = vcf_reader.infos
+            key = "ANN" if "ANN" in vcf_reader.infos else "CSQ"
+            blocks = [record.INFO[key] for record in vcf_reader if record.INFO.get(key, False)]
+    elif args.format == "vep":
+        key = "CSQ"
+        layout_infos = {"CSQ": SimpleNamespace(desc="Format: " + "|".join(f.upper() for f in VEP_FIELDS))}
+        blocks = synthetic_vep_annotations(args.num_records, args.num_annotations)
+    else:
+        key = "ANN"
+        layout_infos = {}
+        blocks = synthetic_snpeff_annotations(args.num_records, args.num_annotations)
+
+    layout = resolve_annotation_layouts(layout_infos)[key]
+
+    if key == "ANN":
+        legacy = lambda: [legacy_parse_snpeff(block) for block in blocks]
+    else:
+        vep_fields = dict(VEP_FIELDS)
+        if "CSQ" in layout_infos:
+            vep_fields.update(
+                {
+                    field.strip().lower(): idx
+                    for idx, field in enumerate(layout_infos["CSQ"].desc.split()[-1].split("|"))
+                }
+            )
+        legacy = lambda: [legacy_parse_vep(block, vep_fields) for block in blocks]
+    compiled = lambda: [parse_annotation_block(block, layout) for block in blocks]
+
+    # both parsers have to agree on all annotations that are used downstream
+    for legacy_result, compiled_result in zip(legacy(), compiled()):
+        if legacy_result != compiled_result:
+            raise ValueError("Annotation parsers disagree, aborting benchmark.")
+
+    num_annotations = sum(len(block) for block in blocks)
+    # alternate the parsers, so that both are timed under the same system load
+    times = [(timeit.timeit(legacy, number=1), timeit.timeit(compiled, number=1)) for _ in range(args.repeat)]
+    legacy_time, compiled_time = map(min, zip(*times))
+    print(f"records: {len(blocks)}, annotations: {num_annotations} ({key})")
+    print(f"legacy loop:       {legacy_time:.3f} s")
+    print(f"annotation parser: {compiled_time:.3f} s")
+    print(f"speedup:           {legacy_time / compiled_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
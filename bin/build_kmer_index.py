@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# Released under the MIT license (2024).
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+from Bio import SeqIO
+
+# instantiate global logger object
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.DEBUG)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+KMER_INDEX_FILE = "kmer_index.json"
+
+# residues are encoded as 1-26, everything else separates k-mers
+RESIDUE_CODES = np.zeros(256, dtype=np.uint64)
+RESIDUE_CODES[np.frombuffer(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ", dtype=np.uint8)] = np.arange(1, 27, dtype=np.uint64)
+
+# k-mers are hashed to 64 bit (polynomial hash modulo 2^64), false positives are negligible for proteome sized inputs
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def read_proteome(proteome):
+    """
+    reads the protein sequences of a reference proteome
+    :param str proteome: FASTA file or directory with FASTA files (.fasta/.fsa)
+    :return: generator of protein sequences
+    """
+    if os.path.isdir(proteome):
+        files = [
+            os.path.join(proteome, filename)
+            for filename in sorted(os.listdir(proteome))
+            if filename.endswith(".fasta") or filename.endswith(".fsa")
+        ]
+    else:
+        files = [proteome]
+    for filename in files:
+        for record in SeqIO.parse(filename, "fasta"):
+            yield str(record.seq).upper()
+
+
+def hash_kmers(codes, length):
+    """
+    hashes all k-mers of the given length of encoded sequences, k-mers that contain a separator are dropped
+    :param codes: numpy array of residue codes (see RESIDUE_CODES)
+    :param int length: k-mer length
+    :return: numpy array of 64 bit k-mer hashes
+    """
+    num_kmers = len(codes) - length + 1
+    if num_kmers <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    hashes = np.zeros(num_kmers, dtype=np.uint64)
+    for offset in range(length):
+        hashes = hashes * HASH_MULTIPLIER + codes[offset : offset + num_kmers]
+    separators = np.concatenate([[0], np.cumsum(codes == 0)])
+    return hashes[separators[length : length + num_kmers] == separators[:num_kmers]]
+
+
+def hash_peptides(sequences, length):
+    """
+    hashes peptide sequences of the same length like hash_kmers
+    :param list sequences: peptide sequences of the given length
+    :param int length: peptide length
+    :return: numpy array of 64 bit peptide hashes
+    """
+    codes = RESIDUE_CODES[np.frombuffer("".join(sequences).encode(), dtype=np.uint8)].reshape(len(sequences), length)
+    hashes = np.zeros(len(sequences), dtype=np.uint64)
+    for offset in range(length):
+        hashes = hashes * HASH_MULTIPLIER + codes[:, offset]
+    return hashes
+
+
+def load_kmer_index(directory):
+    """
+    opens a k-mer index written by this script, the hash arrays are memory mapped
+    :param str directory: k-mer index directory
+    :return: dictionary with the sorted k-mer hashes of each length
+    """
+    with open(os.path.join(directory, KMER_INDEX_FILE)) as index_file:
+        lengths = json.load(index_file)["lengths"]
+    return {length: np.load(os.path.join(directory, f"kmers_{length}.npy"), mmap_mode="r") for length in lengths}
+
+
+def contains_kmers(kmer_index, sequences):
+    """
+    checks which peptide sequences occur in the indexed proteome
+    :param dict kmer_index: k-mer index (see load_kmer_index)
+    :param list sequences: peptide sequences of one length contained in the index
+    :return: numpy array of booleans
+    """
+    if not sequences:
+        return np.zeros(0, dtype=bool)
+    kmers = kmer_index[len(sequences[0])]
+    hashes = hash_peptides(sequences, len(sequences[0]))
+    positions = np.minimum(np.searchsorted(kmers, hashes), max(len(kmers) - 1, 0))
+    return (kmers[positions] == hashes) if len(kmers) else np.zeros(len(sequences), dtype=bool)
+
+
+def __main__():
+    parser = argparse.ArgumentParser(
+        description="Build a k-mer index of a reference proteome for self-peptide filtering with epaa.py."
+    )
+    parser.add_argument(
+        "-i", "--input", help="Reference proteome (FASTA file or directory with FASTA files)", required=True
+    )
+    parser.add_argument("-o", "--output", help="Output directory of the k-mer index", required=True)
+    parser.add_argument("-ml", "--min_length", help="Minimum peptide length", type=int, default=8)
+    parser.add_argument("-l", "--max_length", help="Maximum peptide length", type=int, default=11)
+    args = parser.parse_args()
+
+    sequences = list(read_proteome(args.input))
+    logger.info(f"Read {len(sequences)} protein sequences from {args.input}")
+    codes = RESIDUE_CODES[np.frombuffer("\n".join(sequences).encode(), dtype=np.uint8)]
+
+    os.makedirs(args.output, exist_ok=True)
+    lengths = list(range(args.min_length, args.max_length + 1))
+    for length in lengths:
+        kmers = np.unique(hash_kmers(codes, length))
+        np.save(os.path.join(args.output, f"kmers_{length}.npy"), kmers)
+        logger.info(f"Indexed {len(kmers)} unique {length}-mers")
+
+    # the index description is written last, an index without it is incomplete
+    with open(os.path.join(args.output, KMER_INDEX_FILE), "w") as index_file:
+        json.dump({"lengths": lengths, "proteins": len(sequences), "hash": "polynomial-uint64"}, index_file)
+
+
+if __name__ == "__main__":
+    __main__()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Released under the MIT license (2024).
+
+import argparse
+import csv
+import gzip
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+
+from Bio import SeqIO
+
+# instantiate global logger object
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.DEBUG)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+REFERENCE_INDEX_FILE = "reference.json"
+ID_TABLE_COLUMNS = ["transcript_id", "gene_id", "gene_name", "strand", "protein_id"]
+
+GTF_ATTRIBUTE = re.compile(r'(\S+) "([^"]*)"')
+
+
+def open_file(filename):
+    return gzip.open(filename, "rt") if filename.endswith(".gz") else open(filename)
+
+
+def strip_version(identifier):
+    return identifier.partition(".")[0]
+
+
+def read_gtf_ids(gtf):
+    """
+    reads transcript, gene and protein IDs and the strand of all transcripts from a GTF file (Ensembl format)
+    :param str gtf: GTF file, optionally gzipped
+    :return: dictionary with one dictionary of ID_TABLE_COLUMNS per transcript ID (without version)
+    """
+    transcripts = {}
+    with open_file(gtf) as gtf_file:
+        for line in gtf_file:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9 or fields[2] not in ["transcript", "CDS"]:
+                continue
+            attributes = dict(GTF_ATTRIBUTE.findall(fields[8]))
+            if "transcript_id" not in attributes:
+                continue
+            transcript_id = strip_version(attributes["transcript_id"])
+            entry = transcripts.setdefault(
+                transcript_id,
+                {
+                    "transcript_id": transcript_id,
+                    "gene_id": strip_version(attributes.get("gene_id", "")),
+                    "gene_name": attributes.get("gene_name", ""),
+                    "strand": fields[6],
+                    "protein_id": "",
+                },
+            )
+            if "protein_id" in attributes:
+                entry["protein_id"] = strip_version(attributes["protein_id"])
+    return transcripts
+
+
+def write_indexed_fasta(sequence_file, output):
+    """
+    writes the sequences of a FASTA file with one line per sequence and IDs without version,
+    together with a samtools-style .fai index
+    :param str sequence_file: FASTA file, optionally gzipped
+    :param str output: output FASTA file, the index is written to output.fai
+    :return: number of written sequences
+    """
+    num_sequences = 0
+    offset = 0
+    with open_file(sequence_file) as fasta_in, open(output, "w") as fasta_out, open(f"{output}.fai", "w") as fai:
+        for record in SeqIO.parse(fasta_in, "fasta"):
+            identifier = strip_version(record.id)
+            sequence = str(record.seq)
+            header = f">{identifier}\n"
+            fasta_out.write(header + sequence + "\n")
+            fai.write(f"{identifier}\t{len(sequence)}\t{offset + len(header)}\t{len(sequence)}\t{len(sequence) + 1}\n")
+            offset += len(header) + len(sequence) + 1
+            num_sequences += 1
+    return num_sequences
+
+
+def read_fasta_index(fai):
+    """
+    reads a samtools-style .fai index of a FASTA file with one line per sequence
+    :param str fai: .fai file
+    :return: dictionary with (offset, length) of each sequence ID
+    """
+    with open(fai) as fai_file:
+        return {row[0]: (int(row[2]), int(row[1])) for row in csv.reader(fai_file, delimiter="\t")}
+
+
+def open_sequences(fasta):
+    """
+    memory maps a FASTA file written by write_indexed_fasta
+    :param str fasta: FASTA file
+    :return: memory map of the file and its index (see read_fasta_index)
+    """
+    with open(fasta, "rb") as fasta_file:
+        sequences = mmap.mmap(fasta_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return sequences, read_fasta_index(f"{fasta}.fai")
+
+
+def __main__():
+    parser = argparse.ArgumentParser(
+        description="Build a local reference for offline transcript and protein lookups with epaa.py."
+    )
+    parser.add_argument("-t", "--transcripts", help="Coding sequences (FASTA, e.g. Ensembl cds.all.fa)", required=True)
+    parser.add_argument("-p", "--proteins", help="Protein sequences (FASTA, e.g. Ensembl pep.all.fa)", required=True)
+    parser.add_argument("-g", "--gtf", help="Gene annotation (GTF) of the same release", required=True)
+    parser.add_argument("-o", "--output", help="Output directory of the local reference", required=True)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+
+    transcripts = read_gtf_ids(args.gtf)
+    with open(os.path.join(args.output, "ids.tsv"), "w") as ids_file:
+        writer = csv.DictWriter(ids_file, fieldnames=ID_TABLE_COLUMNS, delimiter="\t")
+        writer.writeheader()
+        writer.writerows(transcripts.values())
+    logger.info(f"Wrote IDs of {len(transcripts)} transcripts")
+
+    for name, sequence_file in [("transcripts", args.transcripts), ("proteins", args.proteins)]:
+        num_sequences = write_indexed_fasta(sequence_file, os.path.join(args.output, f"{name}.fa"))
+        logger.info(f"Indexed {num_sequences} {name}")
+
+    # the reference description is written last, a reference without it is incomplete
+    with open(os.path.join(args.output, REFERENCE_INDEX_FILE), "w") as reference_file:
+        json.dump(
+            {
+                "transcripts": "transcripts.fa",
+                "proteins": "proteins.fa",
+                "ids": "ids.tsv",
+                "sources": [os.path.basename(f) for f in [args.transcripts, args.proteins, args.gtf]],
+            },
+            reference_file,
+        )
+
+
+if __name__ == "__main__":
+    __main__()
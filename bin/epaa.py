@@ -2,28 +2,53 @@
 # Written by Christopher Mohr and released under the MIT license (2022).
 
 import argparse
+import array
+import contextlib
 import csv
+import importlib
 import itertools
 import json
 import logging
 import math
+import multiprocessing
+import operator
 import os
+import pkgutil
 import re
+import sqlite3
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from types import SimpleNamespace
 
 import epytope.Core.Generator as generator
+import epytope.Data.pssms.syfpeithi.mat as syfpeithi_matrices
 import numpy as np
 import pandas as pd
 import vcf
 from Bio import SeqUtils
+from build_kmer_index import KMER_INDEX_FILE, contains_kmers, load_kmer_index
+from build_reference_index import REFERENCE_INDEX_FILE, open_sequences
 from epytope.Core.Allele import Allele
 from epytope.Core.Peptide import Peptide
+from epytope.Core.Result import EpitopePredictionResult
+from epytope.Core.Transcript import Transcript
 from epytope.Core.Variant import MutationSyntax, Variant, VariationType
-from epytope.EpitopePrediction import EpitopePredictorFactory
-from epytope.IO.ADBAdapter import EIdentifierTypes
+from epytope.EpitopePrediction import ANN, EpitopePredictorFactory
+from epytope.IO.ADBAdapter import ADBAdapter, EAdapterFields, EIdentifierTypes
 from epytope.IO.MartsAdapter import MartsAdapter
 from epytope.IO.UniProtAdapter import UniProtDB
+from merge_results import (
+    OUTPUT_FORMATS,
+    check_columnar_support,
+    get_result_schema,
+    open_parquet_writer,
+    to_result_table,
+    write_prediction_results,
+)
+from report_sketches import SEQUENCE_SET_KEYS, SKETCH_TYPES, create_sketch
 
 __author__ = "Christopher Mohr"
 VERSION = "1.1"
@@ -39,9 +64,22 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 ID_SYSTEM_USED = EIdentifierTypes.ENSEMBL
-transcriptProteinTable = {}
 transcriptSwissProtMap = {}
 
+# predictors are built once per process and reused for all peptide lengths and batches
+PREDICTORS = {}
+PREDICTOR_TIMINGS = {}
+prediction_pool = None
+
+# optional on-disk cache of prediction scores, the connection is opened once per process
+PREDICTION_CACHE = {"path": None, "max_bytes": 0, "connection": None, "pid": None}
+PREDICTION_CACHE_COUNTS = {"hits": 0, "misses": 0}
+# file systems on which SQLite file locking is not reliable, the prediction cache is disabled there
+NETWORK_FILESYSTEMS = ["nfs", "nfs4", "lustre", "cifs", "smbfs", "smb3", "gpfs", "beegfs", "ceph", "fuse.sshfs"]
+
+# maximum score of each SYFPEITHI matrix shipped with epytope, filled on first use
+SYFPEITHI_MAX_SCORES = {}
+
 
 def get_epytope_annotation(vt, p, r, alt):
     if vt == VariationType.SNP:
@@ -86,6 +124,26 @@ def determine_variant_type(record, alternative):
     return vt
 
 
+def parse_wild_type_residue(vt, aa_mutation_syntax):
+    """
+    parses the wild type residue of a coding variant once, to restore wild type sequences of mutated peptides
+    :param vt: epytope variation type
+    :param str aa_mutation_syntax: protein change (HGVS.p), e.g. p.Lys41Arg
+    :return: tuple of wild type residue (one letter code) and whether it is inserted (deletion) or replaced,
+             None if the wild type can not be restored (insertions, frameshifts and unknown changes)
+    """
+    if vt in [VariationType.INS, VariationType.FSDEL, VariationType.FSINS, VariationType.UNKNOWN]:
+        return None
+    if "?" in aa_mutation_syntax or "." not in aa_mutation_syntax:
+        return None
+    change = aa_mutation_syntax.split(".")[1]
+    if vt == VariationType.DEL:
+        m = AA_DELETION.match(change)
+        return (SeqUtils.seq1(m.groups()[0]), True) if m is not None else None
+    m = AA_SUBSTITUTION.match(change)
+    return (SeqUtils.seq1(m.groups()[0]), False) if m is not None else None
+
+
 def determine_zygosity(record):
     genotye_dict = {"het": False, "hom": True, "ref": True}
     isHomozygous = False
@@ -107,190 +165,329 @@ def determine_zygosity(record):
     return isHomozygous
 
 
-def read_vcf(filename, pass_only=True):
+# SnpEff ANN fields: Allele | Annotation | Annotation_Impact | Gene_Name | Gene_ID | Feature_Type | Feature_ID |
+# Transcript_BioType | Rank | HGVS.c | HGVS.p | cDNA.pos / cDNA.length | CDS.pos / CDS.length | AA.pos / AA.length |
+# Distance | ERRORS / WARNINGS / INFO
+SNPEFF_FIELDS = {"annotation": 1, "gene_id": 4, "feature_id": 6, "hgvs.c": 9, "hgvs.p": 10}
+SNPEFF_NUM_FIELDS = 16
+
+# default VEP CSQ fields, used if the VCF header does not define the CSQ format
+VEP_FIELDS = {
+    "allele": 0,
+    "consequence": 1,
+    "impact": 2,
+    "symbol": 3,
+    "gene": 4,
+    "feature_type": 5,
+    "feature": 6,
+    "biotype": 7,
+    "exon": 8,
+    "intron": 9,
+    "hgvsc": 10,
+    "hgvsp": 11,
+    "cdna_position": 12,
+    "cds_position": 13,
+    "protein_position": 14,
+    "amino_acids": 15,
+    "codons": 16,
+    "existing_variation": 17,
+    "distance": 18,
+    "strand": 19,
+    "flags": 20,
+    "symbol_source": 21,
+    "hgnc_id": 22,
+}
+
+# first number of a HGVS string, e.g. 123 for c.123A>G or 41 for p.Lys41Arg
+HGVS_POSITION = re.compile(r"\D*(\d*)")
+
+# reference amino acid(s) and position of a protein change, e.g. Lys41Arg (substitution) or Lys41 (deletion)
+AA_SUBSTITUTION = re.compile("([a-zA-Z]+)([0-9]+)([a-zA-Z]+)")
+AA_DELETION = re.compile("([a-zA-Z]+)([0-9]+)")
+
+# prediction methods that use the same models for all peptide lengths and can be queried with mixed-length batches
+CROSS_LENGTH_METHODS = ["mhcflurry", "mhcnuggets-class-1", "mhcnuggets-class-2"]
+
+# rough memory footprint of one haplotype per transcript nucleotide (transcript, protein and peptide sequences)
+HAPLOTYPE_BYTES_PER_BASE = 2
+
+# provenance columns of peptides derived from variants
+PEPTIDE_ANNOTATION_COLUMNS = [
+    "chr",
+    "pos",
+    "gene",
+    "transcripts",
+    "variant type",
+    "synonymous",
+    "homozygous",
+    "variant details (genomic)",
+    "variant details (protein)",
+]
+
+
+def resolve_annotation_layouts(infos):
     """
-    reads vcf files
-    returns a list of epytope variants
+    resolves the field layout of SnpEff (ANN) and VEP (CSQ) annotations once from the VCF header
+    :param dict infos: INFO definitions of the VCF header (vcf.Reader.infos)
+    :return: dictionary with the layout for the ANN and CSQ INFO keys
+    """
+    vep_fields = dict(VEP_FIELDS)
+    vep_header_available = "CSQ" in infos
+    if vep_header_available:
+        vep_def = infos["CSQ"].desc.split()[-1].split("|")
+        for idx, field in enumerate(vep_def):
+            vep_fields[field.strip().lower()] = idx
+    vep_indices = [
+        vep_fields[name]
+        for name in ["consequence", "gene", "feature", "hgvsc", "hgvsp", "cds_position", "protein_position"]
+    ]
+
+    return {
+        "ANN": {
+            "type": "snpeff",
+            "num_fields": SNPEFF_NUM_FIELDS,
+            "indices": list(SNPEFF_FIELDS.values()),
+            "get_fields": operator.itemgetter(*SNPEFF_FIELDS.values()),
+            "from_header": False,
+        },
+        "CSQ": {
+            "type": "vep",
+            "num_fields": max(vep_indices) + 1,
+            "indices": vep_indices,
+            # consequence and gene are only read from the last entry of a record
+            "get_fields": operator.itemgetter(*vep_indices[2:]),
+            "from_header": vep_header_available,
+        },
+    }
+
+
+def parse_annotation_block(annotations, layout):
+    """
+    parses all SnpEff/VEP annotation entries of one record into its coding annotations
+    each entry is split once and the used fields are taken with one itemgetter, positions are extracted with
+    precompiled patterns
+    :param list annotations: annotation entries (strings) of one INFO field
+    :param dict layout: annotation layout (see resolve_annotation_layouts)
+    :return: list of (transcript ID, cds position, protein position, HGVS c., HGVS p.) tuples, gene and synonymous
+             status of the last annotation entry
+    """
+    if layout["type"] == "vep":
+        rows, last_entry = parse_vep_entries(annotations, layout)
+    else:
+        rows, last_entry = parse_snpeff_entries(annotations, layout)
+    if last_entry is None:
+        return rows, "", False
+    consequence_index, gene_index = layout["indices"][:2]
+    if layout["type"] == "vep":
+        return rows, last_entry[gene_index], "synonymous" in last_entry[consequence_index]
+    return rows, last_entry[gene_index], last_entry[consequence_index] == "synonymous_variant"
+
+
+def log_omitted_annotation():
+    logger.warning(
+        "read_vcf: Omitted row! Mandatory columns not present in annotation field. \n Have you annotated your VCF file with SnpEff or VEP?"
+    )
+
+
+def parse_snpeff_entries(annotations, layout):
+    """
+    :param list annotations: annotation entries (strings) of one ANN INFO field
+    :param dict layout: annotation layout (see resolve_annotation_layouts)
+    :return: coding annotations (see parse_annotation_block) and the fields of the last valid entry
+    """
+    get_fields = layout["get_fields"]
+    num_fields = layout["num_fields"]
+    rows = []
+    last_entry = None
+    for entry in annotations:
+        split_entry = entry.split("|")
+        if len(split_entry) != num_fields:
+            log_omitted_annotation()
+            continue
+        last_entry = split_entry
+        annotation, _, transcript_id, hgvs_c, hgvs_p = get_fields(split_entry)
+        # take only coding variants into account, epytope cannot deal with stop gain variants right now
+        if not hgvs_p or "stop_gained" in annotation:
+            continue
+        cds_position = HGVS_POSITION.match(hgvs_c).group(1)
+        protein_position = HGVS_POSITION.match(hgvs_p).group(1)
+        rows.append(
+            (
+                transcript_id,
+                int(cds_position) - 1 if cds_position else 0,
+                int(protein_position) - 1 if protein_position else 0,
+                hgvs_c,
+                hgvs_p,
+            )
+        )
+    return rows, last_entry
+
+
+def parse_vep_entries(annotations, layout):
+    """
+    :param list annotations: annotation entries (strings) of one CSQ INFO field
+    :param dict layout: annotation layout (see resolve_annotation_layouts)
+    :return: coding annotations (see parse_annotation_block) and the fields of the last valid entry
+    """
+    get_fields = layout["get_fields"]
+    num_fields = layout["num_fields"]
+    rows = []
+    last_entry = None
+    for entry in annotations:
+        # fields after the last used one are not split
+        split_entry = entry.split("|", num_fields)
+        if len(split_entry) < num_fields:
+            log_omitted_annotation()
+            continue
+        last_entry = split_entry
+        feature, hgvs_c, hgvs_p, cds_position, protein_position = get_fields(split_entry)
+        if not cds_position:
+            continue
+        # not sure yet if this is always the case
+        cds_position = cds_position.partition("-")[0].partition("/")[0]
+        if not cds_position.isdigit():
+            continue
+        protein_position = protein_position.partition("-")[0].partition("/")[0]
+        split_hgvs_c = hgvs_c.split(":")
+        rows.append(
+            (
+                # we still need the new functionality here in epytope to query with IDs with version (ENTxxx.x)
+                (split_hgvs_c[0] or feature).partition(".")[0],
+                int(cds_position) - 1,
+                int(protein_position) - 1 if protein_position.isdigit() else -1,
+                split_hgvs_c[-1],
+                hgvs_p.rpartition(":")[2],
+            )
+        )
+    return rows, last_entry
+
+
+class VariantMetadata:
+    """
+    columnar store of the (meta)data of variants (INFO fields and FORMAT values per sample), keyed by variant ID
+    values are dictionary-encoded per column: each distinct value is kept once and rows hold integer codes
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.codes = {}
+        self.categories = {}
+
+    @property
+    def columns(self):
+        return list(self.codes)
+
+    def add(self, variant_id, values):
+        """
+        adds the (meta)data of one variant
+        :param str variant_id: variant ID
+        :param dict values: value of each (meta)data column, converted to strings
+        """
+        row = self.rows.setdefault(variant_id, len(self.rows))
+        for name, value in values.items():
+            categories = self.categories.setdefault(name, {})
+            codes = self.codes.setdefault(name, array.array("i"))
+            codes.extend([-1] * (row + 1 - len(codes)))
+            codes[row] = categories.setdefault(str(value), len(categories))
+
+    def to_frame(self, variant_ids):
+        """
+        decodes the (meta)data of the given variants
+        :param list variant_ids: variant IDs
+        :return: DataFrame indexed by variant ID with one categorical column per (meta)data column
+        """
+        variant_ids = [v for v in dict.fromkeys(variant_ids) if v in self.rows]
+        rows = np.array([self.rows[v] for v in variant_ids], dtype=np.int64)
+        columns = {}
+        for name, codes in self.codes.items():
+            # rows added after the last value of a column are missing in its codes
+            codes = np.concatenate(
+                [np.frombuffer(codes, dtype=np.int32), np.full(len(self.rows) - len(codes), -1, dtype=np.int32)]
+            )
+            columns[name] = pd.Categorical.from_codes(codes[rows], categories=list(self.categories[name]))
+        return pd.DataFrame(columns, index=pd.Index(variant_ids, name="variant_id"))
+
+
+def iter_vcf_variants(filename, pass_only=True, variant_metadata=None):
+    """
+    reads vcf files record by record
+    yields epytope variants as soon as they are parsed
     :param filename: /path/to/file
     :param boolean pass_only: only consider variants that passed the filter (default: True)
-    :return: list of epytope variants
+    :param VariantMetadata variant_metadata: store that is filled with the (meta)data of all variants
+    :return: generator of epytope variants
     """
     global ID_SYSTEM_USED
 
-    vep_header_available = False
-    # default VEP fields
-    vep_fields = {
-        "allele": 0,
-        "consequence": 1,
-        "impact": 2,
-        "symbol": 3,
-        "gene": 4,
-        "feature_type": 5,
-        "feature": 6,
-        "biotype": 7,
-        "exon": 8,
-        "intron": 9,
-        "hgvsc": 10,
-        "hgvsp": 11,
-        "cdna_position": 12,
-        "cds_position": 13,
-        "protein_position": 14,
-        "amino_acids": 15,
-        "codons": 16,
-        "existing_variation": 17,
-        "distance": 18,
-        "strand": 19,
-        "flags": 20,
-        "symbol_source": 21,
-        "hgnc_id": 22,
-    }
-
     VEP_KEY = "CSQ"
     SNPEFF_KEY = "ANN"
 
-    variants = list()
+    if variant_metadata is None:
+        variant_metadata = VariantMetadata()
+
     with open(filename) as tsvfile:
         vcf_reader = vcf.Reader(tsvfile)
-        variants = [r for r in vcf_reader]
 
-    # list of mandatory (meta)data
-    exclusion_list = ["ANN", "CSQ"]
+        # list of mandatory (meta)data
+        exclusion_list = ["ANN", "CSQ"]
 
-    # DB identifier of variants
-    inclusion_list = ["vardbid"]
+        # DB identifier of variants
+        inclusion_list = ["vardbid"]
 
-    # determine format of given VEP annotation
-    if VEP_KEY in vcf_reader.infos:
-        split_vep_def = vcf_reader.infos[VEP_KEY]
-        for idx, field in enumerate(split_vep_def.desc.split()[-1].split("|")):
-            vep_fields[field.strip().lower()] = idx
-        vep_header_available = True
+        # determine format of given SnpEff/VEP annotation once
+        annotation_layouts = resolve_annotation_layouts(vcf_reader.infos)
 
-    # get lists of additional metadata
-    metadata_list = set(vcf_reader.infos.keys()) - set(exclusion_list)
-    metadata_list.update(set(inclusion_list))
-    format_list = set(vcf_reader.formats.keys())
-    final_metadata_list = []
+        # get lists of additional metadata
+        metadata_list = set(vcf_reader.infos.keys()) - set(exclusion_list)
+        metadata_list.update(set(inclusion_list))
+        format_list = set(vcf_reader.formats.keys())
 
-    dict_vars = {}
-    list_vars = []
-    transcript_ids = []
+        for num, record in enumerate(vcf_reader):
+            chromosome = record.CHROM.strip("chr")
+            genomic_position = record.POS
+            variation_dbid = record.ID
+            reference = str(record.REF)
+            alternative_list = record.ALT
+            record_filter = record.FILTER
 
-    for num, record in enumerate(variants):
-        chromosome = record.CHROM.strip("chr")
-        genomic_position = record.POS
-        variation_dbid = record.ID
-        reference = str(record.REF)
-        alternative_list = record.ALT
-        record_filter = record.FILTER
+            if pass_only and record_filter:
+                continue
 
-        if pass_only and record_filter:
-            continue
+            """
+            Enum for variation types:
+            type.SNP, type.DEL, type.INS, type.FSDEL, type.FSINS, type.UNKNOWN
 
-        """
-        Enum for variation types:
-        type.SNP, type.DEL, type.INS, type.FSDEL, type.FSINS, type.UNKNOWN
+            VARIANT INCORP IN EPYTOPE
 
-        VARIANT INCORP IN EPYTOPE
+            SNP => seq[pos] = OBS (replace)
+            INSERTION => seqp[pos:pos] = obs (insert at that position)
+            DELETION => s = slice(pos, pos+len(ref)) (create slice that will be removed) del seq[s] (remove)
+            """
+            # check if we have SNPEFF or VEP annotated variants, otherwise abort
+            if record.INFO.get(SNPEFF_KEY, False):
+                annotations, gene, isSynonymous = parse_annotation_block(
+                    record.INFO[SNPEFF_KEY], annotation_layouts[SNPEFF_KEY]
+                )
+                # with the latest epytope release (3.3.1), we can now handle full transcript IDs
+                if any("NM" in annotation[0] for annotation in annotations):
+                    ID_SYSTEM_USED = EIdentifierTypes.REFSEQ
+            elif record.INFO.get(VEP_KEY, False):
+                if not annotation_layouts[VEP_KEY]["from_header"]:
+                    logger.warning("No CSQ definition found in header, trying to map to default VEP format string.")
+                annotations, gene, isSynonymous = parse_annotation_block(
+                    record.INFO[VEP_KEY], annotation_layouts[VEP_KEY]
+                )
+            else:
+                logger.error("No supported variant annotation string found. Aborting.")
+                sys.exit(
+                    "No supported variant annotation string found. Input VCFs require annotation with SNPEff or VEP prior to running the epitope prediction pipeline."
+                )
 
-        SNP => seq[pos] = OBS (replace)
-        INSERTION => seqp[pos:pos] = obs (insert at that position)
-        DELETION => s = slice(pos, pos+len(ref)) (create slice that will be removed) del seq[s] (remove)
-        """
-        for alt in alternative_list:
-            isHomozygous = determine_zygosity(record)
-            vt = determine_variant_type(record, alt)
+            for alt in alternative_list:
+                isHomozygous = determine_zygosity(record)
+                vt = determine_variant_type(record, alt)
 
-            # check if we have SNPEFF or VEP annotated variants, otherwise abort
-            if record.INFO.get(SNPEFF_KEY, False) or record.INFO.get(VEP_KEY, False):
-                isSynonymous = False
-                coding = dict()
-                types = []
-                # SNPEFF annotation
-                if SNPEFF_KEY in record.INFO:
-                    for annraw in record.INFO[SNPEFF_KEY]:
-                        annots = annraw.split("|")
-                        if len(annots) != 16:
-                            logger.warning(
-                                "read_vcf: Omitted row! Mandatory columns not present in annotation field (ANN). \n Have you annotated your VCF file with SnpEff?"
-                            )
-                            continue
-                        (
-                            obs,
-                            a_mut_type,
-                            impact,
-                            a_gene,
-                            a_gene_id,
-                            feature_type,
-                            transcript_id,
-                            exon,
-                            tot_exon,
-                            trans_coding,
-                            prot_coding,
-                            cdna,
-                            cds,
-                            aa,
-                            distance,
-                            warnings,
-                        ) = annots
-                        types.append(a_mut_type)
-                        tpos = 0
-                        ppos = 0
-                        positions = ""
-                        isSynonymous = a_mut_type == "synonymous_variant"
-                        gene = a_gene_id
-
-                        # get cds/protein positions and convert mutation syntax to epytope format
-                        if trans_coding != "":
-                            positions = re.findall(r"\d+", trans_coding)
-                            ppos = int(positions[0]) - 1
-
-                        if prot_coding != "":
-                            positions = re.findall(r"\d+", prot_coding)
-                            tpos = int(positions[0]) - 1
-
-                        # with the latest epytope release (3.3.1), we can now handle full transcript IDs
-                        if "NM" in transcript_id:
-                            ID_SYSTEM_USED = EIdentifierTypes.REFSEQ
-
-                        # take online coding variants into account, epytope cannot deal with stop gain variants right now
-                        if not prot_coding or "stop_gained" in a_mut_type:
-                            continue
-
-                        coding[transcript_id] = MutationSyntax(transcript_id, ppos, tpos, trans_coding, prot_coding)
-                        transcript_ids.append(transcript_id)
-                else:
-                    if not vep_header_available:
-                        logger.warning("No CSQ definition found in header, trying to map to default VEP format string.")
-                    for annotation in record.INFO[VEP_KEY]:
-                        split_annotation = annotation.split("|")
-                        isSynonymous = "synonymous" in split_annotation[vep_fields["consequence"]]
-                        gene = split_annotation[vep_fields["gene"]]
-                        c_coding = split_annotation[vep_fields["hgvsc"]]
-                        p_coding = split_annotation[vep_fields["hgvsp"]]
-                        cds_pos = split_annotation[vep_fields["cds_position"]]
-                        # not sure yet if this is always the case
-                        if cds_pos:
-                            ppos = -1
-                            prot_coding = ""
-                            split_coding_c = c_coding.split(":")
-                            split_coding_p = p_coding.split(":")
-                            # we still need the new functionality here in epytope to query with IDs with version (ENTxxx.x)
-                            transcript_id = (
-                                split_coding_c[0] if split_coding_c[0] else split_annotation[vep_fields["feature"]]
-                            )
-                            transcript_id = transcript_id.split(".")[0]
-                            tpos = int(cds_pos.split("/")[0].split("-")[0]) - 1
-                            if split_annotation[vep_fields["protein_position"]]:
-                                ppos = (
-                                    int(split_annotation[vep_fields["protein_position"]].split("-")[0].split("/")[0])
-                                    - 1
-                                )
-
-                            coding[transcript_id] = MutationSyntax(
-                                transcript_id, tpos, ppos, split_coding_c[-1], split_coding_p[-1]
-                            )
-                            transcript_ids.append(transcript_id)
+                coding = {annotation[0]: MutationSyntax(*annotation) for annotation in annotations}
                 if coding:
                     pos, reference, alternative = get_epytope_annotation(vt, genomic_position, reference, str(alt))
                     var = Variant(
@@ -305,73 +502,159 @@ def read_vcf(filename, pass_only=True):
                         isSynonymous,
                     )
                     var.gene = gene
-                    var.log_metadata("vardbid", variation_dbid)
-                    final_metadata_list.append("vardbid")
-                    for metadata_name in metadata_list:
-                        if metadata_name in record.INFO:
-                            final_metadata_list.append(metadata_name)
-                            var.log_metadata(metadata_name, record.INFO[metadata_name])
-                    for sample in record.samples:
-                        for format_key in format_list:
-                            if getattr(sample.data, format_key, None) is None:
-                                logger.warning(
-                                    f"FORMAT entry {format_key} not defined for {sample.sample}. Skipping."
-                                )
-                                continue
-                            format_header = f"{sample.sample}.{format_key}"
-                            final_metadata_list.append(format_header)
-                            if isinstance(sample[format_key], list):
-                                format_value = ",".join([str(i) for i in sample[format_key]])
-                            else:
-                                format_value = sample[format_key]
-                            var.log_metadata(format_header, format_value)
-                    dict_vars[var] = var
-                    list_vars.append(var)
-            else:
-                logger.error("No supported variant annotation string found. Aborting.")
-                sys.exit(
-                    "No supported variant annotation string found. Input VCFs require annotation with SNPEff or VEP prior to running the epitope prediction pipeline."
+                    var.wild_type_residues = {
+                        transcript_id: parse_wild_type_residue(vt, syntax.aaMutationSyntax)
+                        for transcript_id, syntax in coding.items()
+                    }
+                    # all alternatives of a record share its (meta)data
+                    if var.id not in variant_metadata.rows:
+                        values = {"vardbid": variation_dbid}
+                        for metadata_name in metadata_list:
+                            if metadata_name in record.INFO:
+                                values[metadata_name] = record.INFO[metadata_name]
+                        for sample in record.samples:
+                            for format_key in format_list:
+                                if getattr(sample.data, format_key, None) is None:
+                                    logger.warning(
+                                        f"FORMAT entry {format_key} not defined for {sample.sample}. Skipping."
+                                    )
+                                    continue
+                                if isinstance(sample[format_key], list):
+                                    format_value = ",".join([str(i) for i in sample[format_key]])
+                                else:
+                                    format_value = sample[format_key]
+                                values[f"{sample.sample}.{format_key}"] = format_value
+                        variant_metadata.add(var.id, values)
+                    yield var
+
+
+def iter_vcf_transcript_groups(variants, max_transcript_span=2500000):
+    """
+    groups a stream of position-sorted epytope variants by the transcripts they affect
+    a group is yielded as soon as no later variant can affect one of its transcripts anymore,
+    i.e. if the chromosome changes or the current position lies more than max_transcript_span
+    nucleotides behind the first variant of the group
+    :param variants: iterable of epytope variants, sorted by chromosome and position
+    :param int max_transcript_span: maximum genomic span of a transcript (default: 2500000)
+    :return: generator of lists of epytope variants that do not share transcripts with any other list
+    """
+    open_groups = {}
+    transcript_to_group = {}
+    closed_transcripts = set()
+    seen_chromosomes = set()
+    previous = None
+    is_sorted = True
+    group_count = 0
+
+    def close_groups(group_ids):
+        for group_id in sorted(group_ids, key=lambda g: open_groups[g]["start"]):
+            group = open_groups.pop(group_id)
+            for trans_id in group["transcripts"]:
+                del transcript_to_group[trans_id]
+            closed_transcripts.update(group["transcripts"])
+            yield group["variants"]
+
+    for var in variants:
+        if previous is not None and is_sorted:
+            if var.chrom != previous.chrom:
+                if var.chrom in seen_chromosomes:
+                    is_sorted = False
+                else:
+                    yield from close_groups(list(open_groups))
+            elif var.genomePos < previous.genomePos:
+                is_sorted = False
+            if not is_sorted:
+                logger.warning(
+                    "VCF file is not sorted by position. Transcript groups will only be released at the end of the file."
                 )
-    transToVar = {}
+        if is_sorted:
+            yield from close_groups(
+                [g for g, group in open_groups.items() if group["start"] + max_transcript_span < var.genomePos]
+            )
+        seen_chromosomes.add(var.chrom)
+        previous = var
 
-    # fix because of memory/timing issues due to combinatorial explosion
+        reopened = closed_transcripts.intersection(var.coding.keys())
+        if reopened:
+            logger.warning(
+                f"Variant {var.id} affects already processed transcript(s) {','.join(reopened)}. Variant combinations across both groups are not considered. Consider increasing the maximum transcript span."
+            )
+            closed_transcripts.difference_update(reopened)
 
-    for variant in list_vars:
-        for trans_id in variant.coding.keys():
-            transToVar.setdefault(trans_id, []).append(variant)
+        group_ids = sorted(
+            set(transcript_to_group[t] for t in var.coding.keys() if t in transcript_to_group),
+            key=lambda g: open_groups[g]["start"],
+        )
+        if group_ids:
+            # variant links several groups via its transcripts, merge them into the oldest one
+            group_id = group_ids[0]
+            group = open_groups[group_id]
+            for other_id in group_ids[1:]:
+                other = open_groups.pop(other_id)
+                group["variants"].extend(other["variants"])
+                group["transcripts"].update(other["transcripts"])
+                for trans_id in other["transcripts"]:
+                    transcript_to_group[trans_id] = group_id
+        else:
+            group_id = group_count
+            group_count += 1
+            group = open_groups[group_id] = {"variants": [], "transcripts": set(), "start": var.genomePos}
+        group["variants"].append(var)
+        group["transcripts"].update(var.coding.keys())
+        for trans_id in var.coding.keys():
+            transcript_to_group[trans_id] = group_id
 
-    for tId, vs in transToVar.items():
-        if len(vs) > 10:
-            for v in vs:
-                vs_new = Variant(v.id, v.type, v.chrom, v.genomePos, v.ref, v.obs, v.coding, True, v.isSynonymous)
-                vs_new.gene = v.gene
-                for m in metadata_name:
-                    vs_new.log_metadata(m, v.get_metadata(m))
-                dict_vars[v] = vs_new
+    yield from close_groups(list(open_groups))
 
-    return dict_vars.values(), transcript_ids, final_metadata_list
 
+def iter_variant_batches(groups, batch_size):
+    """
+    collects transcript groups of variants into batches of at least batch_size variants
+    :param groups: iterable of lists of epytope variants
+    :param int batch_size: minimum number of variants per batch
+    :return: generator of lists of epytope variants
+    """
+    batch = []
+    for group in groups:
+        batch.extend(group)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-def read_peptide_input(filename):
-    peptides = []
-    metadata = []
-
-    """expected columns (min required): id sequence"""
-    with open(filename) as peptide_input:
-        # enable listing of protein names for each peptide
-        csv.field_size_limit(600000)
-        reader = csv.DictReader(peptide_input, delimiter="\t")
-        for row in reader:
-            pep = Peptide(row["sequence"])
 
-            for col in row:
-                if col != "sequence":
-                    pep.log_metadata(col, row[col])
-                    metadata.append(col)
-            peptides.append(pep)
+def read_vcf(filename, pass_only=True):
+    """
+    reads vcf files
+    returns a list of epytope variants
+    :param filename: /path/to/file
+    :param boolean pass_only: only consider variants that passed the filter (default: True)
+    :return: list of epytope variants, their transcript IDs and their (meta)data (VariantMetadata)
+    """
+    variant_metadata = VariantMetadata()
+    list_vars = []
+    transcript_ids = []
 
-    metadata = set(metadata)
-    return peptides, metadata
+    for var in iter_vcf_variants(filename, pass_only, variant_metadata):
+        list_vars.append(var)
+        transcript_ids.extend(var.coding.keys())
+
+    return list_vars, transcript_ids, variant_metadata
+
+
+def read_peptide_input(filename):
+    """
+    reads the peptide input into a DataFrame, all columns except the sequence are kept as (meta)data
+    expected columns (min required): id sequence
+    :param filename: /path/to/file
+    :return: list of peptide sequences and DataFrame with the (meta)data of each unique sequence, indexed by sequence
+    """
+    # values are kept as strings, empty values are not converted to NaN
+    peptide_table = pd.read_csv(filename, sep="\t", dtype=str, keep_default_na=False)
+    # the metadata of the last row of a duplicated sequence is used
+    peptide_metadata = peptide_table.drop_duplicates("sequence", keep="last").set_index("sequence")
+    return peptide_table["sequence"].tolist(), peptide_metadata
 
 
 # parse protein_groups of MaxQuant output to get protein intensity values
@@ -423,100 +706,89 @@ def read_lig_ID_values(filename):
     return intensities
 
 
-def create_protein_column_value(pep):
-    # retrieve Ensembl protein ID for given transcript IDs, if we want to provide additional protein ID types, adapt here
+def create_protein_column(peptides, transcript_protein_table):
+    """
+    maps peptides to the Ensembl protein IDs of their transcripts with one merge over all unique peptides
+    :param peptides: pandas Series of epytope peptides
+    :param transcript_protein_table: DataFrame with transcript and protein IDs (see MartsAdapter.get_protein_ids_from_transcripts)
+    :return: pandas Series with the comma separated protein IDs of each peptide
+    """
     # we have to catch cases where no protein information is available, e.g. if there are issues on BioMart side
-    if transcriptProteinTable is None:
-        logger.warning(f"Protein mapping not available for peptide {str(pep)}")
-        return ""
-
-    all_proteins = [
-        # split by : otherwise epytope generator suffix included
-        transcriptProteinTable.query(f'transcript_id == "{transcript.transcript_id.split(":")[0]}"')["ensembl_id"]
-        for transcript in set(pep.get_all_transcripts())
-    ]
-    return ",".join(set([item for sublist in all_proteins for item in sublist]))
+    if transcript_protein_table is None:
+        logger.warning("Protein mapping not available for peptides")
+        return pd.Series("", index=peptides.index)
 
-
-def create_transcript_column_value(pep):
     # split by : otherwise epytope generator suffix included
-    return ",".join(set([transcript.transcript_id.split(":")[0] for transcript in set(pep.get_all_transcripts())]))
-
-
-def create_mutationsyntax_column_value(pep, pep_dictionary):
-    syntaxes = []
-    for variant in set(pep_dictionary[pep]):
-        for coding in variant.coding:
-            syntaxes.append(variant.coding[coding])
-    return ",".join(set([mutationSyntax.aaMutationSyntax for mutationSyntax in syntaxes]))
-
-
-def create_mutationsyntax_genome_column_value(pep, pep_dictionary):
-    syntaxes = []
-    for variant in set(pep_dictionary[pep]):
-        for coding in variant.coding:
-            syntaxes.append(variant.coding[coding])
-    return ",".join(set([mutationSyntax.cdsMutationSyntax for mutationSyntax in syntaxes]))
-
-
-def create_gene_column_value(pep, pep_dictionary):
-    return ",".join(set([variant.gene for variant in set(pep_dictionary[pep])]))
-
-
-def create_variant_pos_column_value(pep, pep_dictionary):
-    return ",".join(set([f"{variant.genomePos}" for variant in set(pep_dictionary[pep])]))
-
-
-def create_variant_chr_column_value(pep, pep_dictionary):
-    return ",".join(set([f"{variant.chrom}" for variant in set(pep_dictionary[pep])]))
+    peptide_transcripts = pd.DataFrame(
+        [
+            (str(pep), transcript.transcript_id.split(":")[0])
+            for pep in peptides.drop_duplicates()
+            for transcript in set(pep.get_all_transcripts())
+        ],
+        columns=["sequence", "transcript_id"],
+    )
+    # if we want to provide additional protein ID types, adapt here
+    protein_ids = peptide_transcripts.merge(
+        transcript_protein_table[["transcript_id", "ensembl_id"]].dropna().drop_duplicates(), on="transcript_id"
+    )
+    proteins = protein_ids.groupby("sequence", sort=False)["ensembl_id"].agg(lambda ids: ",".join(set(ids)))
+    return peptides.map(str).map(proteins).fillna("")
 
 
-def create_variant_type_column_value(pep, pep_dictionary):
+def create_peptide_annotation_table(peptides):
+    """
+    collects the provenance of each unique peptide (variants, transcripts and genes) in one traversal
+    :param peptides: pandas Series of epytope peptides, may contain duplicates
+    :return: DataFrame indexed by peptide sequence with the columns PEPTIDE_ANNOTATION_COLUMNS and
+             DataFrame with the pairs of peptide sequence and variant ID
+    """
     types = {0: "SNP", 1: "DEL", 2: "INS", 3: "FSDEL", 4: "FSINS", 5: "UNKNOWN"}
-    return ",".join(set([types[variant.type] for variant in set(pep_dictionary[pep])]))
-
-
-def create_variant_syn_column_value(pep, pep_dictionary):
-    return ",".join(set([str(variant.isSynonymous) for variant in set(pep_dictionary[pep])]))
+    rows = {}
+    peptide_variants = []
+    for pep in peptides.drop_duplicates():
+        transcripts = set(pep.get_all_transcripts())
+        variants = set()
+        for transcript in transcripts:
+            variants.update(pep.get_variants_by_protein(transcript.transcript_id))
+        syntaxes = [syntax for variant in variants for syntax in variant.coding.values()]
+        peptide_variants.extend([(str(pep), variant.id) for variant in variants])
+        rows[str(pep)] = [
+            ",".join(set([f"{variant.chrom}" for variant in variants])),
+            ",".join(set([f"{variant.genomePos}" for variant in variants])),
+            ",".join(set([variant.gene for variant in variants])),
+            # split by : otherwise epytope generator suffix included
+            ",".join(set([transcript.transcript_id.split(":")[0] for transcript in transcripts])),
+            ",".join(set([types[variant.type] for variant in variants])),
+            ",".join(set([str(variant.isSynonymous) for variant in variants])),
+            ",".join(set([str(variant.isHomozygous) for variant in variants])),
+            ",".join(set([syntax.cdsMutationSyntax for syntax in syntaxes])),
+            ",".join(set([syntax.aaMutationSyntax for syntax in syntaxes])),
+        ]
+    return (
+        pd.DataFrame.from_dict(rows, orient="index", columns=PEPTIDE_ANNOTATION_COLUMNS),
+        pd.DataFrame(peptide_variants, columns=["sequence", "variant_id"]),
+    )
 
 
-def create_variant_hom_column_value(pep, pep_dictionary):
-    return ",".join(set([str(variant.isHomozygous) for variant in set(pep_dictionary[pep])]))
+def create_metadata_table(peptide_variants, variant_metadata):
+    """
+    collects the (meta)data of the variants of each peptide with one merge
+    :param peptide_variants: DataFrame with the pairs of peptide sequence and variant ID
+    :param VariantMetadata variant_metadata: (meta)data of the variants
+    :return: DataFrame indexed by peptide sequence with the comma separated distinct values of each (meta)data column
+    """
+    variant_table = variant_metadata.to_frame(peptide_variants["variant_id"])
+    merged = peptide_variants.merge(variant_table, left_on="variant_id", right_index=True)
+    metadata = merged.groupby("sequence", sort=False)[variant_metadata.columns].agg(
+        lambda values: ",".join(set(values.dropna().astype(str)))
+    )
+    return metadata.replace("", np.nan)
 
 
 def create_coding_column_value(pep, pep_dictionary):
     return ",".join(set([str(variant.coding) for variant in set(pep_dictionary[pep])]))
 
 
-def create_metadata_column_value(pep, c, pep_dictionary):
-    meta = set(
-        [
-            str(variant.get_metadata(c)[0])
-            for variant in set(pep_dictionary[pep[0]])
-            if len(variant.get_metadata(c)) != 0
-        ]
-    )
-    if len(meta) == 0:
-        return np.nan
-    else:
-        return ",".join(meta)
-
-
-def create_wt_seq_column_value(pep, wtseqs):
-    transcripts = [transcript for transcript in set(pep["sequence"].get_all_transcripts())]
-    wild_type = set(
-        [
-            str(wtseqs["{}_{}".format(str(pep["sequence"]), transcript.transcript_id)])
-            for transcript in transcripts
-            if bool(transcript.vars) and "{}_{}".format(str(pep["sequence"]), transcript.transcript_id) in wtseqs
-        ]
-    )
-    if len(wild_type) == 0:
-        return np.nan
-    else:
-        return ",".join(wild_type)
-
-
 def create_quant_column_value(row, dict):
     if row[1] in dict:
         value = dict[row[1]]
@@ -605,91 +877,800 @@ def create_ligandomics_column_value_for_result(row, lig_id, val, wild_type):
         return ""
 
 
-def get_matrix_max_score(allele, length):
-    allele_model = "%s_%i" % (allele, length)
+def get_syfpeithi_max_scores():
+    """
+    returns the maximum score (sum of the maximum score per position) of every SYFPEITHI matrix shipped with epytope,
+    the table is computed once per process
+    :return: dictionary with the maximum score of each allele model (<locus>_<supertype><subtype>_<length>)
+    """
+    if not SYFPEITHI_MAX_SCORES:
+        for module in pkgutil.iter_modules(syfpeithi_matrices.__path__):
+            pssm = getattr(importlib.import_module(f"{syfpeithi_matrices.__name__}.{module.name}"), module.name)
+            SYFPEITHI_MAX_SCORES[module.name] = sum([max(scrs.values()) for pos, scrs in pssm.items()])
+    return SYFPEITHI_MAX_SCORES
+
+
+def get_allele_models(alleles):
+    """
+    maps alleles to the names of their SYFPEITHI matrices (without peptide length)
+    :param list alleles: epytope alleles
+    :return: dictionary with the allele model of each allele string
+    """
+    return {str(a): "%s_%s%s" % (a.locus, a.supertype, a.subtype) for a in alleles}
+
+
+def create_affinity_values(df, allele_model, score_column):
+    """
+    converts the prediction scores of one allele to affinities, grouped by prediction method: SYFPEITHI scores are
+    normalized to the maximum score of the allele matrix (in %), scores of all other methods are converted from [0,1]
+    back to IC50 values (nM). Scores are rounded, so the conversion is computed once per unique score and length.
+    :param df: DataFrame with columns method, length and the score column
+    :param str allele_model: SYFPEITHI allele model of the score column (see get_allele_models)
+    :param str score_column: name of the score column
+    :return: numpy array of affinity values
+    """
+    scores = df[score_column].to_numpy(dtype=float)
+    lengths = df["length"].to_numpy()
+    affinities = np.full(len(df), np.nan)
+    max_scores = get_syfpeithi_max_scores()
+    for method, rows in df.groupby("method", sort=False).indices.items():
+        if "syf" in method:
+            for length in np.unique(lengths[rows]):
+                length_rows = rows[lengths[rows] == length]
+                # without a SYFPEITHI matrix for the allele and length, the affinity is 0
+                max_score = float(max_scores.get("%s_%i" % (allele_model, length), np.nan))
+                values, inverse = np.unique(scores[length_rows], return_inverse=True)
+                affinities[length_rows] = np.array([max(0, round((100.0 / max_score * v), 2)) for v in values])[inverse]
+        else:
+            values, inverse = np.unique(scores[rows], return_inverse=True)
+            affinities[rows] = np.array([round((50000 ** (1.0 - v)), 2) for v in values])[inverse]
+    affinities[np.isnan(scores)] = np.nan
+    return affinities
+
+
+def create_binder_values(df, values, thresholds):
+    """
+    classifies peptides as binders, grouped by prediction method: SYFPEITHI predictions above the method threshold,
+    predictions of all other methods at or below the threshold
+    :param df: DataFrame with column method
+    :param values: pandas Series of affinities or ranks
+    :param dict thresholds: threshold of each prediction method
+    :return: pandas Series with True/False, NaN if no value is available
+    """
+    values = values.astype(float)
+    binders = pd.Series(False, index=df.index)
+    for method, rows in df.groupby("method", sort=False).indices.items():
+        if "syf" in method:
+            binders.iloc[rows] = values.iloc[rows].to_numpy() > thresholds[method]
+        else:
+            binders.iloc[rows] = values.iloc[rows].to_numpy() <= thresholds[method.lower()]
+    if values.isna().any():
+        binders = binders.astype(object).mask(values.isna(), np.nan)
+    return binders
+
+
+def insert_affinity_binder_columns(df, allele_models, thresholds, use_affinity_thresholds):
+    """
+    inserts the affinity and binder columns after the score column of each allele
+    :param df: DataFrame with one column "<allele> Score" per allele
+    :param dict allele_models: SYFPEITHI allele model of each allele (see get_allele_models)
+    :param dict thresholds: binder threshold of each prediction method
+    :param bool use_affinity_thresholds: classify NetMHC predictions by affinity instead of rank
+    """
+    for c in df.columns:
+        if ("HLA-" in str(c) or "H-2-" in str(c)) and "Score" in str(c):
+            idx = df.columns.get_loc(c)
+            allele = c.rstrip(" Score")
+            df[c] = df[c].round(4)
+            df.insert(idx + 1, "%s affinity" % allele, create_affinity_values(df, allele_models[allele], c))
+            binder_values = df["%s affinity" % allele]
+            use_rank = df["method"].str.contains("netmhc") & (not use_affinity_thresholds)
+            if use_rank.any():
+                binder_values = binder_values.where(~use_rank, df["%s Rank" % allele])
+            df.insert(idx + 2, "%s binder" % allele, create_binder_values(df, binder_values, thresholds))
+
+
+def generate_wt_seqs(peptides):
+    """
+    restores the wild type sequence of each unique pair of mutated peptide and transcript from the wild type residues
+    parsed when the variants were read (see parse_wild_type_residue)
+    :param peptides: pandas Series of epytope peptides
+    :return: DataFrame with the columns sequence, transcript_id and wt sequence (NaN if it can not be restored)
+    """
+    rows = []
+    for x in peptides.drop_duplicates():
+        for t in set(x.get_all_transcripts()):
+            transcript_id = t.transcript_id.split(":")[0]
+            mut_seq = list(str(x))
+            not_available = False
+            variant_available = False
+            for p in x.get_protein_positions(t.transcript_id):
+                variant_dic = x.get_variants_by_protein_position(t.transcript_id, p)
+                variant_available = bool(variant_dic)
+                for key, var_list in variant_dic.items():
+                    for v in var_list:
+                        residue = v.wild_type_residues.get(transcript_id)
+                        if residue is None:
+                            not_available = True
+                        elif residue[1]:
+                            mut_seq.insert(key, residue[0])
+                        else:
+                            mut_seq[key] = residue[0]
+            if not_available:
+                rows.append((str(x), t.transcript_id, np.nan))
+            elif variant_available:
+                rows.append((str(x), t.transcript_id, "".join(mut_seq)))
+    return pd.DataFrame(rows, columns=["sequence", "transcript_id", "wt sequence"])
+
+
+def create_wt_seq_column(peptides):
+    """
+    joins the distinct wild type sequences of the transcripts of each peptide onto all prediction rows with one merge
+    :param peptides: pandas Series of epytope peptides
+    :return: pandas Series with the comma separated wild type sequences of each peptide
+    """
+    wt_sequences = generate_wt_seqs(peptides)
+    wild_type = wt_sequences.groupby("sequence", sort=False)["wt sequence"].agg(
+        lambda values: ",".join(set(values.astype(str)))
+    )
+    merged = pd.DataFrame({"sequence": peptides.map(str)}).merge(
+        wild_type.rename("wt sequence"), left_on="sequence", right_index=True, how="left"
+    )
+    return pd.Series(merged["wt sequence"].to_numpy(), index=peptides.index)
+
+
+def filter_self_peptides(peptides, protein_db):
+    """
+    removes peptides that occur in the reference proteome
+    :param list peptides: epytope peptides or peptide sequences
+    :param protein_db: k-mer index of the reference proteome (see build_kmer_index.py), epytope UniProtDB or None
+                       if peptides are not filtered
+    :return: list of the peptides that do not occur in the reference proteome
+    :raises ValueError: if the k-mer index does not contain all peptide lengths
+    """
+    if protein_db is None:
+        return list(peptides)
+    if isinstance(protein_db, UniProtDB):
+        selfies = set([str(p) for p in peptides if protein_db.exists(str(p))])
+        return [p for p in peptides if str(p) not in selfies]
+
+    sequences_by_length = {}
+    for p in peptides:
+        sequences_by_length.setdefault(len(p), set()).add(str(p))
+    missing_lengths = sorted(set(sequences_by_length) - set(protein_db))
+    if missing_lengths:
+        raise ValueError(
+            f"The k-mer index of the reference proteome contains no peptides of length {','.join(map(str, missing_lengths))}. "
+            "Rebuild the index with build_kmer_index.py and --min_length/--max_length covering all peptide lengths."
+        )
+    selfies = set()
+    for length, sequences in sequences_by_length.items():
+        sequences = list(sequences)
+        selfies.update(itertools.compress(sequences, contains_kmers(protein_db, sequences)))
+    return [p for p in peptides if str(p) not in selfies]
+
+
+class LocalReferenceAdapter(ADBAdapter):
+    """
+    offline replacement of the MartsAdapter, serves transcript and protein information from a local reference built
+    with build_reference_index.py. Sequences are read from memory mapped FASTA files at the offsets of their index,
+    IDs are looked up in dictionaries, i.e. each lookup by transcript ID is O(1) and independent of the reference size.
+    IDs are matched without version.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, REFERENCE_INDEX_FILE)) as reference_file:
+            reference = json.load(reference_file)
+        ids = pd.read_csv(os.path.join(directory, reference["ids"]), sep="\t", dtype=str, keep_default_na=False)
+        self.transcripts = ids.set_index("transcript_id").to_dict("index")
+        self.transcript_sequences, self.transcript_offsets = open_sequences(
+            os.path.join(directory, reference["transcripts"])
+        )
+        self.protein_sequences, self.protein_offsets = open_sequences(os.path.join(directory, reference["proteins"]))
+        logger.info(f"Loaded local reference with {len(self.transcripts)} transcripts from {directory}")
+
+    @staticmethod
+    def _fetch(sequences, offsets, identifier):
+        if identifier not in offsets:
+            return None
+        offset, length = offsets[identifier]
+        return sequences[offset : offset + length].decode()
+
+    def get_product_sequence(self, product_id, **kwargs):
+        return self._fetch(self.protein_sequences, self.protein_offsets, product_id.split(".")[0])
+
+    def get_transcript_sequence(self, transcript_id, **kwargs):
+        return self._fetch(self.transcript_sequences, self.transcript_offsets, transcript_id.split(".")[0])
+
+    def get_transcript_information(self, transcript_id, **kwargs):
+        """
+        same fields as MartsAdapter.get_transcript_information
+        :param str transcript_id: transcript ID
+        :return: dictionary with coding sequence, gene name and strand of the transcript or None if it is not available
+        """
+        transcript = self.transcripts.get(transcript_id.split(".")[0])
+        sequence = self.get_transcript_sequence(transcript_id)
+        if transcript is None or sequence is None:
+            return None
+        return {
+            EAdapterFields.SEQ: sequence,
+            EAdapterFields.GENE: transcript["gene_name"],
+            EAdapterFields.STRAND: "-" if transcript["strand"] == "-" else "+",
+        }
+
+    def get_protein_ids_from_transcripts(self, transcripts, **kwargs):
+        """
+        same table as MartsAdapter.get_protein_ids_from_transcripts, the protein IDs of the reference are reported
+        as ensembl_id
+        :param list transcripts: transcript IDs
+        :return: DataFrame with protein and transcript IDs or None if none of the transcripts is available
+        """
+        rows = [
+            (self.transcripts[t.split(".")[0]]["protein_id"], "", "", t)
+            for t in transcripts
+            if self.transcripts.get(t.split(".")[0], {}).get("protein_id")
+        ]
+        if not rows:
+            return None
+        return pd.DataFrame(rows, columns=["ensembl_id", "refseq_id", "uniprot_id", "transcript_id"])
+
+
+def iter_haplotype_combinations(anchors, windows, max_partners):
+    """
+    yields combinations of heterozygous variants, ordered by the number of combined variants
+    :param list anchors: heterozygous variants of one transcript
+    :param list windows: for each anchor the list of downstream heterozygous variants it can be combined with
+    :param int max_partners: maximum number of window variants combined with one anchor
+    :return: generator of lists of epytope variants
+    """
+    for num_partners in range(max_partners + 1):
+        for anchor, window in zip(anchors, windows):
+            for partners in itertools.combinations(window, num_partners):
+                yield [anchor, *partners]
+
+
+def generate_bounded_transcripts(variants, dbadapter, id_type, window_length, max_haplotypes, memory_budget):
+    """
+    generates the variant transcripts (haplotypes) of the given variants
+    replaces epytope's generate_transcripts_from_variants, which enumerates all 2^n combinations of heterozygous
+    variants of a transcript, by a windowed enumeration: heterozygous variants are only combined with downstream
+    variants that can end up in the same peptide, i.e. within window_length nucleotides (frameshifts with all
+    downstream variants). Homozygous variants are part of every haplotype.
+    If the haplotypes of a transcript exceed max_haplotypes or the memory budget, combinations with fewer
+    heterozygous variants are enumerated first and the enumeration stops at the limit.
+    :param variants: list of epytope variants
+    :param dbadapter: epytope DB adapter used to retrieve the transcript sequences
+    :param id_type: type of the transcript IDs used in the variant annotation (EIdentifierTypes)
+    :param int window_length: maximum distance (nt) of combined variants, three times the maximum peptide length
+    :param int max_haplotypes: maximum number of haplotypes per transcript
+    :param int memory_budget: maximum estimated memory (bytes) of the haplotypes of one transcript
+    :return: generator of epytope transcripts
+    """
+    transToVar = {}
+    for v in variants:
+        for trans_id in v.coding.keys():
+            transToVar.setdefault(trans_id, []).append(v)
+
+    for tId, vs in transToVar.items():
+        query = dbadapter.get_transcript_information(tId, type=id_type)
+        if query is None:
+            logger.warning(f"Transcript with ID {tId} not found in DB or sequence unavailable")
+            continue
+
+        tSeq = query[EAdapterFields.SEQ]
+        geneid = query[EAdapterFields.GENE]
+        isReverse = query[EAdapterFields.STRAND] == generator.REVERS
+
+        # same order as in epytope, variants are incorporated by ascending genomic position
+        vs.sort(
+            key=lambda v: v.genomePos - 1 if v.type in [VariationType.FSINS, VariationType.INS] else v.genomePos,
+            reverse=True,
+        )
+        if not generator._check_for_problematic_variants(vs):
+            logger.warning(f"Intersecting variants found for transcript {tId}")
+            continue
+        vs.reverse()
+
+        anchors = sorted([v for v in vs if not v.isHomozygous], key=lambda v: v.coding[tId].tranPos)
+        # in-frame deletions stretch the genomic span of a peptide
+        padding = max([len(v.ref) for v in anchors if v.type == VariationType.DEL], default=0)
+        windows = []
+        for idx, anchor in enumerate(anchors):
+            downstream = anchors[idx + 1 :]
+            if anchor.type not in [VariationType.FSDEL, VariationType.FSINS]:
+                end = anchor.coding[tId].tranPos + window_length + padding
+                downstream = list(itertools.takewhile(lambda v: v.coding[tId].tranPos < end, downstream))
+            windows.append(downstream)
+
+        limit = min(max_haplotypes, memory_budget // max(1, HAPLOTYPE_BYTES_PER_BASE * len(tSeq)))
+        limit = max(limit, 1)
+        num_haplotypes = 1
+        max_partners = -1
+        for num_partners in range(max([len(w) for w in windows], default=-1) + 1):
+            additional = sum([math.comb(len(w), num_partners) for w in windows])
+            if num_haplotypes + additional > limit:
+                logger.warning(
+                    f"Transcript {tId}: combinations of {len(anchors)} heterozygous variants exceed the limit of "
+                    f"{limit} haplotypes, only combinations of up to {num_partners + 1} variants per window are generated."
+                )
+                break
+            num_haplotypes += additional
+            max_partners = num_partners
+
+        combinations = itertools.chain(
+            [[]],
+            itertools.islice(iter_haplotype_combinations(anchors, windows, max_partners + 1), limit - 1),
+        )
+        for num, combination in enumerate(combinations):
+            selected = set(combination)
+            seq = list(tSeq)
+            offset = 0
+            usedVs = {}
+            for v in vs:
+                if v.isHomozygous or v in selected:
+                    pos = v.coding[tId].tranPos + offset
+                    usedVs[pos] = v
+                    offset = generator._incorp.get(v.type, lambda a, b, c, d, e, f: e)(
+                        seq, v, tId, pos, offset, isReverse
+                    )
+            yield Transcript("".join(seq), geneid, f"{tId}:epytope_{num}", vars=usedVs)
+
+
+def get_prediction_cache():
+    """
+    returns the connection to the prediction cache of this process, None if no cache is used
+    the database uses the default rollback journal and waits for locks, so that parallel tasks on the same host can
+    read and write the same cache file, SQLite locking is not reliable on network file systems (see
+    is_network_filesystem)
+    :return: sqlite3 connection
+    """
+    if PREDICTION_CACHE["path"] is None:
+        return None
+    if PREDICTION_CACHE["pid"] != os.getpid():
+        connection = sqlite3.connect(PREDICTION_CACHE["path"], timeout=600, isolation_level=None)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions (sequence TEXT NOT NULL, allele TEXT NOT NULL, method TEXT NOT NULL, "
+            "version TEXT NOT NULL, score REAL, rank REAL, last_used INTEGER NOT NULL, "
+            "PRIMARY KEY (sequence, allele, method, version))"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS unsupported (allele TEXT NOT NULL, length INTEGER NOT NULL, method TEXT NOT NULL, "
+            "version TEXT NOT NULL, PRIMARY KEY (allele, length, method, version))"
+        )
+        PREDICTION_CACHE["connection"] = connection
+        PREDICTION_CACHE["pid"] = os.getpid()
+    return PREDICTION_CACHE["connection"]
+
+
+def is_network_filesystem(path):
+    """
+    checks whether a path is located on a network file system, based on the mount table (Linux only)
+    :param str path: file path
+    :return: file system type if it is a network file system, None otherwise
+    """
+    directory = os.path.dirname(os.path.realpath(path))
+    mount_point, fs_type = "", None
+    try:
+        with open("/proc/mounts") as mounts:
+            for line in mounts:
+                fields = line.split()
+                mount = fields[1].replace("\\040", " ")
+                if os.path.join(directory, "").startswith(os.path.join(mount, "")) and len(mount) >= len(mount_point):
+                    mount_point, fs_type = mount, fields[2]
+    except OSError:
+        return None
+    return fs_type if fs_type in NETWORK_FILESYSTEMS else None
+
+
+def lookup_cached_predictions(connection, method, version, sequences):
+    """
+    looks up the cached scores of the given peptide sequences
+    :param connection: sqlite3 connection to the prediction cache
+    :param str method: prediction method
+    :param str version: version of the prediction method
+    :param list sequences: peptide sequences
+    :return: dictionary with (score, rank) for each cached (sequence, allele)
+    """
+    cached = {}
+    for start in range(0, len(sequences), 500):
+        chunk = sequences[start : start + 500]
+        rows = connection.execute(
+            f"SELECT sequence, allele, score, rank FROM predictions WHERE method = ? AND version = ? AND sequence IN ({','.join('?' * len(chunk))})",
+            [method, version, *chunk],
+        )
+        for sequence, allele, score, rank in rows:
+            # entries without scores were written by earlier versions for peptides the predictor dropped
+            if score is not None or rank is not None:
+                cached[(sequence, allele)] = (score, rank)
+    return cached
+
+
+def lookup_unsupported_alleles(connection, method, version):
+    """
+    :param connection: sqlite3 connection to the prediction cache
+    :param str method: prediction method
+    :param str version: version of the prediction method
+    :return: set of (allele, peptide length) the method returned no scores for in earlier runs
+    """
+    rows = connection.execute(
+        "SELECT allele, length FROM unsupported WHERE method = ? AND version = ?", [method, version]
+    )
+    return set(rows)
+
+
+def store_cached_predictions(connection, method, version, result, peptides, required_alleles, used_sequences):
+    """
+    stores the prediction result of the given peptides in the cache, refreshes the last use of the cache hits
+    and evicts the least recently used entries if the cache exceeds its size limit
+    single peptides without scores (dropped by the predictor) are not stored and predicted again in later runs, an
+    allele without any score for a peptide length is stored as unsupported for this length instead
+    :param connection: sqlite3 connection to the prediction cache
+    :param str method: prediction method
+    :param str version: version of the prediction method
+    :param result: epytope prediction result of the peptides
+    :param list peptides: predicted epytope peptides
+    :param dict required_alleles: alleles (str) the predictor was expected to predict for each peptide length
+    :param list used_sequences: peptide sequences that were taken from the cache
+    """
+    now = int(time.time())
+    scores = {}
+    for (allele, _, score_type), values in result.items():
+        scores.setdefault(str(allele), {})[score_type] = {str(p): value for p, value in values.items()}
+    peptides_by_length = {}
+    for peptide in map(str, peptides):
+        peptides_by_length.setdefault(len(peptide), []).append(peptide)
+    rows = []
+    unsupported = []
+    for length, length_peptides in peptides_by_length.items():
+        for allele in required_alleles[length]:
+            allele_scores = scores.get(allele, {})
+            allele_rows = []
+            for peptide in length_peptides:
+                score, rank = [allele_scores.get(score_type, {}).get(peptide) for score_type in ["Score", "Rank"]]
+                score = None if score is None or math.isnan(score) else score
+                rank = None if rank is None or math.isnan(rank) else rank
+                if score is not None or rank is not None:
+                    allele_rows.append((peptide, allele, method, version, score, rank, now))
+            if allele_rows:
+                rows.extend(allele_rows)
+            else:
+                # e.g. no PSSM of this length for the allele, later runs do not require scores for it
+                unsupported.append((allele, length, method, version))
+
+    connection.execute("BEGIN IMMEDIATE")
     try:
-        pssm = getattr(
-            __import__("epytope.Data.pssms.syfpeithi.mat." + allele_model, fromlist=[allele_model]), allele_model
+        connection.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        connection.executemany("INSERT OR IGNORE INTO unsupported VALUES (?, ?, ?, ?)", unsupported)
+        for start in range(0, len(used_sequences), 500):
+            chunk = used_sequences[start : start + 500]
+            connection.execute(
+                f"UPDATE predictions SET last_used = ? WHERE method = ? AND version = ? AND sequence IN ({','.join('?' * len(chunk))})",
+                [now, method, version, *chunk],
+            )
+        page_size, page_count, free_pages = [
+            connection.execute(f"PRAGMA {pragma}").fetchone()[0]
+            for pragma in ["page_size", "page_count", "freelist_count"]
+        ]
+        used_bytes = (page_count - free_pages) * page_size
+        if used_bytes > PREDICTION_CACHE["max_bytes"]:
+            # evict down to 90% of the limit, freed pages are reused by later inserts
+            num_entries = connection.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            num_evicted = num_entries - int(num_entries * 0.9 * PREDICTION_CACHE["max_bytes"] / used_bytes)
+            connection.execute(
+                "DELETE FROM predictions WHERE rowid IN (SELECT rowid FROM predictions ORDER BY last_used LIMIT ?)",
+                [num_evicted],
+            )
+            logger.info(f"Evicted {num_evicted} entries from prediction cache {PREDICTION_CACHE['path']}")
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def cached_prediction_result(predictor_name, peptides, alleles, cached):
+    """
+    builds an epytope prediction result from cached scores
+    :param str predictor_name: name of the predictor as used in its prediction results
+    :param list peptides: epytope peptides with cached scores for all alleles the predictor supports
+    :param list alleles: epytope alleles
+    :param dict cached: cached scores (see lookup_cached_predictions)
+    :return: epytope prediction result
+    """
+    columns = {}
+    for allele in alleles:
+        for idx, score_type in enumerate(["Score", "Rank"]):
+            values = [cached.get((str(p), str(allele)), (None, None))[idx] for p in peptides]
+            if any(value is not None for value in values):
+                columns[(allele, predictor_name, score_type)] = [np.nan if v is None else v for v in values]
+    df = pd.DataFrame(columns, index=pd.Index(peptides, name="Peptides"), dtype=float)
+    df.columns = pd.MultiIndex.from_tuples(list(columns), names=["Allele", "Method", "ScoreType"])
+    return EpitopePredictionResult(df)
+
+
+@contextlib.contextmanager
+def loaded_models(method, version):
+    """
+    epytope loads the MHCflurry models in every predict call
+    within this context, the model loader used by epytope returns the models kept in the predictor registry instead
+    (see get_predictor), the loader is restored afterwards
+    :param str method: prediction method
+    :param str version: version of the prediction method
+    """
+    models = PREDICTORS.get((method, version, "models"))
+    if models is None:
+        yield
+        return
+    loader = ANN.Class1AffinityPredictor
+    ANN.Class1AffinityPredictor = SimpleNamespace(load=lambda *args, **kwargs: models)
+    try:
+        yield
+    finally:
+        ANN.Class1AffinityPredictor = loader
+
+
+def get_predictor(method, version):
+    """
+    returns the predictor of the given method and version
+    the predictor is built on first use and kept for the rest of the process
+    :param str method: prediction method
+    :param str version: version of the prediction method
+    :return: epytope epitope predictor
+    """
+    key = (method, version)
+    if key not in PREDICTORS:
+        timings = PREDICTOR_TIMINGS.setdefault(
+            f"{method}-{version}", {"load_seconds": 0.0, "predict_seconds": 0.0, "predict_calls": 0}
+        )
+        start = time.perf_counter()
+        predictor = EpitopePredictorFactory(method, version=version)
+        if method == "mhcflurry":
+            # models are loaded once per process and handed to epytope in each predict call (see loaded_models)
+            PREDICTORS[(method, version, "models")] = ANN.Class1AffinityPredictor.load()
+        timings["load_seconds"] += time.perf_counter() - start
+        PREDICTORS[key] = predictor
+    return PREDICTORS[key]
+
+
+def predict_peptides(method, version, peptides, alleles):
+    """
+    predicts the given peptides with the registered predictor of the given method and version
+    if a prediction cache is used, only peptides without cached scores for all alleles the predictor supports are
+    predicted
+    :param str method: prediction method
+    :param str version: version of the prediction method
+    :param list peptides: epytope peptides
+    :param list alleles: epytope alleles
+    :return: epytope prediction result
+    """
+    predictor = get_predictor(method, version)
+    connection = get_prediction_cache()
+    cached = {}
+    missing = peptides
+    if connection is not None:
+        cached = lookup_cached_predictions(connection, method, version, [str(p) for p in peptides])
+        unsupported = lookup_unsupported_alleles(connection, method, version)
+        supported_alleles = [str(a) for a in alleles if str(a) in predictor.supportedAlleles]
+        required_alleles = {
+            length: [a for a in supported_alleles if (a, length) not in unsupported]
+            for length in set(map(len, peptides))
+        }
+        missing = [p for p in peptides if any((str(p), a) not in cached for a in required_alleles[len(p)])]
+        PREDICTION_CACHE_COUNTS["hits"] += len(peptides) - len(missing)
+        PREDICTION_CACHE_COUNTS["misses"] += len(missing)
+
+    result = None
+    if missing:
+        timings = PREDICTOR_TIMINGS[f"{method}-{version}"]
+        start = time.perf_counter()
+        try:
+            with loaded_models(method, version):
+                result = predictor.predict(missing, alleles=alleles)
+        finally:
+            timings["predict_seconds"] += time.perf_counter() - start
+            timings["predict_calls"] += 1
+
+    if connection is None:
+        return result
+    missing_ids = {id(p) for p in missing}
+    hits = [p for p in peptides if id(p) not in missing_ids]
+    if result is not None:
+        store_cached_predictions(connection, method, version, result, missing, required_alleles, [str(p) for p in hits])
+    if not hits:
+        return result
+
+    cached_result = cached_prediction_result(predictor.name, hits, alleles, cached)
+    if result is None:
+        if cached_result.empty:
+            # same error as the predictor for peptides without any supported allele
+            raise ValueError(f"No predictions could be made with {predictor.name} for given input.")
+        return cached_result
+    # keep the column layout of the predictor and the order of the input peptides
+    combined = pd.concat([result, cached_result])
+    combined = combined[list(result.columns) + [c for c in cached_result.columns if c not in result.columns]]
+    positions = {id(p): idx for idx, p in enumerate(peptides)}
+    return EpitopePredictionResult(combined.iloc[np.argsort([positions[id(p)] for p in combined.index])])
+
+
+def log_prediction_failure(length, alleles, method, version):
+    logger.warning(
+        "Prediction for length {length} and allele {allele} not possible with {method} version {version}. No model available.".format(
+            length=length, allele=",".join([str(a) for a in alleles]), method=method, version=version
+        )
+    )
+
+
+def predict_sequences(method, version, sequences, alleles):
+    """
+    predicts peptide sequences in a worker process
+    only the sequences are sent to the workers, the peptides are rebuilt without their protein context
+    :param str method: prediction method
+    :param str version: version of the prediction method
+    :param list sequences: peptide sequences
+    :param list alleles: epytope alleles
+    :return: prediction result, the load and prediction times and the cache hits and misses of this call
+    """
+    key = f"{method}-{version}"
+    timings = dict(PREDICTOR_TIMINGS.get(key, {"load_seconds": 0.0, "predict_seconds": 0.0, "predict_calls": 0}))
+    cache_counts = dict(PREDICTION_CACHE_COUNTS)
+    result = predict_peptides(method, version, [Peptide(sequence) for sequence in sequences], alleles)
+    return (
+        result,
+        {name: value - timings[name] for name, value in PREDICTOR_TIMINGS[key].items()},
+        {name: value - cache_counts[name] for name, value in PREDICTION_CACHE_COUNTS.items()},
+    )
+
+
+def init_prediction_worker(prediction_cache):
+    """
+    sets up a worker process of the prediction pool
+    :param dict prediction_cache: prediction cache settings of the main process
+    """
+    PREDICTION_CACHE.update(prediction_cache, connection=None, pid=None)
+
+
+def get_prediction_pool(num_workers):
+    """
+    returns the process pool used for predictions, the pool is created once so that the workers keep their predictors
+    :param int num_workers: number of worker processes
+    :return: process pool executor
+    """
+    global prediction_pool
+    if prediction_pool is None:
+        # spawned workers start from a clean interpreter, models loaded in the main process (e.g. TensorFlow state)
+        # are not inherited, only the cache settings are passed on
+        prediction_pool = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_prediction_worker,
+            initargs=({"path": PREDICTION_CACHE["path"], "max_bytes": PREDICTION_CACHE["max_bytes"]},),
         )
-        return sum([max(scrs.values()) for pos, scrs in pssm.items()])
-    except:
-        return np.nan
-
+    return prediction_pool
 
-def create_affinity_values(allele, length, j, method, max_scores, allele_strings):
-    if not pd.isnull(j):
-        if "syf" in method:
-            return max(
-                0, round((100.0 / float(max_scores[allele_strings[("%s_%s" % (str(allele), length))]]) * float(j)), 2)
-            )
-        else:
-            # convert given affinity score in range [0,1] back to IC50 affinity value
-            return round((50000 ** (1.0 - float(j))), 2)
-    else:
-        return np.nan
 
+def run_prediction_units(units, alleles, num_workers=1):
+    """
+    runs prediction work units, either one after the other or in a pool of worker processes
+    a unit that raises an error is logged and has no result, a terminated worker process aborts the run
+    :param list units: work units as tuples of method, version and list of epytope peptides
+    :param list alleles: epytope alleles
+    :param int num_workers: number of worker processes, 1 predicts in the current process
+    :return: list of prediction results in the order of the units, None for units that failed
+    """
+    global prediction_pool
 
-def create_binder_values(pred_value, method, thresholds):
-    if not pd.isnull(pred_value):
-        if "syf" in method:
-            return True if pred_value > thresholds[method] else False
+    if num_workers <= 1 or len(units) <= 1:
+        results = []
+        for method, version, peptides in units:
+            try:
+                results.append(predict_peptides(method, version, peptides, alleles))
+            except Exception:
+                logger.debug(f"Prediction with {method} version {version} failed.", exc_info=True)
+                results.append(None)
+        return results
+
+    pool = get_prediction_pool(num_workers)
+    futures = [
+        pool.submit(predict_sequences, method, version, [str(p) for p in peptides], alleles)
+        for method, version, peptides in units
+    ]
+    results = []
+    for (method, version, peptides), future in zip(units, futures):
+        try:
+            result, timings, cache_counts = future.result()
+        except BrokenProcessPool as e:
+            prediction_pool.shutdown(cancel_futures=True)
+            prediction_pool = None
+            raise RuntimeError(
+                f"A prediction worker process terminated unexpectedly while predicting with {method} version "
+                f"{version}. Run with --num_workers 1 to predict in the main process."
+            ) from e
+        except Exception:
+            logger.debug(f"Prediction with {method} version {version} failed.", exc_info=True)
+            results.append(None)
+            continue
+        for name, value in cache_counts.items():
+            PREDICTION_CACHE_COUNTS[name] += value
+        for name, value in timings.items():
+            PREDICTOR_TIMINGS.setdefault(
+                f"{method}-{version}", {"load_seconds": 0.0, "predict_seconds": 0.0, "predict_calls": 0}
+            )[name] += value
+        # map the results back to the peptides with their protein context
+        peptide_objects = {str(p): p for p in peptides}
+        result.index = pd.Index([peptide_objects[str(p)] for p in result.index], name=result.index.name)
+        results.append(result)
+    return results
+
+
+def predict_peptides_by_length(methods, peptides_by_length, alleles, cross_length_batch_size=0, num_workers=1):
+    """
+    predicts peptides grouped by length with all given methods
+    every method and length is one work unit. If cross_length_batch_size is set, methods in CROSS_LENGTH_METHODS
+    get the peptides of all supported lengths at once instead, split into units of at most cross_length_batch_size
+    peptides, and the results are split by length afterwards.
+    :param dict methods: prediction methods and their versions
+    :param dict peptides_by_length: lists of epytope peptides by length
+    :param list alleles: epytope alleles
+    :param int cross_length_batch_size: maximum number of peptides per cross-length prediction call (0: disabled)
+    :param int num_workers: number of worker processes the units are distributed to
+    :return: dictionary with the list of prediction results (one per method) of each length
+    """
+    lengths = [length for length, peptides in peptides_by_length.items() if peptides]
+    units = []
+    method_units = {}
+    for method, version in methods.items():
+        if cross_length_batch_size and method in CROSS_LENGTH_METHODS:
+            # a predictor without models is enough to look up the supported lengths, the models are only loaded
+            # in the process that predicts the unit (see get_predictor)
+            supported_lengths = EpitopePredictorFactory(method, version=version).supportedLength
+            method_lengths = [length for length in lengths if length in supported_lengths]
+            batch = [peptide for length in method_lengths for peptide in peptides_by_length[length]]
+            unit_peptides = [
+                batch[start : start + cross_length_batch_size]
+                for start in range(0, len(batch), cross_length_batch_size)
+            ]
         else:
-            return True if pred_value <= thresholds[method.lower()] else False
-    else:
-        return np.nan
-
+            method_lengths = lengths
+            unit_peptides = [peptides_by_length[length] for length in lengths]
+        method_units[method] = (method_lengths, len(units), len(unit_peptides))
+        units.extend([(method, version, peptides) for peptides in unit_peptides])
 
-def generate_wt_seqs(peptides):
-    wt_dict = {}
-
-    r = re.compile("([a-zA-Z]+)([0-9]+)([a-zA-Z]+)")
-    d_pattern = re.compile("([a-zA-Z]+)([0-9]+)")
-    for x in peptides:
-        trans = x.get_all_transcripts()
-        for t in trans:
-            mut_seq = [a for a in x]
-            protein_pos = x.get_protein_positions(t.transcript_id)
-            not_available = False
-            variant_available = False
-            for p in protein_pos:
-                variant_dic = x.get_variants_by_protein_position(t.transcript_id, p)
-                variant_available = bool(variant_dic)
-                for key in variant_dic:
-                    var_list = variant_dic[key]
-                    for v in var_list:
-                        mut_syntax = v.coding[t.transcript_id.split(":")[0]].aaMutationSyntax
-                        if v.type in [3, 4, 5] or "?" in mut_syntax:
-                            not_available = True
-                        elif v.type in [1]:
-                            m = d_pattern.match(mut_syntax.split(".")[1])
-                            wt = SeqUtils.seq1(m.groups()[0])
-                            mut_seq.insert(key, wt)
-                        elif v.type in [2]:
-                            not_available = True
-                        else:
-                            m = r.match(mut_syntax.split(".")[1])
-                            if m is None:
-                                not_available = True
-                            else:
-                                wt = SeqUtils.seq1(m.groups()[0])
-                                mut_seq[key] = wt
-            if not_available:
-                wt_dict[f"{str(x)}_{t.transcript_id}"] = np.nan
-            elif variant_available:
-                wt_dict[f"{str(x)}_{t.transcript_id}"] = "".join(mut_seq)
-    return wt_dict
+    results = run_prediction_units(units, alleles, num_workers)
 
+    predictions = {length: [] for length in peptides_by_length}
+    for method, version in methods.items():
+        method_lengths, first_unit, num_units = method_units[method]
+        method_results = results[first_unit : first_unit + num_units]
+        for length in set(lengths) - set(method_lengths):
+            log_prediction_failure(length, alleles, method, version)
+
+        if not (cross_length_batch_size and method in CROSS_LENGTH_METHODS):
+            for length, result in zip(method_lengths, method_results):
+                if result is None:
+                    log_prediction_failure(length, alleles, method, version)
+                else:
+                    predictions[length].append(result)
+            continue
 
-# TODO potential improvement in epytope
-def create_peptide_variant_dictionary(peptides):
-    pep_to_variants = {}
-    for pep in peptides:
-        transcript_ids = [x.transcript_id for x in set(pep.get_all_transcripts())]
-        variants = []
-        for t in transcript_ids:
-            variants.extend([v for v in pep.get_variants_by_protein(t)])
-        pep_to_variants[pep] = variants
-    return pep_to_variants
+        # split the cross-length batches by length
+        for idx, result in enumerate(method_results):
+            if result is None:
+                logger.warning(
+                    f"Prediction of batch {idx + 1} of {num_units} (lengths {','.join(map(str, method_lengths))}) not possible with {method} version {version}."
+                )
+        method_results = [result for result in method_results if result is not None]
+        if not method_results:
+            for length in method_lengths:
+                log_prediction_failure(length, alleles, method, version)
+            continue
+        result = pd.concat(method_results)
+        peptide_lengths = result.index.map(len)
+        for length in method_lengths:
+            length_result = result[peptide_lengths == length]
+            if length_result.empty:
+                log_prediction_failure(length, alleles, method, version)
+            else:
+                predictions[length].append(EpitopePredictionResult(length_result))
+    return predictions
 
 
 def make_predictions_from_variants(
@@ -703,26 +1684,38 @@ def make_predictions_from_variants(
     martsadapter,
     protein_db,
     identifier,
-    metadata,
+    variant_metadata,
     transcriptProteinTable,
+    max_haplotypes=1024,
+    haplotype_memory_budget=1024 * 1024**2,
+    cross_length_batch_size=0,
+    num_workers=1,
+    result_writer=None,
 ):
     # list for all peptides and filtered peptides
     all_peptides = []
     all_peptides_filtered = []
 
-    # dictionaries for syfpeithi matrices max values and allele mapping
-    max_values_matrices = {}
-    allele_string_map = {}
+    # mapping of alleles to syfpeithi matrices
+    allele_models = get_allele_models(alleles)
 
     # list to hold dataframes for all predictions
     pred_dataframes = []
     prots = [
         p
         for p in generator.generate_proteins_from_transcripts(
-            generator.generate_transcripts_from_variants(variants_all, martsadapter, ID_SYSTEM_USED)
+            generate_bounded_transcripts(
+                variants_all,
+                martsadapter,
+                ID_SYSTEM_USED,
+                3 * (maxlength - 1),
+                max_haplotypes,
+                haplotype_memory_budget,
+            )
         )
     ]
 
+    filtered_peptides_by_length = {}
     for peplen in range(minlength, maxlength):
         peptide_gen = generator.generate_peptides_from_proteins(prots, peplen)
 
@@ -730,26 +1723,17 @@ def make_predictions_from_variants(
         peptides = [p for p in peptides_var if p.is_created_by_variant()]
 
         # filter out self peptides
-        selfies = [str(p) for p in peptides if protein_db.exists(str(p))]
-        filtered_peptides = [p for p in peptides if str(p) not in selfies]
+        filtered_peptides = filter_self_peptides(peptides, protein_db)
 
         all_peptides = all_peptides + peptides
         all_peptides_filtered = all_peptides_filtered + filtered_peptides
+        filtered_peptides_by_length[peplen] = filtered_peptides
 
-        results = []
-
-        if len(filtered_peptides) > 0:
-            for method, version in methods.items():
-                try:
-                    predictor = EpitopePredictorFactory(method, version=version)
-                    results.extend([predictor.predict(filtered_peptides, alleles=alleles)])
-                except:
-                    logger.warning(
-                        "Prediction for length {length} and allele {allele} not possible with {method} version {version}.".format(
-                            length=peplen, allele=",".join([str(a) for a in alleles]), method=method, version=version
-                        )
-                    )
+    predictions = predict_peptides_by_length(
+        methods, filtered_peptides_by_length, alleles, cross_length_batch_size, num_workers
+    )
 
+    for peplen, results in predictions.items():
         # merge dataframes for multiple predictors
         if len(results) > 1:
             df = results[0].merge_results(results[1:])
@@ -769,62 +1753,28 @@ def make_predictions_from_variants(
         df.reset_index(inplace=True)
         df = df.rename(columns={"Method": "method", "Peptides": "sequence"})
 
-        for a in alleles:
-            conv_allele = "%s_%s%s" % (a.locus, a.supertype, a.subtype)
-            allele_string_map["%s_%s" % (a, peplen)] = "%s_%i" % (conv_allele, peplen)
-            max_values_matrices["%s_%i" % (conv_allele, peplen)] = get_matrix_max_score(conv_allele, peplen)
-
-        pep_to_variants = create_peptide_variant_dictionary(df["sequence"].tolist())
-
+        # annotate each unique peptide once and join the annotations onto all prediction rows
+        annotations, peptide_variants = create_peptide_annotation_table(df["sequence"])
         df["length"] = df["sequence"].map(len)
-        df["chr"] = df["sequence"].map(lambda x: create_variant_chr_column_value(x, pep_to_variants))
-        df["pos"] = df["sequence"].map(lambda x: create_variant_pos_column_value(x, pep_to_variants))
-        df["gene"] = df["sequence"].map(lambda x: create_gene_column_value(x, pep_to_variants))
-        df["transcripts"] = df["sequence"].map(create_transcript_column_value)
-        df["proteins"] = df["sequence"].map(create_protein_column_value)
-        df["variant type"] = df["sequence"].map(lambda x: create_variant_type_column_value(x, pep_to_variants))
-        df["synonymous"] = df["sequence"].map(lambda x: create_variant_syn_column_value(x, pep_to_variants))
-        df["homozygous"] = df["sequence"].map(lambda x: create_variant_hom_column_value(x, pep_to_variants))
-        df["variant details (genomic)"] = df["sequence"].map(
-            lambda x: create_mutationsyntax_genome_column_value(x, pep_to_variants)
-        )
-        df["variant details (protein)"] = df["sequence"].map(
-            lambda x: create_mutationsyntax_column_value(x, pep_to_variants)
+        df = df.join(annotations, on=df["sequence"].map(str))
+        df.insert(
+            df.columns.get_loc("transcripts") + 1,
+            "proteins",
+            create_protein_column(df["sequence"], transcriptProteinTable),
         )
 
-        for c in df.columns:
-            if ("HLA-" in str(c) or "H-2-" in str(c)) and "Score" in str(c):
-                idx = df.columns.get_loc(c)
-                allele = c.rstrip(" Score")
-                df[c] = df[c].round(4)
-                df.insert(
-                    idx + 1,
-                    "%s affinity" % allele,
-                    df.apply(
-                        lambda x: create_affinity_values(
-                            allele, int(x["length"]), float(x[c]), x["method"], max_values_matrices, allele_string_map
-                        ),
-                        axis=1,
-                    ),
-                )
-                df.insert(
-                    idx + 2,
-                    "%s binder" % allele,
-                    df.apply(
-                        lambda x: create_binder_values(float(x["%s Rank" % allele]), x["method"], tool_thresholds)
-                        if "netmhc" in x["method"] and not use_affinity_thresholds
-                        else create_binder_values(float(x["%s affinity" % allele]), x["method"], tool_thresholds),
-                        axis=1,
-                    ),
-                )
+        insert_affinity_binder_columns(df, allele_models, tool_thresholds, use_affinity_thresholds)
 
         df.columns = df.columns.str.replace("Score", "score")
         df.columns = df.columns.str.replace("Rank", "rank")
 
-        for col in set(metadata):
-            df[col] = df.apply(lambda row: create_metadata_column_value(row, col, pep_to_variants), axis=1)
+        if variant_metadata.columns:
+            df = df.join(create_metadata_table(peptide_variants, variant_metadata), on=df["sequence"].map(str))
 
-        pred_dataframes.append(df)
+        if result_writer is not None:
+            result_writer.write(df)
+        else:
+            pred_dataframes.append(df)
 
     statistics = {
         "prediction_methods": [method + "-" + version for method, version in methods.items()],
@@ -837,43 +1787,36 @@ def make_predictions_from_variants(
 
 
 def make_predictions_from_peptides(
-    peptides, methods, tool_thresholds, use_affinity_thresholds, alleles, protein_db, identifier, metadata
+    peptides,
+    methods,
+    tool_thresholds,
+    use_affinity_thresholds,
+    alleles,
+    protein_db,
+    identifier,
+    peptide_metadata,
+    cross_length_batch_size=0,
+    num_workers=1,
+    result_writer=None,
 ):
-    # dictionaries for syfpeithi matrices max values and allele mapping
-    max_values_matrices = {}
-    allele_string_map = {}
+    # mapping of alleles to syfpeithi matrices
+    allele_models = get_allele_models(alleles)
 
     # list to hold dataframes for all predictions
     pred_dataframes = []
 
     # filter out self peptides if specified
-    selfies = [str(p) for p in peptides if protein_db.exists(str(p))]
-    peptides_filtered = [p for p in peptides if str(p) not in selfies]
+    peptides_filtered = filter_self_peptides(peptides, protein_db)
 
-    # sort peptides by length (for predictions)
+    # sort peptides by length (for predictions), only the unique sequences are passed to the predictors
     sorted_peptides = {}
 
-    for p in peptides_filtered:
-        length = len(str(p))
-        if length in sorted_peptides:
-            sorted_peptides[length].append(p)
-        else:
-            sorted_peptides[length] = [p]
+    for sequence in dict.fromkeys(peptides_filtered):
+        sorted_peptides.setdefault(len(sequence), []).append(Peptide(sequence))
 
-    for peplen in sorted_peptides:
-        all_peptides_filtered = sorted_peptides[peplen]
-        results = []
-        for method, version in methods.items():
-            try:
-                predictor = EpitopePredictorFactory(method, version=version)
-                results.extend([predictor.predict(all_peptides_filtered, alleles=alleles)])
-            except:
-                logger.warning(
-                    "Prediction for length {length} and allele {allele} not possible with {method} version {version}. No model available.".format(
-                        length=peplen, allele=",".join([str(a) for a in alleles]), method=method, version=version
-                    )
-                )
+    predictions = predict_peptides_by_length(methods, sorted_peptides, alleles, cross_length_batch_size, num_workers)
 
+    for peplen, results in predictions.items():
         # merge dataframes for multiple predictors
         if len(results) > 1:
             df = results[0].merge_results(results[1:])
@@ -895,11 +1838,6 @@ def make_predictions_from_peptides(
         # create column containing the peptide lengths
         df.insert(2, "length", df["sequence"].map(len))
 
-        for a in alleles:
-            conv_allele = "%s_%s%s" % (a.locus, a.supertype, a.subtype)
-            allele_string_map["%s_%s" % (a, peplen)] = "%s_%i" % (conv_allele, peplen)
-            max_values_matrices["%s_%i" % (conv_allele, peplen)] = get_matrix_max_score(conv_allele, peplen)
-
         mandatory_columns = [
             "chr",
             "pos",
@@ -913,45 +1851,19 @@ def make_predictions_from_peptides(
             "variant details (protein)",
         ]
 
-        for header in mandatory_columns:
-            if header not in metadata:
-                df[header] = np.nan
-            else:
-                df[header] = df.apply(lambda row: row[0].get_metadata(header)[0], axis=1)
-
-        for c in list(set(metadata) - set(mandatory_columns)):
-            df[c] = df.apply(lambda row: row[0].get_metadata(c)[0], axis=1)
-
-        for c in df.columns:
-            if ("HLA-" in str(c) or "H-2-" in str(c)) and "Score" in str(c):
-                idx = df.columns.get_loc(c)
-                allele = c.rstrip(" Score")
-                df[c] = df[c].round(4)
-                df.insert(
-                    idx + 1,
-                    "%s affinity" % allele,
-                    df.apply(
-                        lambda x: create_affinity_values(
-                            allele, int(x["length"]), float(x[c]), x["method"], max_values_matrices, allele_string_map
-                        ),
-                        axis=1,
-                    ),
-                )
-                df.insert(
-                    idx + 2,
-                    "%s binder" % allele,
-                    df.apply(
-                        lambda x: create_binder_values(float(x["%s Rank" % allele]), x["method"], tool_thresholds)
-                        if "netmhc" in x["method"] and not use_affinity_thresholds
-                        else create_binder_values(float(x["%s affinity" % allele]), x["method"], tool_thresholds),
-                        axis=1,
-                    ),
-                )
+        # merge the (meta)data of the peptide input back by sequence
+        extra_columns = [c for c in peptide_metadata.columns if c not in mandatory_columns]
+        df = df.join(peptide_metadata.reindex(columns=mandatory_columns + extra_columns), on=df["sequence"].map(str))
+
+        insert_affinity_binder_columns(df, allele_models, tool_thresholds, use_affinity_thresholds)
 
         df.columns = df.columns.str.replace("Score", "score")
         df.columns = df.columns.str.replace("Rank", "rank")
 
-        pred_dataframes.append(df)
+        if result_writer is not None:
+            result_writer.write(df)
+        else:
+            pred_dataframes.append(df)
 
     # write prediction statistics
     statistics = {
@@ -963,6 +1875,186 @@ def make_predictions_from_peptides(
     return pred_dataframes, statistics
 
 
+def create_binder_statistics():
+    return {
+        "number_of_predictions": 0,
+        "number_of_binders": 0,
+        "number_of_nonbinders": 0,
+        "binders": set(),
+        "non_binders": set(),
+        "alleles": {},
+        "methods": {},
+    }
+
+
+def update_binder_statistics(binder_statistics, df):
+    """
+    adds the binders and non-binders of finalized predictions to the binder statistics, overall and per allele
+    and prediction method
+    a prediction is a binder if it binds any allele, a sequence is a binder if any of its predictions is a binder
+    :param dict binder_statistics: statistics of previous predictions (see create_binder_statistics)
+    :param df: DataFrame with finalized predictions
+    """
+    binder_cols = [col for col in df.columns if "binder" in col and col != "binder"]
+    # binder columns hold True/False or NaN if no value is available
+    flags = df[binder_cols].eq(True)
+    flags.columns = [col[: -len(" binder")] for col in binder_cols]
+    flags["binder"] = flags.any(axis=1)
+    methods = df["method"].astype(str).to_numpy()
+    sequences = df["sequence"].map(str).to_numpy()
+
+    number_of_binders = int(flags["binder"].sum())
+    binder_statistics["number_of_predictions"] += len(df)
+    binder_statistics["number_of_binders"] += number_of_binders
+    binder_statistics["number_of_nonbinders"] += len(df) - number_of_binders
+
+    # one pass over the predictions per (method, sequence), all other breakdowns are derived from it
+    method_sequence_flags = flags.groupby([methods, sequences], sort=False).any()
+    sequence_flags = method_sequence_flags.groupby(level=1, sort=False).any()
+    binder_statistics["binders"].update(sequence_flags.index[sequence_flags["binder"]])
+    binder_statistics["non_binders"].update(sequence_flags.index[~sequence_flags["binder"]])
+    for allele in flags.columns.drop("binder"):
+        allele_statistics = binder_statistics["alleles"].setdefault(allele, {"number_of_binders": 0, "binders": set()})
+        allele_statistics["number_of_binders"] += int(flags[allele].sum())
+        allele_statistics["binders"].update(sequence_flags.index[sequence_flags[allele]])
+
+    method_counts = flags["binder"].groupby(methods, sort=False).agg(["size", "sum"])
+    for method, method_flags in method_sequence_flags["binder"].groupby(level=0, sort=False):
+        method_statistics = binder_statistics["methods"].setdefault(
+            method, {"number_of_predictions": 0, "number_of_binders": 0, "binders": set()}
+        )
+        method_statistics["number_of_predictions"] += int(method_counts.at[method, "size"])
+        method_statistics["number_of_binders"] += int(method_counts.at[method, "sum"])
+        method_statistics["binders"].update(method_flags.index.get_level_values(1)[method_flags.to_numpy()])
+
+
+def get_binder_breakdown(breakdown_statistics, sketch_type="list"):
+    """
+    returns the per-allele or per-method binder statistics in report format
+    :param dict breakdown_statistics: binder statistics per allele or method (see update_binder_statistics)
+    :param str sketch_type: representation of the unique binder sequences (see create_sketch)
+    :return: dictionary with counts and unique binder sequences per allele or method
+    """
+    return {
+        key: {
+            **{name: value for name, value in counts.items() if name != "binders"},
+            "number_of_unique_binders": create_sketch(sorted(counts["binders"]), sketch_type),
+        }
+        for key, counts in breakdown_statistics.items()
+    }
+
+
+def read_vcf_metadata_columns(filename):
+    """
+    returns the names of all (meta)data columns defined in the header of a vcf file (see iter_vcf_variants)
+    :param filename: /path/to/file
+    :return: list of (meta)data column names
+    """
+    with open(filename) as tsvfile:
+        vcf_reader = vcf.Reader(tsvfile)
+        info_columns = [key for key in vcf_reader.infos.keys() if key not in ["ANN", "CSQ", "vardbid"]]
+        format_columns = [f"{sample}.{key}" for sample in vcf_reader.samples for key in vcf_reader.formats.keys()]
+    return ["vardbid"] + info_columns + format_columns
+
+
+def get_result_columns(leading_columns, alleles, methods, metadata_columns, annotation_columns):
+    """
+    returns the fixed column schema of the result file, the same order as the result of all predictions at once
+    :param list leading_columns: columns at the beginning of the result
+    :param list alleles: epytope alleles
+    :param dict methods: prediction methods
+    :param list metadata_columns: (meta)data columns of the variants or peptides
+    :param list annotation_columns: columns of additional annotations (quantification, expression, ligandomics)
+    :return: list of column names
+    """
+    # ranks are only reported by the netmhc family tools
+    score_types = ["affinity", "binder", "score"] + (["rank"] if any("netmhc" in m for m in methods) else [])
+    allele_columns = [f"{a} {score_type}" for a in alleles for score_type in score_types]
+    columns = set(PEPTIDE_ANNOTATION_COLUMNS + ["proteins"] + list(metadata_columns) + allele_columns)
+    return leading_columns + sorted(columns - set(leading_columns)) + annotation_columns + ["binder"]
+
+
+class PredictionResultWriter:
+    """
+    appends finalized predictions to the result file batch by batch with a fixed column schema and accumulates the
+    binder statistics of the written predictions, so only one batch of predictions is held in memory
+    results are written as TSV or Parquet (one row group per batch)
+    """
+
+    def __init__(self, filename, columns, finalize, output_format="tsv"):
+        """
+        :param str filename: result file, created with the first batch
+        :param list columns: column schema of the result file
+        :param finalize: function that adds the result columns to the predictions of one batch
+        :param str output_format: tsv or parquet
+        """
+        self.filename = filename
+        self.columns = columns
+        self.finalize = finalize
+        self.output_format = output_format
+        self.result_file = None
+        self.statistics = create_binder_statistics()
+
+    def write(self, df):
+        df = self.finalize(df)
+        update_binder_statistics(self.statistics, df)
+        unknown_columns = [c for c in df.columns if c not in self.columns]
+        if unknown_columns:
+            logger.warning(f"Columns {', '.join(unknown_columns)} are not part of the result schema and not written.")
+        df = df.reindex(columns=self.columns)
+        header = self.result_file is None
+        if self.output_format == "parquet":
+            schema = get_result_schema(self.columns)
+            if header:
+                self.result_file = open_parquet_writer(self.filename, schema)
+            self.result_file.write_table(to_result_table(df, schema))
+        else:
+            if header:
+                self.result_file = open(self.filename, "w")
+            df.to_csv(self.result_file, sep="\t", index=False, header=header)
+
+    def close(self):
+        if self.result_file is not None:
+            self.result_file.close()
+        elif self.statistics["number_of_predictions"] == 0:
+            logger.error("No predictions available.")
+
+
+def merge_prediction_statistics(statistics, batch_statistics):
+    """
+    merges the prediction statistics of one batch of variants into the statistics of previous batches
+    :param dict statistics: statistics of previous batches (can be empty)
+    :param dict batch_statistics: statistics of the current batch
+    :return: merged statistics
+    """
+    if not statistics:
+        return batch_statistics
+    statistics["number_of_variants"] += batch_statistics["number_of_variants"]
+    statistics["number_of_unique_peptides"].extend(batch_statistics["number_of_unique_peptides"])
+    statistics["number_of_unique_peptides_after_filtering"].extend(
+        batch_statistics["number_of_unique_peptides_after_filtering"]
+    )
+    return statistics
+
+
+def write_protein_fasta(proteins, outfile):
+    """
+    writes mutated protein sequences with their protein and coding changes in the header
+    :param list proteins: epytope proteins
+    :param outfile: FASTA file handle
+    """
+    for p in proteins:
+        variants = []
+        for v in p.vars:
+            variants = variants + p.vars[v]
+        c = [x.coding.values() for x in variants]
+        cf = list(itertools.chain.from_iterable(c))
+        cds = ",".join([y.cdsMutationSyntax for y in set(cf)])
+        aas = ",".join([y.aaMutationSyntax for y in set(cf)])
+        outfile.write(f">{p.transcript_id}:{aas}:{cds}\n")
+        outfile.write(f"{str(p)}\n")
+
+
 def __main__():
     parser = argparse.ArgumentParser(
         description="""EPAA - Epitope Prediction And Annotation \n Pipeline for prediction of MHC class I and II epitopes from variants or peptides for a list of specified alleles.
@@ -1011,7 +2103,18 @@ def __main__():
     parser.add_argument(
         "-fo", "--fasta_output", help="Create FASTA file with protein sequences", required=False, action="store_true"
     )
-    parser.add_argument("-rp", "--reference_proteome", help="Reference proteome for self-filtering", required=False)
+    parser.add_argument(
+        "-rp",
+        "--reference_proteome",
+        help="Reference proteome for self-filtering (FASTA file, directory with FASTA files or k-mer index built with build_kmer_index.py)",
+        required=False,
+    )
+    parser.add_argument(
+        "-lr",
+        "--local_reference",
+        help="Local reference built with build_reference_index.py, used instead of BioMart to retrieve transcript and protein information",
+        required=False,
+    )
     parser.add_argument("-gr", "--gene_reference", help="List of gene IDs for ID mapping.", required=False)
     parser.add_argument("-pq", "--protein_quantification", help="File with protein quantification values")
     parser.add_argument("-ge", "--gene_expression", help="File with expression analysis results")
@@ -1023,12 +2126,107 @@ def __main__():
         "--ligandomics_id",
         help="Comma separated file with peptide sequence, score and median intensity of a ligandomics identification run.",
     )
+    parser.add_argument(
+        "-sm",
+        "--stream_variants",
+        help="Read variants record by record and run predictions per batch of transcript groups, combine with --stream_output to keep memory bounded",
+        required=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "-sb",
+        "--stream_batch_size",
+        help="Minimum number of variants per prediction batch when streaming variants",
+        required=False,
+        type=int,
+        default=500,
+    )
+    parser.add_argument(
+        "-ts",
+        "--max_transcript_span",
+        help="Maximum genomic span (bp) of a transcript, used to release transcript groups when streaming variants",
+        required=False,
+        type=int,
+        default=2500000,
+    )
+    parser.add_argument(
+        "-mh",
+        "--max_haplotypes",
+        help="Maximum number of haplotypes (combinations of heterozygous variants) generated per transcript",
+        required=False,
+        type=int,
+        default=1024,
+    )
+    parser.add_argument(
+        "-hm",
+        "--haplotype_memory",
+        help="Estimated memory budget (MB) for the haplotypes of one transcript",
+        required=False,
+        type=int,
+        default=1024,
+    )
+    parser.add_argument(
+        "-cb",
+        "--cross_length_batch_size",
+        help="Predict peptides of all lengths in batches of this size with methods that support mixed lengths (mhcflurry, mhcnuggets), 0 predicts per length",
+        required=False,
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "-nw",
+        "--num_workers",
+        help="Number of worker processes used to run the predictions of different methods and lengths in parallel",
+        required=False,
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-pc",
+        "--prediction_cache",
+        help="SQLite file used to cache prediction scores across runs, created if it does not exist, must be on local storage",
+        required=False,
+    )
+    parser.add_argument(
+        "-ps",
+        "--prediction_cache_size",
+        help="Maximum size (MB) of the prediction cache, least recently used scores are evicted beyond",
+        required=False,
+        type=int,
+        default=10240,
+    )
+    parser.add_argument(
+        "-so",
+        "--stream_output",
+        help="Write the predictions of each batch to the result file as soon as they are available, with a fixed column schema derived from the inputs",
+        required=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "-of",
+        "--output_format",
+        help="Format of the result file, Parquet and Feather are typed, dictionary-encoded and compressed (requires pyarrow)",
+        required=False,
+        choices=OUTPUT_FORMATS,
+        default="tsv",
+    )
+    parser.add_argument(
+        "-rs",
+        "--report_sketch",
+        help="Representation of peptide sets in the report: plain lists, exact 64-bit hash sets or HyperLogLog sketches",
+        required=False,
+        choices=SKETCH_TYPES,
+        default="list",
+    )
     parser.add_argument("-v", "--version", help="Script version", action="version", version=VERSION)
     args = parser.parse_args()
 
     if len(sys.argv) <= 1:
         parser.print_help()
         sys.exit("Provide at least one argument to epaa.py.")
+    if args.stream_output and args.output_format == "feather":
+        parser.error("Feather results are written at once, use --output_format parquet with --stream_output.")
+    check_columnar_support(args.output_format)
 
     filehandler = logging.FileHandler(f"{args.identifier}_prediction.log")
     filehandler.setLevel(logging.DEBUG)
@@ -1038,43 +2236,76 @@ def __main__():
     logger.info("Running Epitope Prediction And Annotation version: " + str(VERSION))
     logger.info("Starting predictions at " + str(datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
 
-    metadata = []
-    proteins = []
+    cache_fs_type = is_network_filesystem(args.prediction_cache) if args.prediction_cache else None
+    if cache_fs_type is not None:
+        logger.warning(
+            f"Prediction cache {args.prediction_cache} is located on a network file system ({cache_fs_type}) without "
+            "reliable file locking. The cache is disabled, use a path on local storage."
+        )
+        args.prediction_cache = None
+    if args.prediction_cache:
+        PREDICTION_CACHE["path"] = args.prediction_cache
+        PREDICTION_CACHE["max_bytes"] = args.prediction_cache_size * 1024**2
 
-    global transcriptProteinTable
     global transcriptSwissProtMap
 
-    # initialize MartsAdapter
+    # initialize MartsAdapter, or the adapter of a local reference to run without BioMart access
     # in previous version, these were the defaults "GRCh37": "http://feb2014.archive.ensembl.org" (broken)
     # "GRCh38": "http://apr2018.archive.ensembl.org" (different dataset table scheme, could potentially be fixed on BiomartAdapter level if needed )
-    ma = MartsAdapter(biomart=args.genome_reference)
+    if args.local_reference:
+        ma = LocalReferenceAdapter(args.local_reference)
+    else:
+        ma = MartsAdapter(biomart=args.genome_reference)
 
     # read in variants or peptides
     if args.peptides:
         logger.info("Running epaa for peptides...")
-        peptides, metadata = read_peptide_input(args.peptides)
+        peptides, peptide_metadata = read_peptide_input(args.peptides)
     else:
         logger.info("Running epaa for variants...")
-        if args.somatic_mutations.endswith(".vcf"):
-            variant_list, transcripts, metadata = read_vcf(args.somatic_mutations)
-            transcripts = list(set(transcripts))
-        else:
+        if not args.somatic_mutations.endswith(".vcf"):
             raise ValueError("File is not in VCF format. Please provide a VCF file.")
+        if args.stream_variants:
+            # metadata is filled while the variants are read
+            variant_metadata = VariantMetadata()
+            variant_batches = iter_variant_batches(
+                iter_vcf_transcript_groups(
+                    iter_vcf_variants(args.somatic_mutations, variant_metadata=variant_metadata),
+                    args.max_transcript_span,
+                ),
+                args.stream_batch_size,
+            )
+        else:
+            variant_list, transcripts, variant_metadata = read_vcf(args.somatic_mutations)
+            variant_batches = [variant_list] if transcripts else []
 
     # get the alleles
     alleles = [Allele(a) for a in args.alleles.split(";")]
 
     # create protein db instance for filtering self-peptides
-    up_db = UniProtDB("sp")
+    protein_db = None
     if args.filter_self:
-        logger.info("Reading human proteome")
-
-        if os.path.isdir(args.reference_proteome):
-            for filename in os.listdir(args.reference_proteome):
-                if filename.endswith(".fasta") or filename.endswith(".fsa"):
-                    up_db.read_seqs(os.path.join(args.reference_proteome, filename))
+        if os.path.isfile(os.path.join(args.reference_proteome, KMER_INDEX_FILE)):
+            logger.info("Opening k-mer index of human proteome")
+            protein_db = load_kmer_index(args.reference_proteome)
+            # the lengths of given peptides are checked when they are filtered
+            missing_lengths = sorted(set(range(int(args.min_length), int(args.max_length) + 1)) - set(protein_db))
+            if not args.peptides and missing_lengths:
+                logger.error(
+                    f"The k-mer index {args.reference_proteome} contains no peptides of length {','.join(map(str, missing_lengths))}."
+                )
+                sys.exit(
+                    "The k-mer index of the reference proteome does not cover the peptide lengths. Rebuild it with build_kmer_index.py and --min_length/--max_length covering all peptide lengths."
+                )
         else:
-            up_db.read_seqs(args.reference_proteome)
+            logger.info("Reading human proteome")
+            protein_db = UniProtDB("sp")
+            if os.path.isdir(args.reference_proteome):
+                for filename in os.listdir(args.reference_proteome):
+                    if filename.endswith(".fasta") or filename.endswith(".fsa"):
+                        protein_db.read_seqs(os.path.join(args.reference_proteome, filename))
+            else:
+                protein_db.read_seqs(args.reference_proteome)
 
     selected_methods = [item.split("-")[0] if "mhcnuggets" not in item else item for item in args.tools.split(",")]
     with open(args.versions) as versions_file:
@@ -1117,188 +2348,255 @@ def __main__():
                 else:
                     raise ValueError("Tool " + tool + " in specified threshold file is not supported")
 
-    # Distinguish between prediction for peptides and variants
-    if args.peptides:
-        pred_dataframes, statistics = make_predictions_from_peptides(
-            peptides, methods, thresholds, args.use_affinity_thresholds, alleles, up_db, args.identifier, metadata
-        )
-    elif len(transcripts) == 0:
-        logger.warning(f"No transcripts found for variants in {args.somatic_mutations}")
-        pred_dataframes = []
-        statistics = {}
-        all_peptides_filtered = []
-        proteins = []
-    else:
-        # use function provided by epytope to retrieve protein IDs (different systems) for transcript IDs
-        transcriptProteinTable = ma.get_protein_ids_from_transcripts(transcripts, type=EIdentifierTypes.ENSEMBL)
-        pred_dataframes, statistics, all_peptides_filtered, proteins = make_predictions_from_variants(
-            variant_list,
-            methods,
-            thresholds,
-            args.use_affinity_thresholds,
-            alleles,
-            int(args.min_length),
-            int(args.max_length) + 1,
-            ma,
-            up_db,
-            args.identifier,
-            metadata,
-            transcriptProteinTable,
-        )
-
-    # concat dataframes for all peptide lengths
-    try:
-        complete_df = pd.concat(pred_dataframes, sort=True)
-        # replace method names with method names with version
-        complete_df["method"] = complete_df["method"].apply(lambda x: x.lower() + "-" + methods[x.lower()])
-        predictions_available = True
-    except:
-        complete_df = pd.DataFrame()
-        predictions_available = False
-        logger.error("No predictions available.")
-
-    # include wild type sequences to dataframe if specified
-    if args.wild_type:
-        if args.peptides:
-            logger.warning("Wildtype sequence generation not available with peptide input.")
-            pass
-        wt_sequences = generate_wt_seqs(all_peptides_filtered)
-        complete_df["wt sequence"] = complete_df.apply(
-            lambda row: create_wt_seq_column_value(row, wt_sequences), axis=1
-        )
-        columns_tiles = [
-            "sequence",
-            "wt sequence",
-            "length",
-            "chr",
-            "pos",
-            "gene",
-            "transcripts",
-            "proteins",
-            "variant type",
-            "method",
-        ]
-    # Change the order (the index) of the columns
-    else:
-        columns_tiles = [
-            "sequence",
-            "length",
-            "chr",
-            "pos",
-            "gene",
-            "transcripts",
-            "proteins",
-            "variant type",
-            "method",
-        ]
-
-    for c in complete_df.columns:
-        if c not in columns_tiles:
-            columns_tiles.append(c)
-    complete_df = complete_df.reindex(columns=columns_tiles)
-
-    binder_cols = [col for col in complete_df.columns if "binder" in col]
-
-    binders = []
-    non_binders = []
-    pos_predictions = []
-    neg_predictions = []
+    # fixed order of the leading result columns
+    columns_tiles = [
+        "sequence",
+        "wt sequence",
+        "length",
+        "chr",
+        "pos",
+        "gene",
+        "transcripts",
+        "proteins",
+        "variant type",
+        "method",
+    ]
+    if not args.wild_type:
+        columns_tiles.remove("wt sequence")
 
-    for i, r in complete_df.iterrows():
-        binder = False
-        for c in binder_cols:
-            if r[c] is True:
-                binder = True
-                continue
-        if binder:
-            binders.append(str(r["sequence"]))
-            pos_predictions.append(str(r["sequence"]))
-        else:
-            neg_predictions.append(str(r["sequence"]))
-            if str(r["sequence"]) not in binders:
-                non_binders.append(str(r["sequence"]))
-    # parse protein quantification results, annotate proteins for samples
+    # read inputs of additional result annotations
+    annotation_columns = []
     if args.protein_quantification is not None:
         protein_quant = read_protein_quant(args.protein_quantification)
         first_entry = protein_quant[protein_quant.keys()[0]]
-        for k in first_entry.keys():
-            complete_df[f"{k} log2 protein LFQ intensity"] = complete_df.apply(
-                lambda row: create_quant_column_value_for_result(row, protein_quant, transcriptSwissProtMap, k), axis=1
-            )
-    # parse (differential) expression analysis results, annotate features (genes/transcripts)
+        annotation_columns.extend([f"{k} log2 protein LFQ intensity" for k in first_entry.keys()])
     if args.gene_expression is not None:
-        fold_changes = read_diff_expression_values(args.gene_expression)
+        expression_values = read_diff_expression_values(args.gene_expression)
         gene_id_lengths = {}
-        col_name = "RNA expression (RPKM)"
-
+        gene_name_lengths = {}
         with open(args.gene_reference) as gene_list:
             for l in gene_list:
                 ids = l.split("\t")
-                gene_id_in_df = complete_df.iloc[1]["gene"]
-                if "ENSG" in gene_id_in_df:
-                    gene_id_lengths[ids[0]] = float(ids[2].strip())
-                else:
-                    gene_id_lengths[ids[1]] = float(ids[2].strip())
-        deseq = False
-        # add column to result dataframe
-        complete_df[col_name] = complete_df.apply(
-            lambda row: create_expression_column_value_for_result(row, fold_changes, deseq, gene_id_lengths), axis=1
+                gene_id_lengths[ids[0]] = float(ids[2].strip())
+                gene_name_lengths[ids[1]] = float(ids[2].strip())
+        # genes are identified by Ensembl IDs or by names, decided once for all batches from the expression values
+        gene_lengths = (
+            gene_id_lengths if any(feature.startswith("ENSG") for feature in expression_values) else gene_name_lengths
         )
+        annotation_columns.append("RNA expression (RPKM)")
     if args.diff_gene_expression is not None:
-        gene_id_lengths = {}
         fold_changes = read_diff_expression_values(args.diff_gene_expression)
-        col_name = "RNA normal_vs_tumor.log2FoldChange"
-        deseq = True
-
-        # add column to result dataframe
-        complete_df[col_name] = complete_df.apply(
-            lambda row: create_expression_column_value_for_result(row, fold_changes, deseq, gene_id_lengths), axis=1
-        )
-    # parse ligandomics identification results, annotate peptides for samples
+        annotation_columns.append("RNA normal_vs_tumor.log2FoldChange")
     if args.ligandomics_id is not None:
         lig_id = read_lig_ID_values(args.ligandomics_id)
-        # add columns to result dataframe
-        complete_df["ligand score"] = complete_df.apply(
-            lambda row: create_ligandomics_column_value_for_result(row, lig_id, 0, False), axis=1
+        annotation_columns.extend(["ligand score", "ligand intensity"])
+        if args.wild_type != None:
+            annotation_columns.extend(["wt ligand score", "wt ligand intensity"])
+
+    def finalize_predictions(df):
+        """
+        adds method versions, wild type sequences and additional annotations to the predictions of one batch or of
+        all batches
+        :param df: DataFrame with the predictions
+        :return: DataFrame with the result columns
+        """
+        # replace method names with method names with version
+        df["method"] = df["method"].apply(lambda x: x.lower() + "-" + methods[x.lower()])
+
+        # include wild type sequences to dataframe if specified
+        if args.wild_type:
+            if args.peptides:
+                logger.warning("Wildtype sequence generation not available with peptide input.")
+            df["wt sequence"] = create_wt_seq_column(df["sequence"])
+
+        # Change the order (the index) of the columns
+        df = df.reindex(columns=columns_tiles + [c for c in df.columns if c not in columns_tiles])
+
+        # parse protein quantification results, annotate proteins for samples
+        if args.protein_quantification is not None:
+            for k in first_entry.keys():
+                df[f"{k} log2 protein LFQ intensity"] = df.apply(
+                    lambda row: create_quant_column_value_for_result(row, protein_quant, transcriptSwissProtMap, k),
+                    axis=1,
+                )
+        # parse (differential) expression analysis results, annotate features (genes/transcripts)
+        if args.gene_expression is not None:
+            df["RNA expression (RPKM)"] = df.apply(
+                lambda row: create_expression_column_value_for_result(row, expression_values, False, gene_lengths),
+                axis=1,
+            )
+        if args.diff_gene_expression is not None:
+            df["RNA normal_vs_tumor.log2FoldChange"] = df.apply(
+                lambda row: create_expression_column_value_for_result(row, fold_changes, True, {}), axis=1
+            )
+        # parse ligandomics identification results, annotate peptides for samples
+        if args.ligandomics_id is not None:
+            df["ligand score"] = df.apply(
+                lambda row: create_ligandomics_column_value_for_result(row, lig_id, 0, False), axis=1
+            )
+            df["ligand intensity"] = df.apply(
+                lambda row: create_ligandomics_column_value_for_result(row, lig_id, 1, False), axis=1
+            )
+            if args.wild_type != None:
+                df["wt ligand score"] = df.apply(
+                    lambda row: create_ligandomics_column_value_for_result(row, lig_id, 0, True), axis=1
+                )
+                df["wt ligand intensity"] = df.apply(
+                    lambda row: create_ligandomics_column_value_for_result(row, lig_id, 1, True), axis=1
+                )
+
+        df["binder"] = df[[col for col in df.columns if "binder" in col]].any(axis=1)
+        return df
+
+    def concat_finalized_predictions(dataframes):
+        """
+        concatenates finalized predictions of several batches, with the column order of finalize_predictions
+        :param list dataframes: finalized predictions
+        :return: DataFrame with the result columns
+        """
+        df = pd.concat(dataframes, sort=True)
+        added_columns = [c for c in annotation_columns + ["binder"] if c in df.columns]
+        return df.reindex(
+            columns=columns_tiles + [c for c in df.columns if c not in columns_tiles + added_columns] + added_columns
+        )
+
+    # with streaming output, each batch of predictions is finalized and written as soon as it is available
+    result_writer = None
+    if args.stream_output:
+        if args.peptides:
+            metadata_columns = list(peptide_metadata.columns)
+        elif args.stream_variants:
+            metadata_columns = read_vcf_metadata_columns(args.somatic_mutations)
+        else:
+            metadata_columns = variant_metadata.columns
+        result_writer = PredictionResultWriter(
+            f"{args.identifier}_prediction_result.{args.output_format}",
+            get_result_columns(columns_tiles, alleles, methods, metadata_columns, annotation_columns),
+            finalize_predictions,
+            args.output_format,
         )
-        complete_df["ligand intensity"] = complete_df.apply(
-            lambda row: create_ligandomics_column_value_for_result(row, lig_id, 1, False), axis=1
+
+    # mutated proteins are written per batch, such that they are not kept until all variants are processed
+    protein_outfile = open(f"{args.identifier}_prediction_proteins.fasta", "w") if args.fasta_output else None
+
+    # without streaming output, streamed batches are finalized right away and only kept as plain result frames,
+    # which releases the peptides and proteins of a batch before the next one starts
+    finalize_batches = args.stream_variants and not args.peptides and result_writer is None
+    if finalize_batches:
+        logger.info(
+            "Predictions of all batches are kept until all variants are processed, use --stream_output to write "
+            "them per batch."
         )
 
-        if args.wild_type != None:
-            complete_df["wt ligand score"] = complete_df.apply(
-                lambda row: create_ligandomics_column_value_for_result(row, lig_id, 0, True), axis=1
+    # Distinguish between prediction for peptides and variants
+    if args.peptides:
+        pred_dataframes, statistics = make_predictions_from_peptides(
+            peptides,
+            methods,
+            thresholds,
+            args.use_affinity_thresholds,
+            alleles,
+            protein_db,
+            args.identifier,
+            peptide_metadata,
+            args.cross_length_batch_size,
+            args.num_workers,
+            result_writer,
+        )
+    else:
+        pred_dataframes = []
+        statistics = {}
+        for variants in variant_batches:
+            transcripts = list(set(trans_id for variant in variants for trans_id in variant.coding.keys()))
+            # use function provided by epytope to retrieve protein IDs (different systems) for transcript IDs
+            transcriptProteinTable = ma.get_protein_ids_from_transcripts(transcripts, type=EIdentifierTypes.ENSEMBL)
+            (
+                batch_dataframes,
+                batch_statistics,
+                batch_peptides_filtered,
+                batch_proteins,
+            ) = make_predictions_from_variants(
+                variants,
+                methods,
+                thresholds,
+                args.use_affinity_thresholds,
+                alleles,
+                int(args.min_length),
+                int(args.max_length) + 1,
+                ma,
+                protein_db,
+                args.identifier,
+                variant_metadata,
+                transcriptProteinTable,
+                args.max_haplotypes,
+                args.haplotype_memory * 1024**2,
+                args.cross_length_batch_size,
+                args.num_workers,
+                result_writer,
             )
-            complete_df["wt ligand intensity"] = complete_df.apply(
-                lambda row: create_ligandomics_column_value_for_result(row, lig_id, 1, True), axis=1
+            if finalize_batches:
+                batch_dataframes = [finalize_predictions(df) for df in batch_dataframes]
+                for df in batch_dataframes:
+                    df["sequence"] = df["sequence"].map(str)
+            pred_dataframes.extend(batch_dataframes)
+            if protein_outfile is not None:
+                write_protein_fasta(batch_proteins, protein_outfile)
+            statistics = merge_prediction_statistics(statistics, batch_statistics)
+            del variants, transcriptProteinTable, batch_dataframes, batch_peptides_filtered, batch_proteins
+        if not statistics:
+            logger.warning(f"No transcripts found for variants in {args.somatic_mutations}")
+
+    if prediction_pool is not None:
+        prediction_pool.shutdown()
+    if args.prediction_cache:
+        logger.info(
+            f"Prediction cache: {PREDICTION_CACHE_COUNTS['hits']} hits, {PREDICTION_CACHE_COUNTS['misses']} misses"
+        )
+
+    if result_writer is not None:
+        result_writer.close()
+        binder_statistics = result_writer.statistics
+    else:
+        binder_statistics = create_binder_statistics()
+        # concat dataframes for all peptide lengths
+        if pred_dataframes:
+            if finalize_batches:
+                complete_df = concat_finalized_predictions(pred_dataframes)
+            else:
+                complete_df = finalize_predictions(pd.concat(pred_dataframes, sort=True))
+            update_binder_statistics(binder_statistics, complete_df)
+            # write dataframe to tsv, parquet or feather
+            write_prediction_results(
+                complete_df, f"{args.identifier}_prediction_result.{args.output_format}", args.output_format
             )
-    # write mutated protein sequences to fasta file
-    if args.fasta_output and predictions_available:
-        with open(f"{args.identifier}_prediction_proteins.fasta", "w") as protein_outfile:
-            for p in proteins:
-                variants = []
-                for v in p.vars:
-                    variants = variants + p.vars[v]
-                c = [x.coding.values() for x in variants]
-                cf = list(itertools.chain.from_iterable(c))
-                cds = ",".join([y.cdsMutationSyntax for y in set(cf)])
-                aas = ",".join([y.aaMutationSyntax for y in set(cf)])
-                protein_outfile.write(f">{p.transcript_id}:{aas}:{cds}\n")
-                protein_outfile.write(f"{str(p)}\n")
-
-    complete_df["binder"] = complete_df[[col for col in complete_df.columns if "binder" in col]].any(axis=1)
-
-    # write dataframe to tsv
-    complete_df.fillna("")
-    if predictions_available:
-        complete_df.to_csv(f"{args.identifier}_prediction_result.tsv", "\t", index=False)
+        else:
+            logger.error("No predictions available.")
+
+    # mutated protein sequences are only kept if there are predictions
+    if protein_outfile is not None:
+        protein_outfile.close()
+        if binder_statistics["number_of_predictions"] == 0:
+            os.remove(protein_outfile.name)
 
     statistics["tool_thresholds"] = thresholds
-    statistics["number_of_predictions"] = len(complete_df)
-    statistics["number_of_binders"] = len(pos_predictions)
-    statistics["number_of_nonbinders"] = len(neg_predictions)
-    statistics["number_of_unique_binders"] = list(set(binders))
-    statistics["number_of_unique_nonbinders"] = list(set(non_binders) - set(binders))
+    statistics["number_of_predictions"] = binder_statistics["number_of_predictions"]
+    statistics["number_of_binders"] = binder_statistics["number_of_binders"]
+    statistics["number_of_nonbinders"] = binder_statistics["number_of_nonbinders"]
+    statistics["number_of_unique_binders"] = list(binder_statistics["binders"])
+    statistics["number_of_unique_nonbinders"] = list(binder_statistics["non_binders"] - binder_statistics["binders"])
+    statistics["binders_per_allele"] = get_binder_breakdown(binder_statistics["alleles"], args.report_sketch)
+    statistics["binders_per_method"] = get_binder_breakdown(binder_statistics["methods"], args.report_sketch)
+    # peptide sets are stored as lists or as compact sketches that merge_jsons.py unions
+    for key in SEQUENCE_SET_KEYS:
+        if key in statistics:
+            statistics[key] = create_sketch(statistics[key], args.report_sketch)
+    statistics["predictor_timings"] = PREDICTOR_TIMINGS
+    statistics["prediction_cache"] = PREDICTION_CACHE_COUNTS
+
+    for method, timings in PREDICTOR_TIMINGS.items():
+        logger.info(
+            f"{method}: model loading {timings['load_seconds']:.2f}s, prediction {timings['predict_seconds']:.2f}s ({timings['predict_calls']} calls)"
+        )
 
     with open(f"{args.identifier}_report.json", "w") as json_out:
         json.dump(statistics, json_out)
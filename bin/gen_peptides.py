@@ -2,67 +2,233 @@
 # Written by Sabrina Krakau, Christopher Mohr and released under the MIT license (2022).
 
 import argparse
+import csv
+import hashlib
+import heapq
+import itertools
+import logging
+import operator
+import os
+import re
+import sys
+import tempfile
+from collections import Counter
 
-import pandas as pd
 from Bio.SeqIO.FastaIO import SimpleFastaParser
-from epytope.Core import Protein, generate_peptides_from_proteins
-
-parser = argparse.ArgumentParser("Generating peptides from protein sequences.")
-parser.add_argument(
-    "-i", "--input", metavar="FILE", type=argparse.FileType("r"), help="FASTA filename containing proteins."
-)
-parser.add_argument(
-    "-o", "--output", metavar="FILE", type=argparse.FileType("w"), help="Output file containing peptides."
-)
-parser.add_argument(
-    "-min", "--min_length", metavar="N", type=int, help="Minimal length of peptides that will be generated."
-)
-parser.add_argument(
-    "-max", "--max_length", metavar="N", type=int, help="Maximum length of peptides that will be generated."
-)
-args = parser.parse_args()
 
+# instantiate global logger object
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.DEBUG)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+# peptides with other characters than the 20 standard amino acids are skipped (same as epytope)
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+INVALID_AMINO_ACIDS = re.compile(f"[^{AMINO_ACIDS}]+")
+PEPTIDE_COLUMNS = ["sequence", "id", "protein_ids", "counts"]
+
+# approximate memory of one buffered peptide occurrence (sequence, dictionary entry and protein reference)
+PEPTIDE_BYTES = 200
+MAX_OPEN_RUNS = 64
 
-def read_protein_fasta(file):
-    # split at first whitespace and use short ID
 
-    collect = set()
+def read_protein_fasta(file):
+    """
+    reads protein sequences, proteins with the same sequence are only used once (first ID)
+    only digests of the sequences are kept to detect duplicates, the proteins are read one after another
+    :param file: FASTA file handle
+    :return: generator of (ID, sequence) tuples in the order of the file
+    """
+    seen = set()
     # iterate over all FASTA entries:
     for _id, seq in SimpleFastaParser(file):
-        # generate element:
-        _id = _id.split(" ")[0]
-
-        try:
-            collect.add(Protein(seq.strip().upper(), transcript_id=_id))
-        except TypeError:
-            collect.add(Protein(seq.strip().upper()))
-    return list(collect)
-
-
-proteins = read_protein_fasta(args.input)
-
-c = 0
-for k in range(args.min_length, args.max_length + 1):
-    peptides = generate_peptides_from_proteins(proteins, k)
-    # get proteins and corresponding counts
-    pd_peptides = pd.DataFrame(
-        [
-            (
-                str(pep),
-                ",".join([prot.transcript_id.split(" ")[0] for prot in pep.get_all_proteins()]),
-                ",".join([str(len(pep.proteinPos[prot.transcript_id])) for prot in pep.get_all_proteins()]),
-            )
-            for pep in peptides
-        ],
-        columns=["sequence", "protein_ids", "counts"],
+        seq = seq.strip().upper()
+        digest = hashlib.blake2b(seq.encode(), digest_size=16).digest()
+        if digest not in seen:
+            seen.add(digest)
+            # split at first whitespace and use short ID
+            yield _id.split(" ")[0], seq
+
+
+def iter_peptides(proteins, lengths):
+    """
+    generates the peptides of all lengths in one pass over each protein sequence
+    :param proteins: iterable of (ID, sequence) tuples
+    :param list lengths: peptide lengths
+    :return: generator of (peptide, protein ID) tuples, once per occurrence
+    """
+    for _id, seq in proteins:
+        # windows are generated within stretches of valid amino acids only
+        for segment in INVALID_AMINO_ACIDS.split(seq):
+            for length in lengths:
+                for start in range(len(segment) - length + 1):
+                    yield segment[start : start + length], _id
+
+
+def get_occurrences(protein_ids):
+    """
+    :param list protein_ids: protein ID of each occurrence of a peptide
+    :return: comma-separated protein IDs and their number of occurrences, in order of their first occurrence
+    """
+    if len(protein_ids) == 1:
+        return protein_ids[0], "1"
+    # proteins with the same ID are counted together
+    counts = Counter(protein_ids)
+    return ",".join(counts), ",".join(map(str, counts.values()))
+
+
+def generate_peptides(proteins, lengths):
+    """
+    generates the peptides of all lengths in memory
+    :param proteins: iterable of (ID, sequence) tuples
+    :param list lengths: peptide lengths
+    :return: generator of (peptide, protein IDs, counts) rows, grouped by length
+    """
+    peptides = {length: {} for length in lengths}
+    for peptide, _id in iter_peptides(proteins, lengths):
+        peptides[len(peptide)].setdefault(peptide, []).append(_id)
+    for length_peptides in peptides.values():
+        for peptide, protein_ids in length_peptides.items():
+            yield (peptide, *get_occurrences(protein_ids))
+
+
+def write_run(rows, directory):
+    """
+    writes sorted peptide rows to a temporary run file
+    :param rows: iterable of (peptide, protein IDs, counts) rows sorted by length and sequence
+    :param str directory: directory of the run files
+    :return: name of the run file
+    """
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".run", delete=False) as run_file:
+        writer = csv.writer(run_file, delimiter="\t", lineterminator="\n")
+        writer.writerows(rows)
+    return run_file.name
+
+
+def read_run(filename):
+    with open(filename) as run_file:
+        for peptide, protein_ids, counts in csv.reader(run_file, delimiter="\t"):
+            yield len(peptide), peptide, protein_ids, counts
+
+
+def spill_peptides(proteins, lengths, max_peptides, directory):
+    """
+    generates the peptides of all lengths and spills them to sorted run files whenever the number of buffered
+    peptide occurrences reaches max_peptides
+    :param proteins: iterable of (ID, sequence) tuples
+    :param list lengths: peptide lengths
+    :param int max_peptides: maximum number of buffered peptide occurrences
+    :param str directory: directory of the run files
+    :return: list of run files in order of the proteins
+    """
+    runs = []
+    buffer = {}
+    num_buffered = 0
+    for peptide, _id in itertools.chain(iter_peptides(proteins, lengths), [(None, None)]):
+        if peptide is not None:
+            buffer.setdefault(peptide, []).append(_id)
+            num_buffered += 1
+        if num_buffered >= max_peptides or (peptide is None and buffer):
+            peptides = sorted(buffer, key=lambda p: (len(p), p))
+            runs.append(write_run(((p, *get_occurrences(buffer[p])) for p in peptides), directory))
+            buffer = {}
+            num_buffered = 0
+    logger.info(f"Spilled peptides to {len(runs)} sorted runs")
+    return runs
+
+
+def merge_runs(runs, directory, max_open_runs=MAX_OPEN_RUNS):
+    """
+    k-way merges sorted run files and aggregates the protein IDs and counts of each peptide, runs are merged in
+    several passes if there are more than max_open_runs
+    :param list runs: run files in order of the proteins
+    :param str directory: directory of the run files
+    :param int max_open_runs: maximum number of run files merged at once
+    :return: generator of (peptide, protein IDs, counts) rows, sorted by length and sequence
+    """
+    while len(runs) > max_open_runs:
+        merged_runs = []
+        for i in range(0, len(runs), max_open_runs):
+            merged_runs.append(write_run(merge_runs(runs[i : i + max_open_runs], directory), directory))
+            for run in runs[i : i + max_open_runs]:
+                os.remove(run)
+        runs = merged_runs
+    # rows of equal peptides are merged in order of the runs, which keeps protein IDs in order of occurrence
+    merged = heapq.merge(*[read_run(run) for run in runs], key=operator.itemgetter(0, 1))
+    for (_, peptide), rows in itertools.groupby(merged, key=operator.itemgetter(0, 1)):
+        rows = list(rows)
+        if len(rows) == 1:
+            yield peptide, rows[0][2], rows[0][3]
+            continue
+        counts = {}
+        for _, _, protein_ids, protein_counts in rows:
+            for _id, count in zip(protein_ids.split(","), protein_counts.split(",")):
+                counts[_id] = counts.get(_id, 0) + int(count)
+        yield peptide, ",".join(counts), ",".join(map(str, counts.values()))
+
+
+def write_peptides(rows, output):
+    """
+    writes peptides with their protein IDs and number of occurrences per protein, IDs are assigned in order
+    :param rows: iterable of (peptide, protein IDs, counts) rows
+    :param output: output file handle
+    :return: number of written peptides
+    """
+    writer = csv.writer(output, delimiter="\t", lineterminator="\n")
+    writer.writerow(PEPTIDE_COLUMNS)
+    peptide_id = 0
+    for peptide, protein_ids, counts in rows:
+        writer.writerow([peptide, peptide_id, protein_ids, counts])
+        peptide_id += 1
+    return peptide_id
+
+
+def __main__():
+    parser = argparse.ArgumentParser("Generating peptides from protein sequences.")
+    parser.add_argument(
+        "-i", "--input", metavar="FILE", type=argparse.FileType("r"), help="FASTA filename containing proteins."
     )
-    # assign id
-    pd_peptides = pd_peptides.assign(id=[str(c + id) for id in pd_peptides.index])
-    c += len(pd_peptides["sequence"])
+    parser.add_argument(
+        "-o", "--output", metavar="FILE", type=argparse.FileType("w"), help="Output file containing peptides."
+    )
+    parser.add_argument(
+        "-min", "--min_length", metavar="N", type=int, help="Minimal length of peptides that will be generated."
+    )
+    parser.add_argument(
+        "-max", "--max_length", metavar="N", type=int, help="Maximum length of peptides that will be generated."
+    )
+    parser.add_argument(
+        "-mem",
+        "--max_memory",
+        metavar="MB",
+        type=int,
+        default=0,
+        help="Approximate memory for peptides in MB, peptides are deduplicated on disk (sorted runs) if set.",
+    )
+    parser.add_argument(
+        "-tmp",
+        "--temp_dir",
+        metavar="DIR",
+        default=".",
+        help="Directory for the sorted runs of the on-disk deduplication.",
+    )
+    args = parser.parse_args()
 
-    if k == args.min_length:
-        pd_peptides[["sequence", "id", "protein_ids", "counts"]].to_csv(args.output, sep="\t", index=False)
+    proteins = read_protein_fasta(args.input)
+    lengths = list(range(args.min_length, args.max_length + 1))
+    if args.max_memory:
+        max_peptides = max(1, args.max_memory * 1024**2 // PEPTIDE_BYTES)
+        with tempfile.TemporaryDirectory(dir=args.temp_dir) as directory:
+            runs = spill_peptides(proteins, lengths, max_peptides, directory)
+            num_peptides = write_peptides(merge_runs(runs, directory), args.output)
     else:
-        pd_peptides[["sequence", "id", "protein_ids", "counts"]].to_csv(
-            args.output, sep="\t", index=False, mode="a", header=False
-        )
+        num_peptides = write_peptides(generate_peptides(proteins, lengths), args.output)
+    logger.info(f"Generated {num_peptides} peptides of length {args.min_length} to {args.max_length}")
+
+
+if __name__ == "__main__":
+    __main__()
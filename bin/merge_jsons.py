@@ -6,6 +6,169 @@ import argparse
 import json
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from report_sketches import SEQUENCE_SET_KEYS, SketchUnion, count_sketch
+
+COUNT_KEYS = ["number_of_nonbinders", "number_of_binders", "number_of_predictions", "number_of_variants"]
+BREAKDOWN_KEYS = ["binders_per_allele", "binders_per_method"]
+
+
+class ReportAccumulator:
+    """
+    folds JSON reports into one merged report in linear time: counts are summed up, peptide sets are unioned
+    (see SketchUnion) and all other values are collected
+    accumulators of different report subsets can be merged as well, which allows reducing reports in a tree
+    """
+
+    def __init__(self):
+        # keys in order of appearance, to write them in the order of the reports
+        self.keys = {}
+        self.prediction_methods = {}
+        self.tool_thresholds = None
+        self.sequence_sets = {key: SketchUnion() for key in SEQUENCE_SET_KEYS}
+        self.counts = {key: 0 for key in COUNT_KEYS}
+        self.predictor_timings = {}
+        self.prediction_cache = {"hits": 0, "misses": 0}
+        self.breakdowns = {key: {} for key in BREAKDOWN_KEYS}
+        self.other = {}
+
+    def add_report(self, report):
+        """
+        :param dict report: report written by epaa.py or a partial report written by this script
+        """
+        for key, value in report.items():
+            self.keys.setdefault(key)
+            if key == "prediction_methods":
+                self.prediction_methods.update(dict.fromkeys(value if isinstance(value, list) else value.split(",")))
+            elif key == "tool_thresholds":
+                # tool thresholds is the same for all runs i.e. for all JSON parts
+                self.tool_thresholds = value
+            elif key in self.sequence_sets:
+                self.add_sequence_set(self.sequence_sets[key], key, value)
+            elif key in self.counts:
+                self.counts[key] += value
+            elif key == "predictor_timings":
+                # load and prediction times are summed up per method over all runs
+                for method, method_timings in value.items():
+                    for name, seconds in method_timings.items():
+                        self.predictor_timings.setdefault(method, {}).setdefault(name, 0)
+                        self.predictor_timings[method][name] += seconds
+            elif key == "prediction_cache":
+                for name, count in value.items():
+                    self.prediction_cache[name] += count
+            elif key in self.breakdowns:
+                # binder counts per allele and method are summed up, unique binders are unioned over all runs
+                for group, group_counts in value.items():
+                    merged_counts = self.breakdowns[key].setdefault(group, {"number_of_unique_binders": SketchUnion()})
+                    for name, count in group_counts.items():
+                        if name == "number_of_unique_binders":
+                            self.add_sequence_set(merged_counts[name], f"{key} {group}", count)
+                        else:
+                            merged_counts[name] = merged_counts.get(name, 0) + count
+            else:
+                self.other.setdefault(key, []).append(value)
+
+    @staticmethod
+    def add_sequence_set(union, key, value):
+        # a merged report holds the number of peptides, which can not be merged further
+        if isinstance(value, int):
+            raise ValueError(f"Report value {key} is a count, merge partial reports (--partial) instead.")
+        union.add(value)
+
+    def merge(self, other):
+        """
+        :param ReportAccumulator other: accumulator of other reports
+        """
+        for key in other.keys:
+            self.keys.setdefault(key)
+        self.prediction_methods.update(other.prediction_methods)
+        if other.tool_thresholds is not None:
+            self.tool_thresholds = other.tool_thresholds
+        for key, union in other.sequence_sets.items():
+            self.sequence_sets[key].merge(union)
+        for key, count in other.counts.items():
+            self.counts[key] += count
+        self.add_report({"predictor_timings": other.predictor_timings, "prediction_cache": other.prediction_cache})
+        for key, breakdown in other.breakdowns.items():
+            for group, group_counts in breakdown.items():
+                merged_counts = self.breakdowns[key].setdefault(group, {"number_of_unique_binders": SketchUnion()})
+                for name, count in group_counts.items():
+                    if name == "number_of_unique_binders":
+                        merged_counts[name].merge(count)
+                    else:
+                        merged_counts[name] = merged_counts.get(name, 0) + count
+        for key, values in other.other.items():
+            self.other.setdefault(key, []).extend(values)
+
+    def to_report(self, partial=False):
+        """
+        :param bool partial: keep peptide sets (lists or sketches) instead of their counts, to merge the report again
+        :return: merged report
+        """
+
+        def get_size(union):
+            return union.result() if partial else count_sketch(union.result())
+
+        data = {}
+        for key in self.keys:
+            if key == "prediction_methods":
+                data[key] = list(self.prediction_methods) if partial else ",".join(self.prediction_methods)
+            elif key == "tool_thresholds":
+                data[key] = self.tool_thresholds
+            elif key in self.sequence_sets:
+                data[key] = get_size(self.sequence_sets[key])
+            elif key in self.counts:
+                data[key] = self.counts[key]
+            elif key in self.breakdowns:
+                data[key] = {
+                    group: {
+                        name: get_size(count) if name == "number_of_unique_binders" else count
+                        for name, count in counts.items()
+                    }
+                    for group, counts in self.breakdowns[key].items()
+                }
+            elif key == "predictor_timings":
+                data[key] = self.predictor_timings
+            elif key == "prediction_cache":
+                data[key] = self.prediction_cache
+            else:
+                data[key] = self.other[key]
+        data.setdefault("predictor_timings", self.predictor_timings)
+        data.setdefault("prediction_cache", self.prediction_cache)
+        return data
+
+
+def read_reports(filenames):
+    """
+    folds JSON reports one after another, only one report is held in memory
+    :param list filenames: JSON reports
+    :return: ReportAccumulator of the reports
+    """
+    accumulator = ReportAccumulator()
+    for filename in filenames:
+        with open(filename) as infile:
+            accumulator.add_report(json.load(infile))
+    return accumulator
+
+
+def merge_reports(filenames, num_workers=1):
+    """
+    merges JSON reports, in parallel by folding one group of reports per worker process, the accumulators of the
+    groups are merged as they are available
+    :param list filenames: JSON reports
+    :param int num_workers: number of worker processes
+    :return: ReportAccumulator of all reports
+    """
+    if num_workers <= 1 or len(filenames) <= 1:
+        return read_reports(filenames)
+    num_groups = min(len(filenames), num_workers)
+    groups = [filenames[i::num_groups] for i in range(num_groups)]
+    accumulator = ReportAccumulator()
+    with ProcessPoolExecutor(max_workers=num_groups) as pool:
+        for group_accumulator in pool.map(read_reports, groups):
+            accumulator.merge(group_accumulator)
+    return accumulator
 
 
 def __main__():
@@ -13,6 +176,18 @@ def __main__():
     parser.add_argument("-s", "--single_input", help="Single input JSON report")
     parser.add_argument("-i", "--input", help="Input directory with JSON reports")
     parser.add_argument("-p", "--prefix", help="Prefix for output")
+    parser.add_argument(
+        "-w",
+        "--num_workers",
+        help="Number of worker processes reading and merging reports in parallel",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--partial",
+        help="Write a partial report with peptide sets instead of counts, which can be merged again (tree reduce)",
+        action="store_true",
+    )
 
     args = parser.parse_args()
 
@@ -20,55 +195,16 @@ def __main__():
         parser.print_help()
         sys.exit(1)
 
-    # Flatten irregular list function
-    def flatten(l):
-        """Flatten list using recursion."""
-        if isinstance(l, list):
-            for el in l:
-                if isinstance(el, list):
-                    yield from flatten(el)
-                else:
-                    yield el
-        else:
-            return l
-
-    # Combine_dicts function
-    def combine_dicts(a, b):
-        joined_list = list(a.items()) + list(b.items())
-        d = {}
-        for key, value in joined_list:
-            d.setdefault(key, []).append(value)
-        return d
-
     # read in json reports
-    data = dict()
     if args.single_input:
-        with open(args.single_input) as infile:
-            json_content = json.load(infile)
-            data = combine_dicts(data, json_content)
-
+        filenames = [args.single_input]
     else:
-        for file in os.listdir(args.input):
-            if file.endswith(".json"):
-                with open(os.path.join(args.input, file)) as infile:
-                    json_content = json.load(infile)
-                    data = combine_dicts(data, json_content)
+        filenames = sorted(
+            entry.path for entry in os.scandir(args.input) if entry.is_file() and entry.name.endswith(".json")
+        )
+    data = merge_reports(filenames, args.num_workers).to_report(args.partial)
 
     # merge and write json report
-    data["prediction_methods"] = ",".join(set(list(flatten(data["prediction_methods"]))))
-    # tool thresholds is the same for all runs i.e. for all JSON parts
-    data["tool_thresholds"] = json_content["tool_thresholds"]
-    data["number_of_unique_peptides"] = len(set(list(flatten(data["number_of_unique_peptides"]))))
-    data["number_of_unique_peptides_after_filtering"] = len(
-        set(list(flatten(data["number_of_unique_peptides_after_filtering"])))
-    )
-    data["number_of_unique_nonbinders"] = len(set(list(flatten(data["number_of_unique_nonbinders"]))))
-    data["number_of_unique_binders"] = len(set(list(flatten(data["number_of_unique_binders"]))))
-    data["number_of_nonbinders"] = sum(list(flatten(data["number_of_nonbinders"])))
-    data["number_of_binders"] = sum(list(flatten(data["number_of_binders"])))
-    data["number_of_predictions"] = sum(list(flatten(data["number_of_predictions"])))
-    data["number_of_variants"] = sum(list(flatten(data["number_of_variants"])))
-
     with open(f"{args.prefix}_prediction_report.json", "w") as outfile:
         json.dump(data, outfile)
 
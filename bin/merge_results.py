@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# Released under the MIT license (2024).
+
+import argparse
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# pyarrow is only required for Parquet and Feather results
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# instantiate global logger object
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.DEBUG)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+OUTPUT_FORMATS = ["tsv", "parquet", "feather"]
+
+# peptide sequences are (nearly) unique, all other text columns are dictionary-encoded
+SEQUENCE_COLUMNS = ["sequence", "wt sequence"]
+NUMERIC_SUFFIXES = (" score", " rank", " affinity")
+
+
+def check_columnar_support(output_format):
+    """
+    fails before any work is done if the output format needs pyarrow and it is not installed
+    :param str output_format: one of OUTPUT_FORMATS
+    """
+    if output_format != "tsv" and pa is None:
+        raise ImportError(
+            f"{output_format} results require pyarrow, which is not installed in this environment. Use a container or "
+            "conda environment that provides pyarrow (see --output_format) or write tsv results."
+        )
+
+
+def get_result_field(column):
+    """
+    returns the Arrow field of a result column, types are derived from the column name
+    :param str column: column name
+    :return: pyarrow field
+    """
+    if column == "length":
+        return pa.field(column, pa.int64())
+    if column.endswith(NUMERIC_SUFFIXES):
+        return pa.field(column, pa.float64())
+    if column == "binder" or column.endswith(" binder"):
+        return pa.field(column, pa.bool_())
+    if column in SEQUENCE_COLUMNS:
+        return pa.field(column, pa.string())
+    return pa.field(column, pa.dictionary(pa.int32(), pa.string()))
+
+
+def get_result_schema(columns):
+    """
+    returns the Arrow schema of prediction results with the given columns
+    :param list columns: column names
+    :return: pyarrow schema
+    """
+    return pa.schema([get_result_field(str(column)) for column in columns])
+
+
+def to_result_table(df, schema=None):
+    """
+    converts prediction results to an Arrow table with typed numeric and bool columns and dictionary-encoded text
+    :param df: DataFrame with prediction results
+    :param schema: pyarrow schema of the result columns (see get_result_schema), derived from df if not given
+    :return: pyarrow table
+    """
+    if schema is None:
+        schema = get_result_schema(df.columns)
+    arrays = []
+    for field in schema:
+        values = df[field.name]
+        missing = values.isna().to_numpy()
+        if pa.types.is_floating(field.type):
+            arrays.append(pa.array(pd.to_numeric(values, errors="coerce").to_numpy(dtype=float), from_pandas=True))
+        elif pa.types.is_integer(field.type) or pa.types.is_boolean(field.type):
+            arrays.append(pa.array(values.astype(object).to_numpy(), type=field.type, from_pandas=True))
+        else:
+            strings = pa.array(values.astype(str).to_numpy(dtype=object), type=pa.string(), mask=missing)
+            arrays.append(strings.dictionary_encode() if pa.types.is_dictionary(field.type) else strings)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def open_parquet_writer(filename, schema):
+    """
+    opens a Parquet file to write prediction results in several batches (see to_result_table)
+    :param str filename: output file
+    :param schema: pyarrow schema of the result columns (see get_result_schema)
+    :return: pyarrow ParquetWriter
+    """
+    check_columnar_support("parquet")
+    return pq.ParquetWriter(filename, schema, compression="zstd")
+
+
+def write_prediction_results(df, filename, output_format):
+    """
+    writes prediction results as TSV, Parquet or Feather (zstd compressed)
+    :param df: DataFrame with prediction results
+    :param str filename: output file
+    :param str output_format: one of OUTPUT_FORMATS
+    """
+    check_columnar_support(output_format)
+    if output_format == "parquet":
+        pq.write_table(to_result_table(df), filename, compression="zstd")
+    elif output_format == "feather":
+        feather.write_feather(to_result_table(df), filename, compression="zstd")
+    else:
+        df.to_csv(filename, sep="\t", index=False)
+
+
+def read_prediction_results(filename):
+    """
+    reads prediction results written by epaa.py or this script, the format is derived from the file extension
+    :param str filename: TSV, Parquet or Feather file
+    :return: DataFrame with prediction results, dictionary-encoded columns of columnar files are categorical
+    """
+    output_format = filename.rsplit(".", 1)[-1]
+    if output_format in ["parquet", "feather"]:
+        check_columnar_support(output_format)
+        table = pq.read_table(filename) if output_format == "parquet" else feather.read_table(filename)
+        return table.to_pandas()
+    return pd.read_csv(filename, sep="\t", low_memory=False)
+
+
+def merge_prediction_results(frames):
+    """
+    concatenates prediction results and sorts them by chromosome and peptide length (numerically)
+    :param list frames: DataFrames with prediction results
+    :return: DataFrame with all prediction results
+    """
+    categorical = [c for frame in frames for c in frame.columns if isinstance(frame[c].dtype, pd.CategoricalDtype)]
+    merged = pd.concat(frames, ignore_index=True, sort=False)
+    # categories of the inputs differ, concat falls back to plain values
+    for column in set(categorical):
+        merged[column] = merged[column].astype("category")
+    if "chr" in merged.columns and "length" in merged.columns:
+        chromosomes = pd.to_numeric(merged["chr"].astype(object), errors="coerce")
+        order = np.lexsort((merged["length"].to_numpy(), chromosomes.fillna(np.inf).to_numpy()))
+        merged = merged.iloc[order].reset_index(drop=True)
+    return merged
+
+
+def __main__():
+    parser = argparse.ArgumentParser(
+        description="Merge multiple prediction results (TSV, Parquet or Feather) into one."
+    )
+    parser.add_argument("-i", "--input", help="Prediction result files", nargs="+", required=True)
+    parser.add_argument("-p", "--prefix", help="Prefix for output", required=True)
+    parser.add_argument(
+        "-of",
+        "--output_format",
+        help="Format of the merged result, default is the format of the first input",
+        choices=OUTPUT_FORMATS,
+    )
+    args = parser.parse_args()
+
+    output_format = args.output_format or args.input[0].rsplit(".", 1)[-1]
+    check_columnar_support(output_format)
+
+    frames = []
+    for filename in args.input:
+        if os.path.getsize(filename) == 0:
+            logger.warning(f"Skipping empty result file {filename}")
+            continue
+        frames.append(read_prediction_results(filename))
+    merged = merge_prediction_results(frames) if frames else pd.DataFrame()
+    logger.info(f"Merged {len(merged)} predictions from {len(frames)} files")
+
+    write_prediction_results(merged, f"{args.prefix}_prediction_result.{output_format}", output_format)
+
+
+if __name__ == "__main__":
+    __main__()
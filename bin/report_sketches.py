@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# Released under the MIT license (2024).
+
+import base64
+import math
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# list: plain peptide lists (exact, large), hash: 64-bit hash sets (exact up to hash collisions, ~8 bytes per
+# peptide before compression), hll: HyperLogLog registers (fixed size, ~1% relative error)
+SKETCH_TYPES = ["list", "hash", "hll"]
+HLL_PRECISION = 14
+
+# report keys holding sets of peptide sequences, per-allele and per-method breakdowns hold number_of_unique_binders
+SEQUENCE_SET_KEYS = [
+    "number_of_unique_peptides",
+    "number_of_unique_peptides_after_filtering",
+    "number_of_unique_binders",
+    "number_of_unique_nonbinders",
+]
+
+
+def hash_sequences(sequences):
+    """
+    returns stable 64-bit hashes of peptide sequences, the same in all processes
+    :param sequences: iterable of peptide sequences (str or epytope Peptide)
+    :return: numpy array of uint64 hashes
+    """
+    return pd.util.hash_array(np.array([str(s) for s in sequences], dtype=object))
+
+
+def encode_array(values):
+    return base64.b64encode(zlib.compress(np.ascontiguousarray(values).astype("<u8").tobytes())).decode("ascii")
+
+
+def decode_array(encoded):
+    return np.frombuffer(zlib.decompress(base64.b64decode(encoded)), dtype="<u8").astype(np.uint64)
+
+
+def bit_length(values):
+    """
+    returns the number of bits needed to represent each value (0 for 0), computed with integer operations only
+    :param values: numpy array of uint64
+    :return: numpy array of int64
+    """
+    lengths = np.zeros(len(values), dtype=np.int64)
+    for shift in [32, 16, 8, 4, 2, 1]:
+        shifted = values >> np.uint64(shift)
+        above = shifted > 0
+        lengths[above] += shift
+        values = np.where(above, shifted, values)
+    return lengths + (values > 0)
+
+
+def hll_registers(hashes, precision=HLL_PRECISION):
+    """
+    returns the HyperLogLog registers of hashed values
+    :param hashes: numpy array of uint64 hashes
+    :param int precision: number of index bits, 2**precision registers
+    :return: numpy array of uint8 registers
+    """
+    registers = np.zeros(2**precision, dtype=np.uint8)
+    if len(hashes):
+        index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << (64 - precision)) - 1)
+        # position of the leftmost 1-bit in the remaining 64 - precision bits
+        rank = (64 - precision - bit_length(remainder) + 1).astype(np.uint8)
+        np.maximum.at(registers, index, rank)
+    return registers
+
+
+def hll_estimate(registers):
+    """
+    returns the HyperLogLog cardinality estimate with linear counting for small cardinalities
+    :param registers: numpy array of uint8 registers
+    :return: estimated number of distinct values
+    """
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros > 0:
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+def write_hash_sketch(hashes):
+    # sorted hashes are stored as differences, which compress better
+    return {"sketch": "hash", "hashes": encode_array(np.diff(hashes, prepend=np.uint64(0)))}
+
+
+def write_hll_sketch(registers):
+    return {
+        "sketch": "hll",
+        "precision": int(math.log2(len(registers))),
+        "registers": base64.b64encode(zlib.compress(registers.tobytes())).decode("ascii"),
+    }
+
+
+def create_sketch(sequences, sketch_type):
+    """
+    returns the report representation of a set of peptide sequences
+    :param sequences: iterable of unique peptide sequences
+    :param str sketch_type: one of SKETCH_TYPES
+    :return: list of sequences or serializable sketch dictionary
+    """
+    if sketch_type == "list":
+        return [str(s) for s in sequences]
+    hashes = np.unique(hash_sequences(sequences))
+    if sketch_type == "hash":
+        return write_hash_sketch(hashes)
+    return write_hll_sketch(hll_registers(hashes))
+
+
+def read_sketch(sketch):
+    """
+    decodes a sketch written by create_sketch
+    :param dict sketch: sketch dictionary
+    :return: sketch type and numpy array of unique hashes (hash) or registers (hll)
+    """
+    if sketch["sketch"] == "hash":
+        return "hash", np.cumsum(decode_array(sketch["hashes"]), dtype=np.uint64)
+    return "hll", np.frombuffer(zlib.decompress(base64.b64decode(sketch["registers"])), dtype=np.uint8)
+
+
+class SketchUnion:
+    """
+    accumulates the union of sequence sets given as sequences and sketches, without materializing sketched sequences
+    sequences are only hashed if sketches are given as well, the union is an HyperLogLog sketch if any input is one
+    """
+
+    def __init__(self):
+        self.sequences = set()
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.pending_hashes = []
+        self.num_pending = 0
+        self.hashed = False
+        self.registers = None
+
+    def add(self, value):
+        """
+        :param value: peptide sequence, list of sequences or sketch dictionary (see create_sketch)
+        """
+        if isinstance(value, list):
+            self.sequences.update(value)
+        elif not isinstance(value, dict):
+            self.sequences.add(value)
+        else:
+            sketch_type, sketch = read_sketch(value)
+            if sketch_type == "hash":
+                self.add_hashes(sketch)
+            else:
+                self.add_registers(sketch)
+
+    def add_hashes(self, hashes):
+        self.hashed = True
+        self.pending_hashes.append(hashes)
+        self.num_pending += len(hashes)
+        # deduplicate once the pending hashes outgrow the unique ones, amortized linear in the number of hashes
+        if self.num_pending > len(self.hashes):
+            self.compact()
+
+    def add_registers(self, registers):
+        if self.registers is None:
+            self.registers = registers.copy()
+        elif len(registers) != len(self.registers):
+            raise ValueError("HyperLogLog sketches with different precisions can not be merged.")
+        else:
+            np.maximum(self.registers, registers, out=self.registers)
+
+    def compact(self):
+        self.hashes = np.unique(np.concatenate([self.hashes] + self.pending_hashes))
+        self.pending_hashes = []
+        self.num_pending = 0
+
+    def merge(self, other):
+        """
+        adds the union accumulated by another SketchUnion
+        :param SketchUnion other: union to add
+        """
+        self.sequences.update(other.sequences)
+        if other.hashed:
+            for hashes in [other.hashes] + other.pending_hashes:
+                self.add_hashes(hashes)
+        if other.registers is not None:
+            self.add_registers(other.registers)
+
+    def result(self):
+        """
+        :return: list of unique sequences or sketch dictionary
+        """
+        if not self.hashed and self.registers is None:
+            return list(self.sequences)
+        self.add_hashes(hash_sequences(self.sequences))
+        self.sequences = set()
+        self.compact()
+        if self.registers is None:
+            return write_hash_sketch(self.hashes)
+        self.add_registers(hll_registers(self.hashes, int(math.log2(len(self.registers)))))
+        return write_hll_sketch(self.registers)
+
+
+def union_sketches(values):
+    """
+    returns the union of sequence sets given as sequences and sketches (see SketchUnion)
+    :param values: iterable of peptide sequences and sketch dictionaries (see create_sketch)
+    :return: list of unique sequences or sketch dictionary
+    """
+    union = SketchUnion()
+    for value in values:
+        union.add(value)
+    return union.result()
+
+
+def count_sketch(value):
+    """
+    returns the number of unique sequences of a sequence list or sketch (see union_sketches)
+    :param value: list of unique sequences or sketch dictionary
+    :return: (estimated) number of unique sequences
+    """
+    if not isinstance(value, dict):
+        return len(value)
+    sketch_type, sketch = read_sketch(value)
+    return len(sketch) if sketch_type == "hash" else hll_estimate(sketch)
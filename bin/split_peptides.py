@@ -3,32 +3,177 @@
 
 
 import argparse
+import json
+import logging
 import math
+import sys
+import tempfile
 
-parser = argparse.ArgumentParser("Split peptides input file.")
-parser.add_argument("-i", "--input", metavar="FILE", type=str, help="Input file containing peptides.")
-parser.add_argument("-o", "--output_base", type=str, help="Base filename for output files.")
-parser.add_argument(
-    "-s", "--min_size", metavar="N", type=int, help="Minimum number of peptides that should be written into one file."
-)
-parser.add_argument(
-    "-c", "--max_chunks", metavar="N", type=int, help="Maximum number of chunks that should be created."
-)
-args = parser.parse_args()
-
-with open(args.input) as infile:
-    tot_size = sum([1 for _ in infile]) - 1
-
-n = int(min(math.ceil(float(tot_size) / args.min_size), args.max_chunks))
-h = int(max(args.min_size, math.ceil(float(tot_size) / n)))
-
-with open(args.input) as infile:
-    header = next(infile)
-    for chunk in range(n):
-        with open(args.output_base + ".chunk_" + str(chunk) + ".tsv", "w") as outfile:
-            outfile.write(header)
-            for _ in range(h):
-                try:
-                    outfile.write(next(infile))
-                except StopIteration:
-                    break
+# instantiate global logger object
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.DEBUG)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+def read_weights(filename):
+    """
+    reads cost weights of peptide lengths and tools from a JSON file, e.g.
+    {"lengths": {"9": 1.0, "15": 3.0}, "tools": {"mhcflurry": 2.0, "netmhcpan": {"8": 3.0, "9": 3.0}}}
+    a tool weight is either used for all lengths or given per length, lengths without a weight are not supported
+    :param str filename: JSON file
+    :return: dictionary with length weights and tool weights
+    """
+    if not filename:
+        return {"lengths": {}, "tools": {}}
+    with open(filename) as weights_file:
+        weights = json.load(weights_file)
+    return {"lengths": weights.get("lengths", {}), "tools": weights.get("tools", {})}
+
+
+def get_peptide_cost(length, num_alleles, tools, weights):
+    """
+    returns the estimated prediction cost of one peptide: length weight x alleles x weights of the tools supporting
+    the length, the length weight defaults to the length and tool weights default to 1
+    :param int length: peptide length
+    :param int num_alleles: number of alleles
+    :param list tools: prediction tools
+    :param dict weights: length and tool weights (see read_weights)
+    :return: estimated cost
+    """
+    length_weight = float(weights["lengths"].get(str(length), length))
+    tool_weight = 0.0
+    for tool in tools:
+        weight = weights["tools"].get(tool, 1.0)
+        tool_weight += float(weight.get(str(length), 0.0) if isinstance(weight, dict) else weight)
+    return length_weight * num_alleles * tool_weight
+
+
+def spool_peptides(infile, directory):
+    """
+    reads the peptides once and spools them to one temporary file per peptide length
+    :param infile: input file handle
+    :param str directory: directory of the spool files
+    :return: header line and dictionary of (spool file, number of peptides) per length
+    """
+    header = infile.readline()
+    columns = header.rstrip("\r\n").split("\t")
+    sequence_index = columns.index("sequence") if "sequence" in columns else 0
+    spools = {}
+    for line in infile:
+        if not line.endswith("\n"):
+            line += "\n"
+        length = len(line.split("\t", sequence_index + 1)[sequence_index].strip())
+        if length not in spools:
+            spools[length] = [tempfile.TemporaryFile("w+", dir=directory), 0]
+        spools[length][0].write(line)
+        spools[length][1] += 1
+    return header, spools
+
+
+def write_chunks(header, spools, costs, num_chunks, min_size, output_base):
+    """
+    writes the spooled peptides into at most num_chunks chunks of about the same estimated cost
+    the target cost of a chunk is the remaining cost divided by the remaining number of chunks, a peptide starts a new
+    chunk if the middle of its cost exceeds the target and the current chunk has at least min_size peptides, i.e. every
+    chunk except the last has at least min_size peptides
+    :param str header: header line
+    :param dict spools: spool file and number of peptides per length (see spool_peptides)
+    :param dict costs: cost of one peptide per length
+    :param int num_chunks: maximum number of chunks
+    :param int min_size: minimum number of peptides of each chunk except the last
+    :param str output_base: base filename of the chunks
+    :return: estimated cost and number of peptides per written chunk
+    """
+    total_cost = sum(costs[length] * count for length, (_, count) in spools.items())
+    if total_cost == 0:
+        # none of the tools supports the lengths, chunks are balanced by the number of peptides
+        costs = {length: 1.0 for length in costs}
+        total_cost = sum(count for _, count in spools.values())
+
+    chunk_costs = []
+    chunk_sizes = []
+    remaining_cost = total_cost
+    target = 0.0
+    outfile = None
+    for length in sorted(spools):
+        spool, _ = spools[length]
+        spool.seek(0)
+        cost = costs[length]
+        for line in spool:
+            if outfile is None or (
+                len(chunk_costs) < num_chunks and chunk_sizes[-1] >= min_size and chunk_costs[-1] + cost / 2 > target
+            ):
+                if outfile is not None:
+                    outfile.close()
+                target = remaining_cost / (num_chunks - len(chunk_costs))
+                outfile = open(f"{output_base}.chunk_{len(chunk_costs)}.tsv", "w")
+                outfile.write(header)
+                chunk_costs.append(0.0)
+                chunk_sizes.append(0)
+            outfile.write(line)
+            chunk_costs[-1] += cost
+            chunk_sizes[-1] += 1
+            remaining_cost -= cost
+        spool.close()
+    if outfile is not None:
+        outfile.close()
+    return chunk_costs, chunk_sizes
+
+
+def __main__():
+    parser = argparse.ArgumentParser("Split peptides input file.")
+    parser.add_argument("-i", "--input", metavar="FILE", type=str, help="Input file containing peptides.")
+    parser.add_argument("-o", "--output_base", type=str, help="Base filename for output files.")
+    parser.add_argument(
+        "-s",
+        "--min_size",
+        metavar="N",
+        type=int,
+        help="Minimum number of peptides that should be written into one file (except the last), determines the "
+        "number of chunks (number of peptides / N, rounded up, at most max_chunks). Chunks are balanced by estimated "
+        "cost as far as the minimum size allows.",
+    )
+    parser.add_argument(
+        "-c", "--max_chunks", metavar="N", type=int, help="Maximum number of chunks that should be created."
+    )
+    parser.add_argument(
+        "-a", "--alleles", type=str, default="", help="Alleles (semicolon-separated) for the cost model."
+    )
+    parser.add_argument(
+        "-t", "--tools", type=str, default="", help="Prediction tools (comma-separated) for the cost model."
+    )
+    parser.add_argument(
+        "-w", "--weights", metavar="FILE", type=str, help="JSON file with cost weights of peptide lengths and tools."
+    )
+    args = parser.parse_args()
+
+    num_alleles = max(1, len([allele for allele in args.alleles.split(";") if allele]))
+    tools = [tool for tool in args.tools.split(",") if tool] or ["default"]
+    weights = read_weights(args.weights)
+
+    with tempfile.TemporaryDirectory(dir=".") as directory, open(args.input) as infile:
+        header, spools = spool_peptides(infile, directory)
+        counts = {length: count for length, (_, count) in spools.items()}
+        tot_size = sum(counts.values())
+        if tot_size == 0:
+            logger.warning(f"No peptides found in {args.input}")
+            return
+
+        # same number of chunks as with fixed-size chunks of min_size peptides
+        n = int(min(math.ceil(tot_size / args.min_size), args.max_chunks))
+        costs = {length: get_peptide_cost(length, num_alleles, tools, weights) for length in counts}
+        chunk_costs, chunk_sizes = write_chunks(header, spools, costs, n, args.min_size, args.output_base)
+
+    logger.info(
+        f"Split {tot_size} peptides into {len(chunk_costs)} chunks of {min(chunk_sizes)}-{max(chunk_sizes)} peptides, "
+        f"estimated costs {min(chunk_costs):.0f}-{max(chunk_costs):.0f}"
+    )
+
+
+if __name__ == "__main__":
+    __main__()
@@ -2,22 +2,235 @@
 # Written by Christopher Mohr and released under the MIT license (2022).
 
 import argparse
-import csv
+import heapq
 import logging
 import os
+import re
+from array import array
+from collections import OrderedDict
 
+DEFAULT_NUM_CHUNKS = 10
+MAX_OPEN_FILES = 64
 
-def determine_split_size(input_file, size):
-    with open(input_file) as variants:
-        input_lines = variants.readlines()
-        num_variants = sum(1 for i in input_lines if not i.startswith("#"))
-    if not size:
-        return max(int(num_variants / 10), 1)
-    elif num_variants < size:
-        logging.warning("Provided split size larger than number of variants. Using default value.")
-        return max(int(num_variants / 10), 1)
-    else:
-        return size
+# field indices of SnpEff (ANN) annotations, VEP (CSQ) indices are read from the header if available
+SNPEFF_FIELDS = {"consequence": 1, "feature": 6, "hgvsp": 10}
+VEP_FIELDS = {"consequence": 1, "feature": 6, "cds_position": 13}
+VEP_FORMAT = re.compile(r"Format: ([^\"]+)")
+
+# frameshifts change the protein up to the next stop codon and yield more peptides than other variants
+FRAMESHIFT_WEIGHT = 3
+
+
+def read_vep_fields(line):
+    """
+    :param str line: CSQ INFO header line
+    :return: indices of the used VEP fields
+    """
+    match = VEP_FORMAT.search(line)
+    if not match:
+        return VEP_FIELDS
+    fields = [field.strip().lower() for field in match.group(1).split("|")]
+    return {name: fields.index(name) if name in fields else idx for name, idx in VEP_FIELDS.items()}
+
+
+def get_annotations(info, fields):
+    """
+    returns the coding annotations of one record, the same entries epaa.py generates mutated proteins for
+    :param str info: INFO column
+    :param dict fields: indices of the SnpEff and VEP fields
+    :return: list of (transcript ID, is frameshift) tuples
+    """
+    annotations = []
+    for entry in info.split(";"):
+        key, _, value = entry.partition("=")
+        if key == "ANN":
+            for annotation in value.split(","):
+                annotation = annotation.split("|")
+                if len(annotation) <= fields["ANN"]["hgvsp"] or not annotation[fields["ANN"]["hgvsp"]]:
+                    continue
+                consequence = annotation[fields["ANN"]["consequence"]]
+                if "stop_gained" not in consequence:
+                    annotations.append((annotation[fields["ANN"]["feature"]], "frameshift" in consequence))
+            return annotations
+        if key == "CSQ":
+            max_index = max(fields["CSQ"].values())
+            for annotation in value.split(","):
+                annotation = annotation.split("|")
+                if len(annotation) <= max_index or not annotation[fields["CSQ"]["cds_position"]]:
+                    continue
+                # epaa.py queries transcripts without version
+                transcript_id = annotation[fields["CSQ"]["feature"]].partition(".")[0]
+                annotations.append((transcript_id, "frameshift" in annotation[fields["CSQ"]["consequence"]]))
+            return annotations
+    return annotations
+
+
+def get_workload(annotations, num_alternatives):
+    """
+    :param list annotations: coding annotations (see get_annotations)
+    :param int num_alternatives: number of alternative alleles
+    :return: expected number of mutated proteins to generate peptides from, weighted by the variant consequence
+    """
+    return num_alternatives * sum(FRAMESHIFT_WEIGHT if frameshift else 1 for _, frameshift in annotations)
+
+
+class ChunkWriter:
+    """
+    writes records to chunk files as they are read, a limited number of chunk files is kept open
+    records of one chunk are numbered, to restore the input order when chunks are merged
+    """
+
+    def __init__(self, output_base, header):
+        self.output_base = output_base
+        self.header = header
+        self.files = OrderedDict()
+        self.records = []
+        self.workloads = []
+
+    def filename(self, chunk):
+        return f"{self.output_base}_part_{chunk}.vcf"
+
+    def new_chunk(self):
+        chunk = len(self.records)
+        with open(self.filename(chunk), "w") as output_file:
+            output_file.writelines(self.header)
+        self.records.append(array("Q"))
+        self.workloads.append(0)
+        return chunk
+
+    def write(self, chunk, index, line, workload):
+        if chunk in self.files:
+            self.files.move_to_end(chunk)
+        else:
+            if len(self.files) >= MAX_OPEN_FILES:
+                self.files.popitem(last=False)[1].close()
+            self.files[chunk] = open(self.filename(chunk), "a")
+        self.files[chunk].write(line)
+        self.records[chunk].append(index)
+        self.workloads[chunk] += workload
+
+    def close(self):
+        for output_file in self.files.values():
+            output_file.close()
+        self.files.clear()
+
+    def read_records(self, chunk):
+        with open(self.filename(chunk)) as input_file:
+            records = (line for line in input_file if not line.startswith("#"))
+            yield from zip(self.records[chunk], records)
+        os.remove(self.filename(chunk))
+
+    def merge(self, chunks, filename):
+        """
+        merges chunk files into one file, records are k-way merged in the order of the input file
+        :param list chunks: chunks to merge
+        :param str filename: name of the merged file
+        """
+        merged = heapq.merge(*[self.read_records(chunk) for chunk in chunks])
+        with open(filename + ".tmp", "w") as output_file:
+            output_file.writelines(self.header)
+            output_file.writelines(line for _, line in merged)
+        os.replace(filename + ".tmp", filename)
+
+
+def find(groups, chunk):
+    # chunks are merged into the chunk with the lowest number
+    while groups[chunk] != chunk:
+        groups[chunk] = groups[groups[chunk]]
+        chunk = groups[chunk]
+    return chunk
+
+
+def split_vcf(input_file, output_base, size=None, distance=0, total_bytes=0):
+    """
+    splits a VCF file into chunks while reading it, variants of the same transcript are always written into the same
+    chunk and chunks are balanced by the expected peptide workload (see get_workload)
+    a record with known transcripts is written to their chunk, chunks are merged if a record links transcripts of
+    different chunks, a new chunk is started when the current chunk reaches the target workload
+    :param input_file: VCF file handle
+    :param str output_base: base name of the chunk files
+    :param int size: number of variants of average workload per chunk, 1/10 of the estimated workload otherwise
+    :param int distance: records without coding annotations stay in the chunk of the previous record if they are
+                         within this distance on the same chromosome
+    :param int total_bytes: size of the input file, used to estimate the total workload
+    :return: list of chunk files
+    """
+    header = []
+    fields = {"ANN": SNPEFF_FIELDS, "CSQ": VEP_FIELDS}
+    writer = None
+    transcript_chunks = {}
+    groups = []
+    current = None
+    previous = (None, 0)
+    bytes_read = 0
+    num_records = 0
+    total_workload = 0
+
+    for line in input_file:
+        bytes_read += len(line)
+        if line.startswith("#"):
+            if line.startswith("##INFO=<ID=CSQ,"):
+                fields["CSQ"] = read_vep_fields(line)
+            header.append(line)
+            continue
+        if writer is None:
+            writer = ChunkWriter(output_base, header)
+        if not line.endswith("\n"):
+            line += "\n"
+
+        columns = line.split("\t", 8)
+        annotations = get_annotations(columns[7], fields)
+        workload = get_workload(annotations, len(columns[4].split(",")))
+        num_records += 1
+        total_workload += workload
+        position = (columns[0], int(columns[1]))
+
+        chunks = {find(groups, transcript_chunks[t]) for t, _ in annotations if t in transcript_chunks}
+        if chunks:
+            chunk = min(chunks)
+            for other in chunks - {chunk}:
+                groups[other] = chunk
+                writer.workloads[chunk] += writer.workloads[other]
+            if current is not None and find(groups, current) != current:
+                current = chunk
+        else:
+            # target workload of the current chunk, extrapolated from the workload read so far
+            if size:
+                target = size * total_workload / num_records
+            else:
+                target = total_workload * max(total_bytes, bytes_read) / bytes_read / DEFAULT_NUM_CHUNKS
+            nearby = not annotations and position[0] == previous[0] and position[1] < previous[1] + distance
+            if current is None or (writer.workloads[current] + workload > target and not nearby):
+                current = writer.new_chunk()
+                groups.append(current)
+            chunk = current
+        for transcript_id, _ in annotations:
+            transcript_chunks.setdefault(transcript_id, chunk)
+        writer.write(chunk, num_records, line, workload)
+        previous = position
+
+    if writer is None:
+        logging.warning("No variants found in input file.")
+        return []
+    writer.close()
+
+    # merge linked chunks and number the resulting chunks consecutively
+    members = {}
+    for chunk in range(len(groups)):
+        members.setdefault(find(groups, chunk), []).append(chunk)
+    filenames = []
+    for number, (chunk, group) in enumerate(members.items(), 1):
+        filename = f"{output_base}_chunk_{number}.vcf"
+        if len(group) > 1:
+            writer.merge(group, filename)
+        else:
+            os.replace(writer.filename(chunk), filename)
+        filenames.append(filename)
+    workloads = [writer.workloads[chunk] for chunk in members]
+    logging.info(
+        f"Split {num_records} variants into {len(filenames)} chunks, workloads {min(workloads)}-{max(workloads)}"
+    )
+    return filenames
 
 
 def main():
@@ -35,7 +248,7 @@ def main():
         metavar="N",
         type=int,
         required=False,
-        help="Number of variants that should be written into one file. Default: number of variants / 10",
+        help="Number of variants (of average peptide workload) that should be written into one file. Default: one tenth of the workload",
     )
     parser.add_argument(
         "-d",
@@ -43,48 +256,21 @@ def main():
         metavar="N",
         type=int,
         default=110000,
-        help="Number of nucleotides between previous and current variant. Default: 110000",
+        help="Number of nucleotides between previous and current variant without coding annotation across split. Default: 110000",
     )
     parser.add_argument("-o", "--output", metavar="N", help="Output directory")
 
     args = parser.parse_args()
 
-    split_size = determine_split_size(args.input, args.size)
-    file_name = args.input.split(".")[0]
-    var_group_count = 0
-    file_count = 1
-    metadata = ""
-    var_group = ""
-
+    file_name = os.path.basename(args.input).split(".")[0]
     with open(args.input) as input_file:
-        vcf_file = csv.reader(input_file, delimiter="\t")
-
-        for line in vcf_file:
-            if line[0].startswith("#"):
-                metadata += ("\t").join(line)
-                metadata += "\n"
-            else:
-                var_group += ("\t").join(line)
-                var_group += "\n"
-                # Get chromosome and positional information of the transcript
-                transcript = (line[0], int(line[1]))
-                # Check if the current number of saved variants is lower the number of desired variants per split
-                if var_group_count < split_size:
-                    var_group_count += 1
-                # Check if previous variant might be in the same transcript by checking chr and pos information
-                elif transcript[0] == previous_transcript[0] and transcript[1] < previous_transcript[1] + args.distance:
-                    var_group_count += 1
-                # write split to new VCF file
-                else:
-                    with open(os.path.join(args.output, f"{file_name}_chunk_{file_count}.vcf"), "w") as output_file:
-                        output_file.write(metadata + var_group)
-                        var_group = ""
-                        var_group_count = 0
-                        file_count += 1
-                previous_transcript = transcript
-        if var_group:
-            with open(os.path.join(args.output, f"{file_name}_chunk_{file_count}.vcf"), "w") as output_file:
-                output_file.write(metadata + var_group)
+        split_vcf(
+            input_file,
+            os.path.join(args.output, file_name),
+            args.size,
+            args.distance,
+            os.path.getsize(args.input),
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,50 @@
+process BUILD_KMER_INDEX {
+    label 'process_low'
+
+    conda "bioconda::epytope=3.3.1"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://depot.galaxyproject.org/singularity/epytope:3.3.1--pyh7cba7a3_0' :
+        'biocontainers/epytope:3.3.1--pyh7cba7a3_0' }"
+
+    input:
+    path proteome
+
+    output:
+    path "kmer_index", emit: index
+    path "versions.yml", emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    // the index covers the peptide lengths of both MHC classes
+    def min_length = [params.min_peptide_length, params.min_peptide_length_class2].min()
+    def max_length = [params.max_peptide_length, params.max_peptide_length_class2].max()
+
+    """
+    build_kmer_index.py --input ${proteome} \\
+        --output kmer_index \\
+        --min_length ${min_length} \\
+        --max_length ${max_length}
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version 2>&1 | sed 's/Python //g')
+        numpy: \$(python -c "import numpy; print(numpy.__version__)")
+        biopython: \$(python -c "import Bio; print(Bio.__version__)")
+    END_VERSIONS
+    """
+
+    stub:
+    """
+    mkdir kmer_index
+    touch kmer_index/kmer_index.json
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version 2>&1 | sed 's/Python //g')
+        numpy: \$(python -c "import numpy; print(numpy.__version__)")
+        biopython: \$(python -c "import Bio; print(Bio.__version__)")
+    END_VERSIONS
+    """
+}
@@ -21,12 +21,14 @@ process EPYTOPE_GENERATE_PEPTIDES {
     def prefix = task.ext.suffix ? "${meta.sample}_${task.ext.suffix}" : "${meta.sample}_peptides"
     def min_length = (meta.mhc_class == "I") ? params.min_peptide_length : params.min_peptide_length_class2
     def max_length = (meta.mhc_class == "I") ? params.max_peptide_length : params.max_peptide_length_class2
+    def max_memory = params.peptide_generation_memory ? "--max_memory ${params.peptide_generation_memory}" : ""
 
     """
     gen_peptides.py --input ${raw} \\
     --max_length ${max_length} \\
     --min_length ${min_length} \\
     --output '${prefix}.tsv' \\
+    ${max_memory} \\
     $task.ext.args
 
     cat <<-END_VERSIONS > versions.yml
@@ -1,16 +1,17 @@
 process EPYTOPE_PEPTIDE_PREDICTION {
     label 'process_low'
 
-    conda "conda-forge::coreutils=9.1 conda-forge::tcsh=6.20.00 bioconda::epytope=3.1.0 conda-forge::gawk=5.1.0 conda-forge::perl=5.32.1"
+    conda "conda-forge::coreutils=9.1 conda-forge::tcsh=6.20.00 bioconda::epytope=3.1.0 conda-forge::gawk=5.1.0 conda-forge::perl=5.32.1 conda-forge::pyarrow=12.0.1"
     container 'ghcr.io/jonasscheid/epitopeprediction-2:0.3.0'
 
     input:
     tuple val(meta), path(splitted), path(software_versions)
     val netmhc_paths
+    path kmer_index
 
     output:
     tuple val(meta), path("*.json"), emit: json
-    tuple val(meta), path("*.tsv"), emit: predicted, optional: true
+    tuple val(meta), path("*.{tsv,parquet,feather}"), emit: predicted, optional: true
     tuple val(meta), path("*.fasta"), emit: fasta, optional: true
     path "versions.yml", emit: versions
 
@@ -22,8 +23,12 @@ process EPYTOPE_PEPTIDE_PREDICTION {
     // Argument list needs to end with --peptides or --somatic_mutation
     def argument = task.ext.args
 
-    if (params.proteome) {
-        argument = "--proteome ${params.proteome} " + argument
+    if (params.filter_self) {
+        argument = "--filter_self --reference_proteome ${kmer_index} " + argument
+    }
+
+    if (params.local_reference) {
+        argument = "--local_reference ${params.local_reference} " + argument
     }
 
     if (params.wild_type) {
@@ -34,6 +39,14 @@ process EPYTOPE_PEPTIDE_PREDICTION {
         argument = "--fasta_output " + argument
     }
 
+    if (params.output_format != "tsv") {
+        argument = "--output_format ${params.output_format} " + argument
+    }
+
+    if (params.report_sketch != "list") {
+        argument = "--report_sketch ${params.report_sketch} " + argument
+    }
+
     if (params.tool_thresholds) {
         argument = "--tool_thresholds ${params.tool_thresholds} " + argument
     }
@@ -42,6 +55,10 @@ process EPYTOPE_PEPTIDE_PREDICTION {
         argument = "--use_affinity_thresholds " + argument
     }
 
+    if (params.prediction_cache) {
+        argument = "--prediction_cache ${params.prediction_cache} --prediction_cache_size ${params.prediction_cache_size} " + argument
+    }
+
     def netmhc_paths_string = netmhc_paths.join(",")
     def tools_split = params.tools.split(',')
     // TODO: Move to nf-validation
@@ -77,6 +94,7 @@ process EPYTOPE_PEPTIDE_PREDICTION {
         --max_length ${max_length} \
         --min_length ${min_length} \
         --versions ${software_versions} \
+        --num_workers ${task.cpus} \
         ${argument} ${splitted}
 
     cat <<-END_VERSIONS > versions.yml
@@ -85,6 +103,7 @@ process EPYTOPE_PEPTIDE_PREDICTION {
         epytope: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('epytope').version)")
         pandas: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('pandas').version)")
         pyvcf: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('PyVCF3').version)")
+        pyarrow: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('pyarrow').version)" 2>/dev/null || echo "not installed")
         mhcflurry: \$(mhcflurry-predict --version 2>&1 | sed 's/^mhcflurry //; s/ .*\$//')
         mhcnuggets: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('mhcnuggets').version)")
     END_VERSIONS
@@ -93,7 +112,7 @@ process EPYTOPE_PEPTIDE_PREDICTION {
     stub:
     """
     touch ${splitted.baseName}.json
-    touch ${splitted.baseName}.tsv
+    touch ${splitted.baseName}.${params.output_format}
     touch ${splitted.baseName}.fasta
 
     cat <<-END_VERSIONS > versions.yml
@@ -102,6 +121,7 @@ process EPYTOPE_PEPTIDE_PREDICTION {
         epytope: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('epytope').version)")
         pandas: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('pandas').version)")
         pyvcf: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('PyVCF3').version)")
+        pyarrow: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('pyarrow').version)" 2>/dev/null || echo "not installed")
         mhcflurry: \$(mhcflurry-predict --version 2>&1 | sed 's/^mhcflurry //; s/ .*\$//')
         mhcnuggets: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('mhcnuggets').version)")
     END_VERSIONS
@@ -1,10 +1,8 @@
 process MERGE_JSON {
     label 'process_low'
 
-    conda "conda-forge::python=3.8.3"
-    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
-        'https://depot.galaxyproject.org/singularity/python:3.8.3' :
-        'biocontainers/python:3.8.3' }"
+    conda "conda-forge::python=3.8.3 conda-forge::pandas=1.5.3"
+    container 'ghcr.io/jonasscheid/epitopeprediction-2:0.3.0'
 
     input:
     tuple val(meta), path(json)
@@ -22,11 +20,12 @@ process MERGE_JSON {
         argument += " ${json}"
     }
     """
-    merge_jsons.py --prefix ${meta.sample} ${argument}
+    merge_jsons.py --prefix ${meta.sample} --num_workers ${task.cpus} ${argument}
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
         python: \$(python --version | sed 's/Python //g')
+        pandas: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('pandas').version)")
     END_VERSIONS
     """
 
@@ -37,6 +36,7 @@ process MERGE_JSON {
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
         python: \$(python --version | sed 's/Python //g')
+        pandas: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('pandas').version)")
     END_VERSIONS
     """
 }
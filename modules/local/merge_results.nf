@@ -0,0 +1,41 @@
+process MERGE_RESULTS {
+    label 'process_low'
+
+    conda "conda-forge::python=3.8.3 conda-forge::pandas=1.5.3 conda-forge::pyarrow=12.0.1"
+    container 'ghcr.io/jonasscheid/epitopeprediction-2:0.3.0'
+
+    input:
+    tuple val(meta), path(predicted)
+
+    output:
+    tuple val(meta), path("*.{tsv,parquet,feather}"), emit: predicted
+    path "versions.yml", emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    """
+    merge_results.py --input ${predicted} --prefix ${meta.sample} --output_format ${params.output_format} ${args}
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version 2>&1 | sed 's/Python //g')
+        pandas: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('pandas').version)")
+        pyarrow: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('pyarrow').version)")
+    END_VERSIONS
+    """
+
+    stub:
+    """
+    touch ${meta.sample}_prediction_result.${params.output_format}
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version 2>&1 | sed 's/Python //g')
+        pandas: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('pandas').version)")
+        pyarrow: \$(python -c "import pkg_resources; print(pkg_resources.get_distribution('pyarrow').version)")
+    END_VERSIONS
+    """
+}
@@ -18,10 +18,14 @@ process SPLIT_PEPTIDES {
 
     script:
     def prefix = task.ext.suffix ? "${peptide.baseName}_${task.ext.suffix}" : "${peptide.baseName}"
+    def weights = params.peptides_split_weights ? "--weights ${params.peptides_split_weights}" : ""
 
     """
     split_peptides.py --input ${peptide} \\
     --output_base "${prefix}" \\
+    --alleles '${meta.alleles}' \\
+    --tools '${params.tools}' \\
+    ${weights} \\
     $task.ext.args
 
     cat <<-END_VERSIONS > versions.yml
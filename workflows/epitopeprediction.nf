@@ -17,6 +17,7 @@ include { VARIANT_SPLIT
 include { SNPSIFT_SPLIT                                                            } from '../modules/local/snpsift_split'
 
 include { EPYTOPE_GENERATE_PEPTIDES                                                } from '../modules/local/epytope_generate_peptides'
+include { BUILD_KMER_INDEX                                                         } from '../modules/local/build_kmer_index'
 include { SPLIT_PEPTIDES as SPLIT_PEPTIDES_PEPTIDES                                } from '../modules/local/split_peptides'
 include { SPLIT_PEPTIDES as SPLIT_PEPTIDES_PROTEIN                                 } from '../modules/local/split_peptides'
 
@@ -27,6 +28,7 @@ include { EPYTOPE_PEPTIDE_PREDICTION as EPYTOPE_PEPTIDE_PREDICTION_VAR
 include { CAT_FILES as CAT_TSV                                                     } from '../modules/local/cat_files'
 include { CAT_FILES as CAT_FASTA                                                   } from '../modules/local/cat_files'
 include { CSVTK_CONCAT                                                             } from '../modules/local/csvtk_concat'
+include { MERGE_RESULTS                                                            } from '../modules/local/merge_results'
 
 include { MERGE_JSON as MERGE_JSON_SINGLE                                          } from '../modules/local/merge_json'
 include { MERGE_JSON as MERGE_JSON_MULTI                                           } from '../modules/local/merge_json'
@@ -305,6 +307,19 @@ workflow EPITOPEPREDICTION {
     )
     ch_versions = ch_versions.mix( SPLIT_PEPTIDES_PEPTIDES.out.versions )
 
+    // build the k-mer index of the reference proteome once for self-filtering
+    if (params.filter_self) {
+        if (!params.proteome) { exit 1, "Self-filtering requires a reference proteome (--proteome)." }
+        BUILD_KMER_INDEX(
+            file(params.proteome, checkIfExists: true)
+        )
+        ch_kmer_index = BUILD_KMER_INDEX.out.index.collect()
+        ch_versions = ch_versions.mix(BUILD_KMER_INDEX.out.versions)
+    }
+    else {
+        ch_kmer_index = []
+    }
+
     /*
     ========================================================================================
         RUN EPITOPE PREDICTION
@@ -319,7 +334,8 @@ workflow EPITOPEPREDICTION {
             .splitted
             .combine( ch_prediction_tool_versions )
             .transpose(),
-            EXTERNAL_TOOLS_IMPORT.out.nonfree_tools.collect().ifEmpty([])
+            EXTERNAL_TOOLS_IMPORT.out.nonfree_tools.collect().ifEmpty([]),
+            ch_kmer_index
     )
     ch_versions = ch_versions.mix( EPYTOPE_PEPTIDE_PREDICTION_PROTEIN.out.versions )
 
@@ -331,7 +347,8 @@ workflow EPITOPEPREDICTION {
             .splitted
             .combine( ch_prediction_tool_versions )
             .transpose(),
-            EXTERNAL_TOOLS_IMPORT.out.nonfree_tools.collect().ifEmpty([])
+            EXTERNAL_TOOLS_IMPORT.out.nonfree_tools.collect().ifEmpty([]),
+            ch_kmer_index
     )
     ch_versions = ch_versions.mix( EPYTOPE_PEPTIDE_PREDICTION_PEP.out.versions )
 
@@ -342,7 +359,8 @@ workflow EPITOPEPREDICTION {
             .splitted
             .combine( ch_prediction_tool_versions )
             .transpose(),
-            EXTERNAL_TOOLS_IMPORT.out.nonfree_tools.collect().ifEmpty([])
+            EXTERNAL_TOOLS_IMPORT.out.nonfree_tools.collect().ifEmpty([]),
+            ch_kmer_index
     )
     ch_versions = ch_versions.mix( EPYTOPE_PEPTIDE_PREDICTION_VAR.out.versions )
 
@@ -363,15 +381,23 @@ workflow EPITOPEPREDICTION {
         .set { ch_predicted_peptides }
 
     // Combine epitope prediction results
-    CAT_TSV(
-        ch_predicted_peptides.single
-    )
-    ch_versions = ch_versions.mix( CAT_TSV.out.versions )
+    if (params.output_format == 'tsv') {
+        CAT_TSV(
+            ch_predicted_peptides.single
+        )
+        ch_versions = ch_versions.mix( CAT_TSV.out.versions )
 
-    CSVTK_CONCAT(
-        ch_predicted_peptides.multi
-    )
-    ch_versions = ch_versions.mix( CSVTK_CONCAT.out.versions )
+        CSVTK_CONCAT(
+            ch_predicted_peptides.multi
+        )
+        ch_versions = ch_versions.mix( CSVTK_CONCAT.out.versions )
+    } else {
+        // columnar results are read and written with typed and dictionary-encoded columns
+        MERGE_RESULTS(
+            ch_predicted_peptides.single.mix( ch_predicted_peptides.multi )
+        )
+        ch_versions = ch_versions.mix( MERGE_RESULTS.out.versions )
+    }
 
     // Combine protein sequences
     CAT_FASTA(